@@ -0,0 +1,188 @@
+"""
+Load tests a `Client` against the bundled mock discord server, without a network connection.
+
+The mock server runs in a separate process and sends synthetic INTERACTION_CREATE events to the
+client at a fixed rate, or as fast as it can. A command answers every interaction, and the
+benchmark reports:
+
+- events handled per second, and the delay from the server sending an event to its handler starting
+- HTTP message queue depth, the time messages waited in the queue and the time each request took
+- the requests the server received, including how many were rate limited with a 429
+
+Events are generated from a fixed seed, so runs with the same options send the same events.
+
+Usage:
+    python benchmarks/gateway_load.py --events 5000 --rate 500
+    python benchmarks/gateway_load.py --events 20000 --rate 0 --respond direct --json results.json
+    python benchmarks/gateway_load.py --events 2000 --rate 100 --respond channel
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import discord_python as dp
+
+def createTimedEvent(rng, sequence):
+    # The monotonic clock is shared between processes, so the client can measure the delay.
+    t, d = dp.createInteractionEvent(rng, sequence, command_name="load")
+    d["data"]["options"].append({"name": "sent_at", "type": 10, "value": time.monotonic()})
+    return t, d
+
+def runServer(pipe, args):
+    async def run():
+        rate = args.rate if args.rate > 0 else None
+        server = dp.MockDiscordServer(event_rate=rate, event_count=args.events, event_factory=createTimedEvent,
+            route_limit=args.route_limit, global_limit=args.global_limit, seed=args.seed)
+        await server.start()
+        loop = asyncio.get_running_loop()
+
+        async def getStatistics():
+            return server.getStatistics()
+
+        def listenForCommands():
+            while True:
+                command = pipe.recv()
+                if command == "statistics":
+                    pipe.send(asyncio.run_coroutine_threadsafe(getStatistics(), loop).result())
+
+        threading.Thread(target=listenForCommands, daemon=True).start()
+        pipe.send(server.port)
+        await asyncio.Event().wait()
+    asyncio.run(run())
+
+class TimedMessage(dp.Message):
+    """
+    A `Message` that records how long it waited in the message queue and how long its request took.
+
+    """
+
+    def __init__(self, *args, results, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.results = results
+        self.queued_at = time.perf_counter()
+
+    async def performHTTPAction(self, http):
+        start = time.perf_counter()
+        await super().performHTTPAction(http)
+        self.results["queue_wait"].append(start - self.queued_at)
+        self.results["request_time"].append(time.perf_counter() - start)
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    return {
+        "p50": values[len(values) // 2] * 1000,
+        "p99": values[min(len(values) - 1, int(len(values) * 0.99))] * 1000,
+        "max": values[-1] * 1000,
+    }
+
+async def measure(args, port : int, pipe):
+    client = dp.Client(debug_level=logging.WARNING, quickConnect=True)
+    client.bot_token = "mock-token"
+    client.discord_http_api_base = f"http://127.0.0.1:{port}/api/v10"
+    client.discord_http_oauth_base = f"http://127.0.0.1:{port}/api/oauth2"
+    # Normally set by Client.eventHandler before the coroutines start.
+    client.reconnect = False
+
+    results = {"handled": 0, "dispatch_delay": [], "queue_wait": [], "request_time": [], "max_queue_depth": 0}
+
+    async def load(client : dp.Client, interaction : dp.Interaction):
+        results["dispatch_delay"].append(time.monotonic() - interaction.options[-1]["value"])
+        results["handled"] += 1
+        response = dp.InteractionResponseText(interaction, "Loaded.")
+        if args.respond == "direct":
+            await interaction.respond(response)
+        elif args.respond == "channel":
+            # Spread over a few channels, each with its own rate limit bucket.
+            channel_id = 500000000000000000 + results["handled"] % 4
+            url = client.discord_http_api_base + f"/channels/{channel_id}/messages"
+            client.messageQueue.append(TimedMessage(url=url, method=dp.HTTPMethods.POST, json=response.json["data"], client=client, results=results))
+        else:
+            client.messageQueue.append(TimedMessage(url=response.url, method=dp.HTTPMethods.POST, json=response.json, client=client, results=results))
+
+    client.registerApplicationCommand("load", dp.ApplicationCommandType.SUB_COMMAND, "Load test.", load)
+    await client.createWebsocketConnection(f"ws://127.0.0.1:{port}/gateway")
+    handler = asyncio.get_running_loop().create_task(client.runHandler())
+
+    start_cpu = time.process_time()
+    start = None
+    deadline = time.perf_counter() + args.timeout
+    while results["handled"] < args.events and time.perf_counter() < deadline:
+        if start == None and results["handled"]:
+            start = time.perf_counter()
+        results["max_queue_depth"] = max(results["max_queue_depth"], len(client.messageQueue))
+        await asyncio.sleep(0.01)
+    end = time.perf_counter()
+    # The queue is drained separately, so the event rate is not limited by the requests.
+    while client.messageQueue and time.perf_counter() < deadline:
+        results["max_queue_depth"] = max(results["max_queue_depth"], len(client.messageQueue))
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter()
+    cpu = time.process_time() - start_cpu
+
+    handler.cancel()
+    await asyncio.gather(handler, return_exceptions=True)
+    await client.ws.close()
+    await client.session.close()
+
+    pipe.send("statistics")
+    server = pipe.recv()
+    elapsed = end - (start or end)
+    return {
+        "events": args.events,
+        "rate": args.rate,
+        "respond": args.respond,
+        "handled": results["handled"],
+        "events_per_second": results["handled"] / elapsed if elapsed > 0 else None,
+        "dispatch_delay_ms": percentiles(results["dispatch_delay"]),
+        "max_queue_depth": results["max_queue_depth"],
+        "queue_wait_ms": percentiles(results["queue_wait"]),
+        "request_time_ms": percentiles(results["request_time"]),
+        "drain_seconds": drained - end,
+        "cpu_seconds": cpu,
+        "server": server,
+    }
+
+async def main(args):
+    parent_pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=runServer, args=(child_pipe, args), daemon=True)
+    server.start()
+    port = parent_pipe.recv()
+    try:
+        result = await measure(args, port, parent_pipe)
+    finally:
+        server.kill()
+
+    print(f"Events handled:   {result['handled']}/{result['events']}" + (f" at {result['events_per_second']:.0f}/s" if result["events_per_second"] else ""))
+    print("Dispatch delay:   p50 {p50:.2f}ms  p99 {p99:.2f}ms  max {max:.2f}ms".format(**result["dispatch_delay_ms"]) if result["handled"] else "Dispatch delay:   -")
+    print(f"Queue depth:      max {result['max_queue_depth']}, drained {result['drain_seconds']:.2f}s after the last event")
+    if result["queue_wait_ms"]["p50"] != None:
+        print("Queue wait:       p50 {p50:.2f}ms  p99 {p99:.2f}ms  max {max:.2f}ms".format(**result["queue_wait_ms"]))
+        print("Request time:     p50 {p50:.2f}ms  p99 {p99:.2f}ms  max {max:.2f}ms".format(**result["request_time_ms"]))
+    print(f"Server requests:  {result['server']['requests']} {result['server']['statuses']}, {result['server']['rate_limited']} rate limited")
+    print(f"CPU:              {result['cpu_seconds']:.2f}s")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=4)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load tests a Client against a local mock discord server.")
+    parser.add_argument("--events", type=int, default=5000, help="The amount of interactions sent.")
+    parser.add_argument("--rate", type=float, default=500, help="Interactions sent per second, or 0 for as fast as possible.")
+    parser.add_argument("--respond", choices=["queue", "direct", "channel"], default="queue",
+        help="Respond through the message queue, with Interaction.respond(), or with a channel message through the queue.")
+    parser.add_argument("--route-limit", type=int, default=5, help="Requests allowed per route every 5 seconds.")
+    parser.add_argument("--global-limit", type=int, default=50, help="Requests allowed per second across routes with a global limit.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed used to generate events.")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the events to be handled.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,136 @@
+"""
+Replays a gateway recording through a `Client`, to benchmark decoding and dispatching gateway events.
+
+Recordings are made with `Client.recordGateway()`. Each frame is fed through `websocketListener`, so
+it is decoded and dispatched exactly as if it had been received from the gateway. Interactions for
+commands that are not registered are not dispatched, so pass the names of the commands in the
+recording with `--commands` to include the cost of creating each `Interaction` and starting its task.
+
+Replaying as fast as possible (`--speed 0`) measures throughput. Replaying at the recorded speed
+(`--speed 1`) shows how far behind the client falls during bursts such as a READY storm.
+
+A synthetic recording of a READY storm can be generated when no real recording is available.
+
+Usage:
+    python benchmarks/gateway_replay.py --generate storm.gz --guilds 2000 --events 20000
+    python benchmarks/gateway_replay.py storm.gz --speed 0 --repeat 5 --json results.json
+    python benchmarks/gateway_replay.py shard0.gz --speed 1 --commands play,skip
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import discord_python as dp
+
+def generateRecording(path : str, guilds : int, events : int, duration : float, seed : int):
+    """
+    Writes a recording of READY, a GUILD_CREATE for every guild in the first few seconds, then a mix of
+    messages and interactions spread over `duration` seconds.
+
+    """
+    rng = random.Random(seed)
+    frames = [(0.0, json.dumps({"op": 10, "d": {"heartbeat_interval": 41250}, "s": None, "t": None}))]
+    sequence = 1
+    frames.append((0.05, json.dumps({"op": 0, "s": sequence, "t": "READY", "d": {
+        "v": 10,
+        "user": {"id": "100000000000000002", "username": "recorded-bot", "discriminator": "0", "bot": True},
+        "guilds": [{"id": str(300000000000000000 + index), "unavailable": True} for index in range(guilds)],
+        "session_id": "recorded-session",
+        "resume_gateway_url": "wss://gateway.discord.gg",
+        "application": {"id": "100000000000000001", "flags": 0},
+    }})))
+    for index in range(guilds):
+        sequence += 1
+        t, d = dp.createGuildCreateEvent(rng, index, members=rng.randrange(10, 300))
+        frames.append((0.1 + index * 0.002, json.dumps({"op": 0, "s": sequence, "t": t, "d": d})))
+    start = frames[-1][0]
+    for index in range(events):
+        sequence += 1
+        if rng.random() < 0.2:
+            t, d = dp.createInteractionEvent(rng, sequence)
+        else:
+            t, d = dp.createMessageEvent(rng, sequence)
+        frames.append((start + duration * index / max(1, events), json.dumps({"op": 0, "s": sequence, "t": t, "d": d})))
+    dp.writeRecording(path, frames)
+    print(f"Wrote {len(frames)} frames ({os.path.getsize(path) / 1e6:.1f}MB compressed) to {path}")
+
+async def replay(args):
+    frames = list(dp.readRecording(args.recording))
+    size = sum(len(data) for _, data in frames)
+    types = {}
+    for _, data in frames:
+        t = json.loads(data).get("t") or "op"
+        types[t] = types.get(t, 0) + 1
+    print(f"{len(frames)} frames, {size / 1e6:.1f}MB uncompressed, {frames[-1][0] - frames[0][0]:.1f}s recorded")
+
+    client = dp.Client(debug_level=logging.WARNING, quickConnect=True)
+    client.bot_token = "replay-token"
+    # Only the listener is run, so the other gateway coroutines are not needed.
+    for function in client.functions:
+        function.close()
+    dispatched = {"count": 0}
+
+    async def command(client : dp.Client, interaction : dp.Interaction):
+        dispatched["count"] += 1
+
+    for name in args.commands:
+        client.registerApplicationCommand(name, dp.ApplicationCommandType.SUB_COMMAND, "Replayed.", command)
+
+    speed = args.speed if args.speed > 0 else None
+    runs = []
+    for _ in range(args.repeat):
+        dispatched["count"] = 0
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        await dp.replayRecording(client, frames, speed)
+        # Let the dispatched callbacks run, so their tasks are included.
+        await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - start_cpu
+        runs.append({"seconds": elapsed, "cpu_seconds": cpu, "frames_per_second": len(frames) / elapsed,
+            "megabytes_per_second": size / 1e6 / elapsed, "interactions_dispatched": dispatched["count"]})
+        print(f"  {elapsed:8.3f}s  {len(frames) / elapsed:10.0f} frames/s  {size / 1e6 / elapsed:7.1f}MB/s  cpu {cpu:.3f}s  dispatched {dispatched['count']}")
+
+    seconds = [run["seconds"] for run in runs]
+    result = {
+        "recording": args.recording,
+        "frames": len(frames),
+        "bytes": size,
+        "event_types": types,
+        "speed": args.speed,
+        "runs": runs,
+        "best_seconds": min(seconds),
+        "median_seconds": statistics.median(seconds),
+    }
+    print(f"Best {min(seconds):.3f}s, median {statistics.median(seconds):.3f}s")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=4)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays a gateway recording through a Client.")
+    parser.add_argument("recording", nargs="?", help="The recording to replay.")
+    parser.add_argument("--speed", type=float, default=0, help="Times faster than recorded to replay, or 0 for as fast as possible.")
+    parser.add_argument("--repeat", type=int, default=3, help="The amount of times to replay the recording.")
+    parser.add_argument("--commands", default="ping", help="Comma separated command names to register, so their interactions are dispatched.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--generate", help="Write a synthetic READY storm recording to this file instead of replaying.")
+    parser.add_argument("--guilds", type=int, default=1000, help="Guilds in the generated READY.")
+    parser.add_argument("--events", type=int, default=10000, help="Messages and interactions generated after the guilds.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds the generated messages and interactions are spread over.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed used to generate the recording.")
+    args = parser.parse_args()
+    args.commands = [name for name in args.commands.split(",") if name]
+    if args.generate:
+        generateRecording(args.generate, args.guilds, args.events, args.duration, args.seed)
+    elif args.recording:
+        asyncio.run(replay(args))
+    else:
+        parser.error("Give a recording to replay, or --generate.")
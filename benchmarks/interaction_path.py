@@ -0,0 +1,246 @@
+"""
+Microbenchmarks each stage of handling an interaction, from the gateway frame to the serialized response.
+
+Stages:
+
+- `json_decode`: decoding an INTERACTION_CREATE gateway frame, for a typical and a large payload
+- `command_lookup`: `Client.dispatchInteraction` scanning every registered command without a match
+- `dispatch`: `Client.dispatchInteraction` finding the last registered command and starting its task
+- `interaction_construction`: `Client.createInteraction`
+- `response_text_json`: `InteractionResponseText.generateJSON` with an embed and a row of buttons
+- `embed_json`: `Embed.generateJSON` with an author, footer and 10 fields
+- `message_serialization`: serializing a response to a request body, as aiohttp does for `Message`
+- `template_render`: `ResponseTemplate.render`, for comparison with building and serializing a response
+
+Each stage is timed with enough loops to take at least `--min-time` seconds, repeated `--repeat`
+times, and reported as nanoseconds per operation. The JSON report keeps the same format between
+versions, so a report can be compared with a previous one using `--compare`.
+
+Usage:
+    python benchmarks/interaction_path.py --json baseline.json
+    python benchmarks/interaction_path.py --compare baseline.json --json current.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import discord_python as dp
+
+REPORT_FORMAT = 1
+
+def createLargeInteraction(rng : random.Random) -> dict:
+    # A command with many options and resolved users, as sent for user and channel options.
+    _, d = dp.createInteractionEvent(rng, 1)
+    d["data"]["options"] = [{"name": f"option-{index}", "type": 3, "value": "x" * rng.randrange(10, 100)} for index in range(20)]
+    d["data"]["resolved"] = {
+        "users": {str(200000000000000000 + index): {"id": str(200000000000000000 + index), "username": f"user{index}", "avatar": "a" * 32,
+            "discriminator": "0", "public_flags": 0} for index in range(10)},
+        "members": {str(200000000000000000 + index): {"roles": [str(600000000000000000 + role) for role in range(5)], "nick": None,
+            "joined_at": "2023-01-01T00:00:00.000000+00:00", "permissions": "562949953421311", "flags": 0} for index in range(10)},
+    }
+    return d
+
+def createEmbed() -> dp.Embed:
+    embed = dp.Embed("Server statistics", "Statistics for the last 7 days." * 3, url="https://example.com/stats",
+        image="https://example.com/chart.png", author=dp.Author("Stats bot", "https://example.com", "https://example.com/icon.png"),
+        footer_text="Updated hourly", footer_icon="https://example.com/footer.png")
+    for index in range(10):
+        embed.addField(dp.Field(f"Field {index}", f"Value {index} " * 5, inline=index % 2 == 0))
+    return embed
+
+def measure(function, min_time : float, repeat : int) -> dict:
+    """
+    Times `function`, which runs `loops` operations when called with `loops`.
+
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        function(loops)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+    timings = [elapsed / loops * 1e9]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        function(loops)
+        timings.append((time.perf_counter() - start) / loops * 1e9)
+    return {
+        "ns_per_op_min": min(timings),
+        "ns_per_op_median": statistics.median(timings),
+        "ops_per_second": 1e9 / min(timings),
+        "loops": loops,
+        "repeats": repeat,
+    }
+
+def runBenchmarks(args) -> dict:
+    rng = random.Random(args.seed)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    client = dp.Client(debug_level=logging.WARNING)
+    for function in client.functions:
+        function.close()
+    client.bot_token = "benchmark-token"
+    client.application_id = "100000000000000001"
+
+    async def callback(client, interaction):
+        pass
+
+    for index in range(args.commands):
+        client.registerApplicationCommand(f"command-{index}", dp.ApplicationCommandType.SUB_COMMAND, "Benchmark.", callback)
+
+    _, typical = dp.createInteractionEvent(rng, 1, command_name=f"command-{args.commands - 1}")
+    large = createLargeInteraction(rng)
+    typical_frame = json.dumps({"op": 0, "s": 1, "t": "INTERACTION_CREATE", "d": typical})
+    large_frame = json.dumps({"op": 0, "s": 1, "t": "INTERACTION_CREATE", "d": large})
+    unknown = dict(typical, data=dict(typical["data"], name="unknown-command"))
+
+    interaction = client.createInteraction(typical)
+    response = dp.InteractionResponseText(interaction, "Here are your statistics.")
+    response.addEmbed(createEmbed())
+    row = dp.ActionRow(client)
+    for index in range(3):
+        row.addComponent(dp.Button(f"Page {index}", dp.ButtonStyle.BLURPLE, client, f"page-{index}", callback=callback))
+    response.addActionRow(row)
+    response_json = response.generateJSON()
+    embed = createEmbed()
+
+    template_interaction = dp.Interaction(None, None, None, None, None)
+    template_response = dp.InteractionResponseText(template_interaction, "Hello " + dp.Slot("name") + "!")
+    template_response.addEmbed(dp.Embed(dp.Slot("title"), "Your score.", color=dp.Slot("color")))
+    template = dp.ResponseTemplate(template_response)
+
+    def jsonDecodeTypical(loops):
+        for _ in range(loops):
+            json.loads(typical_frame)
+
+    def jsonDecodeLarge(loops):
+        for _ in range(loops):
+            json.loads(large_frame)
+
+    def commandLookup(loops):
+        # dispatchInteraction needs a running event loop, even when no task is started.
+        async def run():
+            dispatch = client.dispatchInteraction
+            for _ in range(loops):
+                dispatch(unknown)
+        loop.run_until_complete(run())
+
+    def dispatchCommand(loops):
+        async def run():
+            dispatch = client.dispatchInteraction
+            for index in range(loops):
+                dispatch(typical)
+                if index % 1000 == 999:
+                    # Let the started tasks finish, so they do not build up.
+                    await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        loop.run_until_complete(run())
+
+    def interactionConstruction(loops):
+        create = client.createInteraction
+        for _ in range(loops):
+            create(typical)
+
+    def responseTextJSON(loops):
+        generate = response.generateJSON
+        for _ in range(loops):
+            generate()
+
+    def embedJSON(loops):
+        generate = embed.generateJSON
+        for _ in range(loops):
+            generate()
+
+    def messageSerialization(loops):
+        # aiohttp serializes the json argument of a request into a JsonPayload.
+        for _ in range(loops):
+            aiohttp.JsonPayload(response_json)
+
+    def templateRender(loops):
+        render = template.render
+        for _ in range(loops):
+            render(name="Jayden", title="Score: 10", color=5918163)
+
+    stages = [
+        ("json_decode_typical", jsonDecodeTypical, len(typical_frame)),
+        ("json_decode_large", jsonDecodeLarge, len(large_frame)),
+        ("command_lookup", commandLookup, None),
+        ("dispatch", dispatchCommand, None),
+        ("interaction_construction", interactionConstruction, None),
+        ("response_text_json", responseTextJSON, len(json.dumps(response_json))),
+        ("embed_json", embedJSON, len(json.dumps(embed.generateJSON()))),
+        ("message_serialization", messageSerialization, len(json.dumps(response_json))),
+        ("template_render", templateRender, len(template.render(name="Jayden", title="Score: 10", color=5918163))),
+    ]
+
+    results = {}
+    for name, function, payload_bytes in stages:
+        if args.stages and name not in args.stages:
+            continue
+        result = measure(function, args.min_time, args.repeat)
+        result["payload_bytes"] = payload_bytes
+        results[name] = result
+    loop.close()
+
+    return {
+        "format": REPORT_FORMAT,
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "registered_commands": args.commands,
+        "results": results,
+    }
+
+def printReport(report : dict, baseline : dict = None, threshold : float = 0.1):
+    header = f"{'stage':<26} {'min ns/op':>12} {'median ns/op':>13} {'ops/s':>12} {'bytes':>7}"
+    if baseline != None:
+        header += f" {'baseline':>12} {'change':>8}"
+    print(header)
+    for name, result in report["results"].items():
+        line = f"{name:<26} {result['ns_per_op_min']:>12.0f} {result['ns_per_op_median']:>13.0f} {result['ops_per_second']:>12.0f} {result['payload_bytes'] or '':>7}"
+        previous = baseline["results"].get(name) if baseline != None else None
+        if previous != None:
+            change = result["ns_per_op_min"] / previous["ns_per_op_min"] - 1
+            flag = "  slower" if change > threshold else "  faster" if change < -threshold else ""
+            line += f" {previous['ns_per_op_min']:>12.0f} {change:>+7.1%}{flag}"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks the stages of handling an interaction.")
+    parser.add_argument("--min-time", type=float, default=0.2, help="The minimum seconds each repeat of a stage runs for.")
+    parser.add_argument("--repeat", type=int, default=5, help="The amount of times each stage is timed.")
+    parser.add_argument("--commands", type=int, default=50, help="The amount of registered commands.")
+    parser.add_argument("--stages", help="Comma separated stages to run. Defaults to all of them.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed used to generate payloads.")
+    parser.add_argument("--json", help="Write the report to this file.")
+    parser.add_argument("--compare", help="A previous report to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="The relative change reported as slower or faster.")
+    args = parser.parse_args()
+    args.stages = args.stages.split(",") if args.stages else None
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get("format") != REPORT_FORMAT:
+            parser.error(f"{args.compare} has report format {baseline.get('format')}, expected {REPORT_FORMAT}.")
+
+    report = runBenchmarks(args)
+    printReport(report, baseline, args.threshold)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=4)
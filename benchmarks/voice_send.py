@@ -0,0 +1,294 @@
+"""
+Measures how many voice streams one process can send.
+
+A stand-in voice server runs in a separate process. It speaks enough of the voice gateway for a
+`VoiceClient` to connect, answers IP discovery, and records when each UDP packet arrives. This
+process connects the requested number of `VoiceClient`s to it and plays a synthetic Opus source on
+each, so FFmpeg is not involved. For each stream count it reports:
+
+- packets per second received by the server
+- pacing jitter: the p50/p99/max deviation of the gap between packets from 20ms
+- CPU used by this process per stream, as a percentage of one core
+
+The cost of each encryption mode is measured separately.
+
+With `--batch`, the connections share UDP sockets and each tick's packets are sent with one
+`sendmmsg` call (see `Client.batch_voice_udp`). A shared socket can only have one connection to each
+voice server address, so the stand-in server listens on several UDP ports and spreads the streams
+across them, as real voice servers are spread across many addresses.
+
+The stand-in server is a single Python process. At several hundred streams its own receive loop
+adds to the measured jitter and can drop packets from its socket buffer. Compare results from the
+same host, and treat the packet rate as a lower bound.
+
+Usage:
+    python benchmarks/voice_send.py --streams 1,10,50,100 --duration 5
+    python benchmarks/voice_send.py --streams 200 --mode xsalsa20_poly1305_lite --json results.json
+    python benchmarks/voice_send.py --streams 100,500 --batch
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import discord_python as dp
+
+# A 20ms CELT frame with a typical size for 128kbps music.
+OPUS_FRAME = bytes([0xFC]) + os.urandom(319)
+
+class VoiceServer():
+    """
+    The stand-in voice gateway and UDP server, run in its own process.
+
+    """
+
+    def __init__(self, mode : str, port_count : int) -> None:
+        self.mode = mode
+        self.port_count = port_count
+        self.udp_ports = []
+        self.arrivals = {}
+        self.next_ssrc = 1
+
+    async def handleWebsocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"op": 8, "d": {"heartbeat_interval": 13750}})
+        async for message in ws:
+            payload = json.loads(message.data)
+            if payload["op"] == 0:
+                ssrc = self.next_ssrc
+                self.next_ssrc += 1
+                self.arrivals[ssrc] = []
+                port = self.udp_ports[ssrc % len(self.udp_ports)]
+                await ws.send_json({"op": 2, "d": {"ssrc": ssrc, "ip": "127.0.0.1", "port": port, "modes": [self.mode]}})
+            elif payload["op"] == 1:
+                await ws.send_json({"op": 4, "d": {"mode": payload["d"]["data"]["mode"], "secret_key": list(range(32))}})
+            elif payload["op"] == 3:
+                await ws.send_json({"op": 6, "d": payload["d"]})
+        return ws
+
+    def datagram_received(self, transport, data, addr):
+        if len(data) == 74 and data[:2] == b'\x00\x01':
+            response = b'\x00\x02\x00\x46' + data[4:8] + addr[0].encode().ljust(64, b'\x00') + addr[1].to_bytes(2, "big")
+            transport.sendto(response, addr)
+            return
+        ssrc = int.from_bytes(data[8:12], "big")
+        times = self.arrivals.get(ssrc)
+        if times != None:
+            times.append(time.perf_counter())
+
+    def report(self, start : float, end : float):
+        # Pacing is measured from the gaps between packets of each stream, within the measured window.
+        deviations = []
+        packets = 0
+        for times in list(self.arrivals.values()):
+            window = [t for t in times if start <= t <= end]
+            packets += len(window)
+            deviations += [abs((b - a) - 0.02) * 1000 for a, b in zip(window, window[1:])]
+        deviations.sort()
+        def percentile(p):
+            return deviations[min(len(deviations) - 1, int(len(deviations) * p))] if deviations else None
+        return {
+            "packets": packets,
+            "packets_per_second": packets / (end - start),
+            "jitter_p50_ms": percentile(0.5),
+            "jitter_p99_ms": percentile(0.99),
+            "jitter_max_ms": deviations[-1] if deviations else None,
+        }
+
+    def listenForCommands(self, pipe, loop):
+        while True:
+            command = pipe.recv()
+            if command[0] == "report":
+                pipe.send(self.report(command[1], command[2]))
+            elif command[0] == "reset":
+                loop.call_soon_threadsafe(self.arrivals.clear)
+                pipe.send(None)
+
+    async def run(self, pipe):
+        loop = asyncio.get_running_loop()
+        server = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                server.datagram_received(self.transport, data, addr)
+
+        for _ in range(self.port_count):
+            transport, _ = await loop.create_datagram_endpoint(Protocol, local_addr=("127.0.0.1", 0))
+            self.udp_ports.append(transport.get_extra_info("sockname")[1])
+
+        app = web.Application()
+        app.router.add_get("/", self.handleWebsocket)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        ws_port = site._server.sockets[0].getsockname()[1]
+
+        threading.Thread(target=self.listenForCommands, args=(pipe, loop), daemon=True).start()
+        pipe.send(ws_port)
+        await asyncio.Event().wait()
+
+def runServer(pipe, mode, port_count):
+    asyncio.run(VoiceServer(mode, port_count).run(pipe))
+
+class SyntheticOpus():
+    """
+    An audio source that returns the same Opus frame until it is stopped.
+
+    """
+
+    start : float = 0
+
+    def __init__(self) -> None:
+        self.stopped = False
+
+    async def wait_until_ready(self, timeout : float = 5):
+        pass
+
+    def read(self):
+        return b'' if self.stopped else OPUS_FRAME
+
+    def stop(self):
+        self.stopped = True
+
+class BenchmarkClient():
+    """
+    Stands in for `Client`, answering each voice join with the stand-in server's address.
+
+    """
+
+    getVoiceScheduler = dp.Client.getVoiceScheduler
+    getVoiceSocketPool = dp.Client.getVoiceSocketPool
+    voice_scheduler = None
+    voice_socket_pool = None
+    streams_started : int = 0
+
+    def __init__(self, session, endpoint, batch_voice_udp : bool = False) -> None:
+        self.session = session
+        self.endpoint = endpoint
+        self.batch_voice_udp = batch_voice_udp
+        self.voice_clients = {}
+        self.logger = logging.getLogger("Logging")
+        self.ws = self
+
+    async def send_json(self, payload):
+        guild_id = payload["d"]["guild_id"]
+        if payload["d"]["channel_id"] == None:
+            # Leaving the channel.
+            return
+        voice_client = self.voice_clients[guild_id]
+        voice_client.voiceStateUpdate({"guild_id": guild_id, "user_id": "1", "session_id": f"session-{guild_id}", "channel_id": guild_id})
+        voice_client.voiceServerUpdate({"guild_id": guild_id, "endpoint": self.endpoint, "token": "token"})
+
+async def connectStreams(client, count : int, first_id : int):
+    voice_clients = []
+    for guild_id in range(first_id, first_id + count):
+        voice_client = dp.VoiceClient(str(guild_id), str(guild_id), False, False, client)
+        voice_client.websocket_scheme = "ws"
+        client.voice_clients[str(guild_id)] = voice_client
+        voice_clients.append(voice_client)
+    while not all(voice_client.ready and voice_client.encryption != None for voice_client in voice_clients):
+        await asyncio.sleep(0.05)
+    return voice_clients
+
+async def measureStreams(client, pipe, count : int, duration : float, warmup : float):
+    client.streams_started += count
+    voice_clients = await connectStreams(client, count, client.streams_started - count + 1)
+    sources = [SyntheticOpus() for _ in voice_clients]
+    tasks = [asyncio.get_running_loop().create_task(vc.do_play(source)) for vc, source in zip(voice_clients, sources)]
+
+    await asyncio.sleep(warmup)
+    scheduler = client.getVoiceScheduler()
+    late_ticks = scheduler.late_ticks
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    end = time.perf_counter()
+    cpu = time.process_time() - start_cpu
+    late_ticks = scheduler.late_ticks - late_ticks
+
+    for source in sources:
+        source.stop()
+    await asyncio.gather(*tasks)
+    for voice_client in voice_clients:
+        await voice_client.disconnect()
+
+    pipe.send(("report", start, end))
+    result = pipe.recv()
+    pipe.send(("reset",))
+    pipe.recv()
+    result.update({
+        "streams": count,
+        "expected_packets_per_second": count * 50,
+        "cpu_percent_per_stream": cpu / (end - start) / count * 100,
+        "cpu_percent_total": cpu / (end - start) * 100,
+        "late_ticks": late_ticks,
+    })
+    return result
+
+def measureEncryption(iterations : int = 20000):
+    header = bytes(12)
+    results = {}
+    for name, mode in dp.ENCRYPTION_MODES.items():
+        if name not in dp.PREFERRED_MODES:
+            continue
+        encryption = mode(bytes(32))
+        start = time.perf_counter()
+        for _ in range(iterations):
+            encryption.encrypt(header, OPUS_FRAME)
+        results[name] = (time.perf_counter() - start) / iterations * 1e6
+    return results
+
+async def main(args):
+    parent_pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=runServer, args=(child_pipe, args.mode, args.server_ports), daemon=True)
+    server.start()
+    ws_port = parent_pipe.recv()
+
+    results = {"mode": args.mode, "batch": args.batch, "encryption_us_per_packet": measureEncryption(), "runs": []}
+    print("Encryption cost per packet:")
+    for name, cost in results["encryption_us_per_packet"].items():
+        print(f"  {name:<36} {cost:7.2f}us")
+    print()
+    print(f"{'streams':>8} {'packets/s':>10} {'expected':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'cpu/stream':>11} {'late ticks':>11}")
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        client = BenchmarkClient(session, f"127.0.0.1:{ws_port}", args.batch)
+        for count in args.streams:
+            result = await measureStreams(client, parent_pipe, count, args.duration, args.warmup)
+            results["runs"].append(result)
+            print(f"{count:>8} {result['packets_per_second']:>10.0f} {result['expected_packets_per_second']:>9} "
+                f"{result['jitter_p50_ms'] or 0:>8.3f} {result['jitter_p99_ms'] or 0:>8.3f} {result['jitter_max_ms'] or 0:>8.3f} "
+                f"{result['cpu_percent_per_stream']:>10.3f}% {result['late_ticks']:>11}")
+
+    server.kill()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks sending voice audio to a local stand-in voice server.")
+    parser.add_argument("--streams", default="1,10,50,100", help="Comma separated stream counts to measure.")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds measured for each stream count.")
+    parser.add_argument("--warmup", type=float, default=1, help="Seconds played before measuring.")
+    parser.add_argument("--mode", default=dp.PREFERRED_MODES[0], help="The encryption mode offered by the server.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--batch", action="store_true", help="Send each tick's packets in batches through shared sockets.")
+    parser.add_argument("--server-ports", type=int, default=64, help="The amount of UDP ports the stand-in server spreads streams across.")
+    args = parser.parse_args()
+    args.streams = [int(count) for count in args.streams.split(",")]
+    logging.getLogger("Logging").setLevel(logging.WARNING)
+    asyncio.run(main(args))
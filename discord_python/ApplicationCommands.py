@@ -1,6 +1,7 @@
 # Registers application commands and syncs them.
 import aiohttp
 import asyncio
+from .Autocomplete import AutocompleteIndex
 
 from typing import (
     List
@@ -25,13 +26,18 @@ class ApplicationCommandOption():
     description : str = None
     required : bool = False
     choices : List[ApplicationCommandChoice] = []
+    autocomplete : AutocompleteIndex = None
 
-    def __init__(self, type, name, description, required=False) -> None:
+    def __init__(self, type, name, description, required=False, autocomplete : AutocompleteIndex = None) -> None:
         self.choices = []
         self.type = type
         self.name = name
         self.description = description
         self.required = required
+        self.autocomplete = autocomplete
+        if autocomplete != None:
+            # Built now rather than when the first user types into the option.
+            autocomplete.startBuild()
 
     def addChoice(self, choice : ApplicationCommandChoice):
         self.choices.append(choice)
@@ -40,6 +46,8 @@ class ApplicationCommandOption():
         json = []
         for choice in self.choices:
             json.append(choice.generateJSON())
+        if self.autocomplete != None:
+            return {"name": self.name, "description": self.description, "type": self.type, "required": self.required, "autocomplete": True}
         if json == []:
             return {"name": self.name, "description": self.description, "type": self.type, "required": self.required}
         return {"name": self.name, "description": self.description, "type": self.type, "required": self.required, "choices": json}
@@ -0,0 +1,131 @@
+# Allows files to be attached to messages and interaction responses.
+import asyncio
+import json
+import mimetypes
+import os
+import aiohttp
+
+from typing import (
+    List
+)
+
+CHUNK_SIZE : int = 256 * 1024
+
+class Attachment():
+    """
+    A file that is uploaded with a message or an interaction response. The contents are streamed into
+    the request in chunks when it is sent, so large files are never fully loaded into memory.
+
+    """
+
+    filename : str = None
+    source = None
+    description : str = None
+    content_type : str = None
+
+    def __init__(self, filename : str, source, description : str = None, content_type : str = None) -> None:
+        """
+        Creates an attachment.
+
+        Parameters
+        -------
+        filename: `str`
+            The name of the file shown in discord.
+        source: `str`
+            Where the contents of the file come from. This can be the path of a file on disk, a file object
+            opened in binary mode, `bytes` or a `memoryview`, or an async iterator of `bytes`.
+        description: `str`
+            The alt text of the file. (Max: 1024 characters)
+        content_type: `str`
+            The MIME type of the file. Defaults to a guess based on the filename.
+
+        Warning
+        -------
+        File objects and async iterators can only be read once, so an attachment using them can only be
+        sent once.
+
+        """
+        self.filename = filename
+        self.source = source
+        self.description = description
+        if content_type == None:
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        self.content_type = content_type
+
+    def generateJSON(self, id : int):
+        """
+        Generates the JSON describing this attachment in the payload of the message.
+
+        Returns
+        -------
+        :class:`Dict[]`
+            A dictionary representing the values to be translated into JSON.
+
+        """
+        if self.description == None:
+            return {"id": id, "filename": self.filename}
+        return {"id": id, "filename": self.filename, "description": self.description}
+
+    def getContents(self):
+        """
+        Returns the contents of the attachment in a form that aiohttp can stream.
+
+        """
+        if isinstance(self.source, (str, os.PathLike)):
+            return readFile(self.source)
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            return self.source
+        if hasattr(self.source, "read"):
+            return readFileObject(self.source)
+        return self.source
+
+async def readFileObject(file):
+    """
+    Reads a file object in chunks without blocking the event loop.
+
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, file.read, CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+async def readFile(path):
+    """
+    Opens and reads a file from disk in chunks without blocking the event loop.
+
+    """
+    loop = asyncio.get_running_loop()
+    file = await loop.run_in_executor(None, open, path, "rb")
+    try:
+        async for chunk in readFileObject(file):
+            yield chunk
+    finally:
+        file.close()
+
+def createMultipart(payload, attachments : List[Attachment]) -> aiohttp.MultipartWriter:
+    """
+    Creates the multipart body of a request with attachments. The JSON payload is sent in the
+    `payload_json` part, and each attachment is sent in its own part.
+
+    Parameters
+    -------
+    payload: `Dict[]`
+        The JSON of the message. This can also be JSON that has already been serialized to bytes.
+    attachments: `List[Attachment]`
+        The attachments to upload, in the same order as the `attachments` of the payload.
+
+    """
+    writer = aiohttp.MultipartWriter("form-data")
+
+    if not isinstance(payload, (bytes, bytearray)):
+        payload = json.dumps(payload).encode()
+    part = writer.append(payload, {"Content-Type": "application/json"})
+    part.set_content_disposition("form-data", name="payload_json")
+
+    for id, attachment in enumerate(attachments):
+        part = writer.append(attachment.getContents(), {"Content-Type": attachment.content_type})
+        part.set_content_disposition("form-data", name=f"files[{id}]", filename=attachment.filename)
+
+    return writer
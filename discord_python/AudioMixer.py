@@ -0,0 +1,188 @@
+# Mixes and adjusts the volume of PCM audio before it is encoded to Opus and sent.
+import array
+import asyncio
+import sys
+
+from typing import (
+    List
+)
+
+from .Opus import OpusEncoder, FRAME_BYTES, FRAME_SAMPLES, CHANNELS
+from .Voice import SILENCE_FRAME
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class MixerTrack():
+    """
+    A PCM source playing in a `PCMMixer`. Its volume can be changed while it plays.
+
+    """
+
+    source = None
+    volume : float = 1.0
+    finished : bool = False
+
+    def __init__(self, source, volume : float = 1.0) -> None:
+        self.source = source
+        self.volume = volume
+        self.finished = False
+
+    def setVolume(self, volume : float):
+        self.volume = max(volume, 0.0)
+
+    def stop(self):
+        self.finished = True
+        self.source.stop()
+
+class PCMMixer():
+    """
+    An audio source that mixes any number of PCM sources, such as `FFmpegPCM`, applies the volume
+    of each and encodes the result to Opus. Mixing is vectorized with NumPy when it is installed,
+    and encoding needs libopus.
+
+    """
+
+    tracks : List[MixerTrack] = []
+    volume : float = 1.0
+    keep_open : bool = False
+    stopped : bool = False
+    encoder : OpusEncoder = None
+    # A mixer always plays from its start, so its position is how long it has played for.
+    start : float = 0
+
+    def __init__(self, volume : float = 1.0, bitrate : int = 128000, keep_open : bool = False) -> None:
+        """
+        Creates a mixer. Pass it to `VoiceClient.play()` like any other source.
+
+        Parameters
+        -------
+        volume: `float`
+            The volume applied to the mixed audio, where 1.0 is unchanged.
+        bitrate: `int`
+            The bitrate of the Opus audio that is sent.
+        keep_open: `bool`
+            If True, the mixer keeps playing once every track has finished, so more tracks can be
+            added later. Otherwise it finishes with its last track.
+
+        Raises
+        -------
+        RuntimeError
+            Raised if libopus could not be loaded.
+
+        """
+        self.tracks = []
+        self.volume = volume
+        self.keep_open = keep_open
+        self.stopped = False
+        self.encoder = OpusEncoder(bitrate)
+        if numpy != None:
+            # Buffers reused for every frame, so mixing does not allocate.
+            self.mix = numpy.zeros(FRAME_SAMPLES * CHANNELS, dtype=numpy.float32)
+            self.scaled = numpy.zeros(FRAME_SAMPLES * CHANNELS, dtype=numpy.float32)
+            self.output = numpy.zeros(FRAME_SAMPLES * CHANNELS, dtype="<i2")
+
+    def addSource(self, source, volume : float = 1.0) -> MixerTrack:
+        """
+        Starts playing a PCM source in the mix.
+
+        Returns
+        -------
+        :class:`MixerTrack`
+            The track, which can be used to change the volume of the source or stop it.
+
+        """
+        track = MixerTrack(source, volume)
+        self.tracks.append(track)
+        return track
+
+    def setVolume(self, volume : float):
+        self.volume = max(volume, 0.0)
+
+    async def wait_until_ready(self, timeout : float = 5):
+        await asyncio.gather(*(track.source.wait_until_ready(timeout) for track in self.tracks))
+
+    def read_frames(self) -> List:
+        # Reads the next frame of every track, dropping tracks that have finished. A track that has
+        # not read its next frame yet is left out of this frame of the mix.
+        frames = []
+        for track in self.tracks[:]:
+            if track.finished:
+                self.tracks.remove(track)
+                continue
+            data = track.source.read()
+            if data == None:
+                continue
+            if len(data) != FRAME_BYTES:
+                track.finished = True
+                self.tracks.remove(track)
+                continue
+            frames.append((data, track.volume))
+        return frames
+
+    def mix_numpy(self, frames) -> bytes:
+        mix = self.mix
+        mix.fill(0)
+        for data, volume in frames:
+            samples = numpy.frombuffer(data, dtype="<i2")
+            numpy.multiply(samples, volume, out=self.scaled, casting="unsafe")
+            numpy.add(mix, self.scaled, out=mix)
+        if self.volume != 1.0:
+            numpy.multiply(mix, self.volume, out=mix)
+        numpy.clip(mix, -32768, 32767, out=mix)
+        numpy.copyto(self.output, mix, casting="unsafe")
+        return self.output.tobytes()
+
+    def mix_python(self, frames) -> bytes:
+        # Used when NumPy is not installed. This is much slower, so it is only suitable for a few tracks.
+        mix = [0.0] * (FRAME_SAMPLES * CHANNELS)
+        for data, volume in frames:
+            samples = array.array("h", data)
+            if sys.byteorder == "big":
+                samples.byteswap()
+            volume *= self.volume
+            for index, sample in enumerate(samples):
+                mix[index] += sample * volume
+        output = array.array("h", (max(-32768, min(32767, int(sample))) for sample in mix))
+        if sys.byteorder == "big":
+            output.byteswap()
+        return output.tobytes()
+
+    def mixFrame(self, frames) -> bytes:
+        """
+        Mixes frames of PCM, given as pairs of data and volume, and returns the mixed PCM frame.
+
+        """
+        if len(frames) == 1 and frames[0][1] * self.volume == 1.0:
+            return bytes(frames[0][0])
+        if numpy != None:
+            return self.mix_numpy(frames)
+        return self.mix_python(frames)
+
+    def read(self):
+        """
+        Returns the next Opus frame of the mix, None if no track has a frame ready, or `b''` once
+        the mixer has finished. A mixer kept open without any tracks returns silence, as it is not
+        waiting for anything.
+
+        """
+        if self.stopped:
+            return b''
+        frames = self.read_frames()
+        if not frames:
+            if not self.tracks:
+                return SILENCE_FRAME if self.keep_open else b''
+            return None
+        return self.encoder.encode(self.mixFrame(frames))
+
+    def stop(self):
+        """
+        Stops the mixer and every track in it.
+
+        """
+        self.stopped = True
+        for track in self.tracks:
+            track.stop()
+        self.tracks = []
@@ -0,0 +1,332 @@
+# An in-memory index for answering autocomplete interactions without running any user code.
+import asyncio
+from bisect import bisect_left
+from collections import OrderedDict
+import heapq
+
+from typing import (
+    Dict,
+    List,
+    Tuple
+)
+
+class AutocompleteIndex():
+    """
+    A sorted index of choices that can be attached to an `ApplicationCommandOption`. Whenever a user
+    types into that option, the client answers directly from this index. Choices are matched by the
+    start of their name first, then by the start of any word in their name, and finally by a fuzzy
+    match where the typed characters appear in order.
+
+    """
+
+    names : List[str] = []
+    values : List = []
+    weights : List[float] = []
+
+    prefix_keys : List[str] = []
+    prefix_entries : List[int] = []
+    word_keys : List[str] = []
+    word_entries : List[int] = []
+    normalized : List[str] = []
+    rank_of : List[int] = []
+    default_results : List[int] = []
+    short_results : Dict[str, List[int]] = {}
+
+    max_results : int = 25
+    key_length : int = 48
+    fuzzy_scan_limit : int = 500
+    cache_size : int = 4096
+    cache : OrderedDict = None
+    fuzzy : bool = True
+    sort_chunk_size : int = 16384
+    built : bool = True
+    build_task : asyncio.Task = None
+    generation : int = 0
+
+    def __init__(self, max_results : int = 25, fuzzy : bool = True, cache_size : int = 4096) -> None:
+        """
+        Creates an empty autocomplete index.
+
+        Parameters
+        -------
+        max_results: `int`
+            The maximum amount of choices returned for a query. Discord allows at most 25.
+        fuzzy: `bool`
+            Whether choices should be matched fuzzily when there are not enough prefix matches.
+        cache_size: `int`
+            The amount of query results that are remembered. Users typing the same characters
+            will be answered from this cache.
+
+        """
+        self.names = []
+        self.values = []
+        self.weights = []
+        self.prefix_keys = []
+        self.prefix_entries = []
+        self.word_keys = []
+        self.word_entries = []
+        self.normalized = []
+        self.rank_of = []
+        self.default_results = []
+        self.short_results = {}
+        self.max_results = min(max_results, 25)
+        self.fuzzy = fuzzy
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.built = True
+        self.build_task = None
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def normalize(text : str) -> str:
+        return text.casefold().strip()
+
+    def addChoice(self, name : str, value = None, weight : float = 0) -> None:
+        """
+        Adds a choice to the index. The index is rebuilt in the background the next time it is searched.
+
+        Parameters
+        -------
+        name: `str`
+            The name of the choice shown to the user. (Max: 100 characters)
+        value: `str`
+            The value sent to your application when this choice is selected. Defaults to the name.
+        weight: `float`
+            Choices with a higher weight are shown first when several choices match equally well.
+
+        """
+        self.names.append(name[:100])
+        self.values.append(name[:100] if value is None else value)
+        self.weights.append(weight)
+        self.built = False
+        self.generation += 1
+
+    def addChoices(self, choices) -> None:
+        """
+        Adds many choices at once. Each choice can be a name, or a tuple of `(name, value)`
+        or `(name, value, weight)`.
+
+        """
+        for choice in choices:
+            if isinstance(choice, str):
+                self.addChoice(choice)
+            else:
+                self.addChoice(*choice)
+
+    def build(self) -> None:
+        """
+        Sorts the index, blocking until it is done. Large indexes take seconds to sort, so while the
+        client is running, use `buildAsync()` instead.
+
+        """
+        self.applyIndex(self.createIndex(list(self.names), list(self.weights)), self.generation)
+
+    async def buildAsync(self) -> None:
+        """
+        Sorts the index in an executor, so the event loop keeps handling the gateway while it is built.
+        Searches made in the meantime are answered from the previous index.
+
+        """
+        generation = self.generation
+        names = list(self.names)
+        weights = list(self.weights)
+        index = await asyncio.get_running_loop().run_in_executor(None, self.createIndex, names, weights, self.sort_chunk_size)
+        self.applyIndex(index, generation)
+
+    def startBuild(self) -> None:
+        """
+        Builds the index if choices were added since it was last built. Outside of an event loop the index
+        is built straight away, otherwise it is built in the background with `buildAsync()`. This is called
+        when the index is attached to an option and whenever it is searched.
+
+        """
+        if self.built or (self.build_task != None and not self.build_task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.build()
+            return
+        self.build_task = loop.create_task(self.buildAsync())
+
+    @staticmethod
+    def sortInChunks(items : List, chunk_size : int = None, key = None) -> List:
+        # Sorting holds the GIL until it finishes, which would pause the event loop while a large index is
+        # built on another thread. Sorting in chunks and merging them lets the event loop run in between.
+        if chunk_size == None or len(items) <= chunk_size:
+            return sorted(items, key=key)
+        chunks = [sorted(items[start:start + chunk_size], key=key) for start in range(0, len(items), chunk_size)]
+        return list(heapq.merge(*chunks, key=key))
+
+    def createIndex(self, names : List[str], weights : List[float], chunk_size : int = None) -> Dict:
+        # Only reads its arguments, so it can run on another thread while choices are added.
+        normalized = [self.normalize(name) for name in names]
+
+        # Every entry is given its position in the final ranking, so ranking a set of matches
+        # only needs a list lookup for each entry.
+        ranked = self.sortInChunks(range(len(names)), chunk_size, key=lambda entry: (-weights[entry], len(names[entry]), names[entry]))
+        rank_of = [0] * len(ranked)
+        for position, entry in enumerate(ranked):
+            rank_of[entry] = position
+
+        prefix = []
+        words = []
+        for entry, name in enumerate(normalized):
+            prefix.append((name[:self.key_length], entry))
+            for position in range(1, len(name)):
+                if not name[position - 1].isalnum() and name[position].isalnum():
+                    words.append((name[position:position + self.key_length], entry))
+        prefix = self.sortInChunks(prefix, chunk_size)
+        words = self.sortInChunks(words, chunk_size)
+        prefix_keys = [key for key, _ in prefix]
+        prefix_entries = [entry for _, entry in prefix]
+        word_keys = [key for key, _ in words]
+        word_entries = [entry for _, entry in words]
+        # Freeing a list of a million tuples also holds the GIL throughout, so they are freed a chunk at a time.
+        if chunk_size != None:
+            for items in (prefix, words):
+                while items:
+                    del items[-chunk_size:]
+
+        # Single characters match the largest ranges of the index, so they are ranked ahead of time.
+        short_results = {}
+        for character in set(key[:1] for key in prefix_keys if key):
+            short_results[character] = self.prefixMatches(prefix_keys, prefix_entries, character, self.max_results, normalized, rank_of)
+
+        return {
+            "normalized": normalized,
+            "rank_of": rank_of,
+            "default_results": ranked[:self.max_results],
+            "prefix_keys": prefix_keys,
+            "prefix_entries": prefix_entries,
+            "word_keys": word_keys,
+            "word_entries": word_entries,
+            "short_results": short_results,
+        }
+
+    def applyIndex(self, index : Dict, generation : int) -> None:
+        for name, value in index.items():
+            setattr(self, name, value)
+        self.cache.clear()
+        # Choices added while the index was being built are included by the next build.
+        self.built = generation == self.generation
+
+    def prefixMatches(self, keys : List[str], entries : List[int], query : str, limit : int, normalized : List[str] = None, rank_of : List[int] = None) -> List[int]:
+        normalized = self.normalized if normalized == None else normalized
+        rank_of = self.rank_of if rank_of == None else rank_of
+        key_query = query[:self.key_length]
+        low = bisect_left(keys, key_query)
+        high = bisect_left(keys, key_query + "\U0010ffff", low)
+        matches = entries[low:high]
+        if len(query) > self.key_length:
+            matches = [entry for entry in matches if query in normalized[entry]]
+        if len(matches) <= limit:
+            return sorted(matches, key=rank_of.__getitem__)
+        return heapq.nsmallest(limit, matches, key=rank_of.__getitem__)
+
+    def fuzzyMatches(self, query : str, limit : int, exclude) -> List[int]:
+        # Only choices where a word starts with the same characters as the query are considered,
+        # so the amount of work stays bounded for very large indexes.
+        scored = {}
+        scanned = 0
+        for start in (query[:2], query[:1]):
+            for keys, entries in ((self.prefix_keys, self.prefix_entries), (self.word_keys, self.word_entries)):
+                low = bisect_left(keys, start)
+                high = bisect_left(keys, start + "\U0010ffff", low)
+                high = min(high, low + self.fuzzy_scan_limit - scanned)
+                scanned += high - low
+                for entry in entries[low:high]:
+                    if entry in exclude or entry in scored:
+                        continue
+                    score = self.fuzzyScore(query, self.normalized[entry])
+                    if score is not None:
+                        scored[entry] = score
+            if len(scored) >= limit or scanned >= self.fuzzy_scan_limit:
+                break
+        rank_of = self.rank_of
+        return heapq.nsmallest(limit, scored, key=lambda entry: (scored[entry], rank_of[entry]))
+
+    @staticmethod
+    def fuzzyScore(query : str, name : str):
+        # Every character of the query must appear in order. Larger gaps give a worse score.
+        position = name.find(query[0])
+        if position == -1:
+            return None
+        score = position
+        for character in query[1:]:
+            next_position = name.find(character, position + 1)
+            if next_position == -1:
+                return None
+            score += next_position - position - 1
+            position = next_position
+        return score
+
+    def search(self, query : str, limit : int = None) -> List[Tuple[str, object]]:
+        """
+        Finds the best choices for what the user has typed so far.
+
+        Parameters
+        -------
+        query: `str`
+            The text the user has typed into the option.
+        limit: `int`
+            The maximum amount of choices to return. Defaults to `max_results`.
+
+        Returns
+        -------
+        :class:`List[Tuple[str, object]]`
+            The name and value of each matching choice, best match first.
+
+        """
+        if not self.built:
+            self.startBuild()
+        if limit is None:
+            limit = self.max_results
+        query = self.normalize(str(query))
+
+        cache_key = (query, limit)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.cache.move_to_end(cache_key)
+            return cached
+
+        if query == "":
+            results = self.default_results[:limit]
+        elif query in self.short_results and limit <= self.max_results:
+            results = self.short_results[query][:limit]
+        else:
+            results = self.prefixMatches(self.prefix_keys, self.prefix_entries, query, limit)
+            if len(results) < limit:
+                found = set(results)
+                for entry in self.prefixMatches(self.word_keys, self.word_entries, query, limit * 2):
+                    if entry not in found:
+                        found.add(entry)
+                        results.append(entry)
+                        if len(results) == limit:
+                            break
+                if len(results) < limit and self.fuzzy:
+                    results += self.fuzzyMatches(query, limit - len(results), found)
+
+        choices = [(self.names[entry], self.values[entry]) for entry in results]
+        if not self.built:
+            # Results from an outdated index are not cached, so they are replaced once it is rebuilt.
+            return choices
+        self.cache[cache_key] = choices
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return choices
+
+    def generateJSON(self, query : str) -> List[Dict]:
+        """
+        Generates the choices for an autocomplete result from what the user has typed so far.
+
+        Returns
+        -------
+        :class:`List[Dict[]]`
+            A list of choices to be translated into JSON.
+
+        """
+        return [{"name": name, "value": value} for name, value in self.search(query)]
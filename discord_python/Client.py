@@ -4,20 +4,26 @@ import asyncio
 import json
 import random
 from .ApplicationCommands import ApplicationCommand, MessageComponentCallback
-from .Message import Message
+from .Message import Message, HTTPMethods, InteractionCallbackType, DISCORD_HTTP_API_BASE
 import logging
 from .Logger import CustomFormatter
 from .InteractionResponder import Interaction
 import string
+import time
 from .Enums import ApplicationCommandType
 from .Voice import VoiceClient
+from .VoiceScheduler import VoiceScheduler
+from .VoiceUDP import VoiceSocketPool
+from .GatewayRecorder import GatewayRecorder
+from .Metrics import ClientMetrics
+from .InteractionServer import InteractionServer
 import socket
 
 
 from typing import (
     List,
     Dict,
-    Tuple,
+    Set,
     Callable
 )
 
@@ -25,7 +31,7 @@ class Client:
 
     resume_gateway_url = None
     gateway_url = None
-    discord_http_api_base = "https://discord.com/api/v10"
+    discord_http_api_base = DISCORD_HTTP_API_BASE
     discord_http_oauth_base = "https://discord.com/api/oauth2"
     bot_token = None
     event_loop = None
@@ -38,17 +44,25 @@ class Client:
     ready_event_occurred : bool = False
     commands : List[ApplicationCommand] = []
     application_id = None
+    user_id : str = None
     messageQueue : List[Message] = []
     logger : logging.Logger = None
     message_callbacks : List[MessageComponentCallback] = []
     reconnect : bool = False
-    voice_endpoint : str = None
     quick_connect : bool = False
     intents : int = 0
     heartbeat_intervals : Dict[int, int] = {}
-    voice_websockets : Dict[int, aiohttp.ClientWebSocketResponse] = {}
-    voice_identifications : Dict[int, Tuple[int, str, int, List[str]]] = {}
     voice_clients : Dict[str, VoiceClient] = {}
+    inline_responses : Dict[str, asyncio.Future] = {}
+    deferred_responses : Dict[str, str] = {}
+    background_tasks : Set[asyncio.Task] = set()
+    voice_scheduler : VoiceScheduler = None
+    batch_voice_udp : bool = False
+    voice_socket_pool : VoiceSocketPool = None
+    gateway_recorder : GatewayRecorder = None
+    metrics : ClientMetrics = None
+    heartbeat_sent_at : float = None
+    latency : float = None
 
     # Implementing this class will allow users to create a websocket session with discord.
     def __init__(self, intents=0, debug_level=logging.INFO, quickConnect : bool = False) -> None:
@@ -69,6 +83,9 @@ class Client:
         
         self.quick_connect = quickConnect
         self.intents = intents
+        self.inline_responses = {}
+        self.deferred_responses = {}
+        self.background_tasks = set()
 
         self.functions = [self.websocketListener(),
             self.heartbeat(),
@@ -170,6 +187,65 @@ class Client:
         self.getGatewayBotURL()
         self.eventHandler(self.gateway_url)
 
+    def runInteractionServer(self, bot_token, public_key, host="0.0.0.0", port=8080, path="/interactions") -> None:
+        """
+        Runs your bot without a gateway connection. Interactions are received as HTTP requests from discord
+        through an `InteractionServer`, and the first response to each interaction is sent back in the body
+        of the request. Set the Interactions Endpoint URL of your application to point to this server.
+
+        Parameters
+        -------
+        bot_token: `str`
+            The token for your bot. This is still needed for any requests made through the message queue.
+        public_key: `str`
+            The public key of your application, used to verify that requests were sent by discord.
+        host: `str`
+            The address the server listens on. Defaults to all addresses.
+        port: `int`
+            The port the server listens on. Defaults to 8080.
+        path: `str`
+            The path of the Interactions Endpoint URL. Defaults to `/interactions`.
+
+        Warning
+        -------
+        Gateway events are not received in this mode, so voice is not available. Functions registered with
+        `registerAsyncEvent()` are still run.
+
+        """
+        self.bot_token = bot_token
+        # The gateway coroutines are not used without a gateway connection. They are found by their
+        # functions rather than their position, so coroutines registered before this are kept.
+        gateway_functions = {self.websocketListener.__code__, self.heartbeat.__code__, self.identify.__code__}
+        functions = []
+        for function in self.functions:
+            if getattr(function, "cr_code", None) in gateway_functions:
+                function.close()
+            else:
+                functions.append(function)
+        self.functions = functions
+        self.reconnect = False
+
+        self.event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.event_loop)
+        server = InteractionServer(self, public_key, host, port, path)
+        try:
+            self.event_loop.run_until_complete(self.startInteractionServer(server))
+            self.event_loop.run_until_complete(self.runHandler())
+        finally:
+            self.event_loop.run_until_complete(server.stop())
+            self.event_loop.run_until_complete(self.session.close())
+            self.event_loop.close()
+
+    async def startInteractionServer(self, server):
+        """
+        Creates the http session and starts the interaction server. There is no READY event without a gateway
+        connection, so the client is marked as ready once the server is listening.
+
+        """
+        self.session = aiohttp.ClientSession()
+        await server.start()
+        self.ready_event_occurred = True
+
     def eventHandler(self, gateway_url):
         """
         The function responsible for running any coroutines. A new event loop is created, and then after
@@ -231,7 +307,9 @@ class Client:
             The URL that will be used for creating the websocket connection.
 
         """
-        self.session = aiohttp.ClientSession()
+        # Every voice connection keeps a websocket open on this session, so the default limit of 100
+        # connections would stop more than 100 guilds from connecting to voice.
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
         self.ws = await self.session.ws_connect(gateway_url)
 
     async def websocketListener(self):
@@ -251,60 +329,51 @@ class Client:
                 return
             async for message in self.ws:
                 if message.type == aiohttp.WSMsgType.TEXT:
+                    if self.gateway_recorder != None:
+                        self.gateway_recorder.record(message.data)
                     message_data = json.loads(message.data)
                     self.logger.debug(message_data)
+                    if self.metrics != None:
+                        self.metrics.gateway_messages.inc((message_data['op'],))
+                        if message_data['op'] == 0:
+                            self.metrics.gateway_events.inc((message_data['t'],))
                     if message_data['op'] == 0:
                         # The application has received a dispatch event.
                         if message_data['t'] == 'READY':
                             # Ready event received. The application should save the resume gateway url.
                             self.resume_gateway_url = message_data['d']['resume_gateway_url']
                             self.session_id = message_data['d']['session_id']
+                            self.application_id = message_data['d']['application']['id']
+                            self.user_id = message_data['d']['user']['id']
                             self.ready_event_occurred = True
 
                         if message_data['t'] == "VOICE_STATE_UPDATE":
-                            self.voice_session = message_data['d']['session_id']
-                            self.voice_user_id = message_data['d']['user_id']
+                            # Voice states of other users are also received with the GUILD_VOICE_STATES intent.
+                            voice_client = self.voice_clients.get(message_data['d'].get('guild_id'))
+                            if voice_client != None and message_data['d']['user_id'] == self.user_id:
+                                voice_client.voiceStateUpdate(message_data['d'])
 
                         if message_data['t'] == 'VOICE_SERVER_UPDATE':
-                            self.voice_endpoint = message_data['d']['endpoint']
-                            self.voice_token = message_data['d']['token']
-                            self.voice_guild = message_data['d']['guild_id']
+                            voice_client = self.voice_clients.get(message_data['d']['guild_id'])
+                            if voice_client != None:
+                                voice_client.voiceServerUpdate(message_data['d'])
 
                         if message_data['t'] == 'INTERACTION_CREATE':
-                            loop = asyncio.get_running_loop()
-                            if message_data['d']['type'] == 2:
-                                # An application command was received! Wahoo!
-
-                                # Determines which function to callback to for this command.
-                                for command in self.commands:
-                                    if command.name == message_data['d']['data']['name']:
-                                        if 'options' in message_data['d']['data']:
-                                            loop.create_task(command.function(client=self, interaction=Interaction(message_data['d']['id'], message_data['d']['token'], message_data['d']['member']['user']['id'], message_data['d']['guild_id'], bot_token=self.bot_token, options=message_data['d']['data']['options'])))
-                                        else:
-                                            loop.create_task(command.function(client=self, interaction=Interaction(message_data['d']['id'], message_data['d']['token'], message_data['d']['member']['user']['id'], message_data['d']['guild_id'], bot_token=self.bot_token)))
-
-                            if message_data['d']['type'] == 3:
-                                # An message component interaction was received!
-
-                                # Determines which function to callback to for this command.
-                                for message_callback in self.message_callbacks:
-                                    if message_callback.custom_id == message_data['d']['data']['custom_id']:
-                                        #command.function(self, message_data['d']['id'], message_data['d']['token'])
-                                        loop.create_task(message_callback.function(client=self, interaction=Interaction(message_data['d']['id'], message_data['d']['token'], bot_token=self.bot_token)))
-
-                            if message_data['d']['type'] == 5:
-                                # An modal interaction was received!
-                                self.logger.debug("Received MODAL interaction.")
-                                # Determines which function to callback to for this command.
-                                for message_callback in self.message_callbacks:
-                                    if message_callback.custom_id == message_data['d']['data']['custom_id']:
-                                        #command.function(self, message_data['d']['id'], message_data['d']['token'])
-                                        self.logger.debug("Found MODAL callback function.")
-                                        loop.create_task(message_callback.function(client=self, interaction=Interaction(message_data['d']['id'], message_data['d']['token'], bot_token=self.bot_token)))
+                            if message_data['d']['type'] == 4:
+                                # An autocomplete interaction was received, answered straight from the option's index.
+                                response = self.generateAutocompleteResponse(message_data['d'])
+                                if response != None:
+                                    url = self.discord_http_api_base + f"/interactions/{message_data['d']['id']}/{message_data['d']['token']}/callback"
+                                    message = Message(url=url, method=HTTPMethods.POST, json=response, client=self)
+                                    # Autocomplete results go stale after every keystroke, so they skip the message queue.
+                                    self.createBackgroundTask(message.performHTTPAction(self.session))
+                            else:
+                                self.dispatchInteraction(message_data['d'])
 
                     if message_data['op'] == 1:
                         # The application should immediately send a heartbeat.
                         await self.ws.send_json({"op":1, "d":self.last_sequence})
+                        self.heartbeat_sent_at = time.monotonic()
                         self.logger.info(f"Heartbeat requested, and has been sent.")
                     
                     if message_data['op'] == 7:
@@ -317,6 +386,11 @@ class Client:
                     if message_data['op'] == 11:
                         self.logger.info(f"Heartbeat acknowledged.")
                         self.heartbeats_sent = True
+                        if self.heartbeat_sent_at != None:
+                            self.latency = time.monotonic() - self.heartbeat_sent_at
+                            self.heartbeat_sent_at = None
+                            if self.metrics != None:
+                                self.metrics.heartbeat_latency.observe(self.latency)
                     
                     if message_data['s'] != None:
                         self.last_sequence = message_data['s']
@@ -327,6 +401,128 @@ class Client:
                     self.logger.error(f"ERROR PACKET RECEIVED {message.data}")
             await asyncio.sleep(0)
 
+    def createInteraction(self, interaction_data) -> Interaction:
+        """
+        Creates the `Interaction` passed to callback functions from the data of an interaction.
+
+        Parameters
+        -------
+        interaction_data: `Dict[]`
+            The data of the INTERACTION_CREATE event.
+
+        """
+        if 'member' in interaction_data:
+            user_id = interaction_data['member']['user']['id']
+        else:
+            user_id = interaction_data.get('user', {}).get('id')
+        return Interaction(interaction_data['id'], interaction_data['token'], user_id, interaction_data.get('guild_id'),
+            bot_token=self.bot_token, options=interaction_data['data'].get('options', []),
+            application_id=interaction_data.get('application_id'), client=self)
+
+    def dispatchInteraction(self, interaction_data):
+        """
+        Determines which callback function an interaction belongs to and runs it as a new task. This is
+        used for interactions received from the gateway and from an `InteractionServer`.
+
+        Parameters
+        -------
+        interaction_data: `Dict[]`
+            The data of the INTERACTION_CREATE event.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether a callback function was found for the interaction.
+
+        """
+        loop = asyncio.get_running_loop()
+        if interaction_data['type'] == 2:
+            # An application command was received! Wahoo!
+
+            # Determines which function to callback to for this command.
+            for command in self.commands:
+                if command.name == interaction_data['data']['name']:
+                    callback = command.function(client=self, interaction=self.createInteraction(interaction_data))
+                    if self.metrics != None:
+                        callback = self.metrics.timeCallback(command.name, callback)
+                    loop.create_task(callback)
+                    return True
+
+        if interaction_data['type'] == 3 or interaction_data['type'] == 5:
+            # A message component or modal interaction was received!
+            if interaction_data['type'] == 5:
+                self.logger.debug("Received MODAL interaction.")
+
+            # Determines which function to callback to for this component.
+            for message_callback in self.message_callbacks:
+                if message_callback.custom_id == interaction_data['data']['custom_id']:
+                    callback = message_callback.function(client=self, interaction=self.createInteraction(interaction_data))
+                    if self.metrics != None:
+                        callback = self.metrics.timeCallback(message_callback.custom_id, callback)
+                    loop.create_task(callback)
+                    return True
+
+        return False
+
+    def createBackgroundTask(self, coroutine) -> asyncio.Task:
+        """
+        Starts a task that nothing awaits. A reference is kept until it finishes, so it is not garbage collected
+        while running, and any exception it raises is logged.
+
+        """
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.backgroundTaskDone)
+        return task
+
+    def backgroundTaskDone(self, task : asyncio.Task):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception() != None:
+            self.logger.error(f"Background task failed: {task.exception()!r}")
+
+    def generateAutocompleteResponse(self, interaction_data):
+        """
+        Generates the response to an autocomplete interaction using the `AutocompleteIndex` attached to 
+        the focused option of the command. No user code is run.
+
+        Parameters
+        -------
+        interaction_data: `Dict[]`
+            The data of the INTERACTION_CREATE event.
+
+        Returns
+        -------
+        :class:`Dict[]`
+            The response to be translated into JSON, or None if the focused option has no index.
+
+        """
+        focused = None
+        options = interaction_data['data'].get('options', [])
+        while options:
+            # Focused options can be nested inside of sub commands.
+            nested = []
+            for option in options:
+                if option.get('focused'):
+                    focused = option
+                nested += option.get('options', [])
+            options = nested
+
+        if focused == None:
+            return None
+
+        for command in self.commands:
+            if command.name != interaction_data['data']['name']:
+                continue
+            for option in command.options:
+                if option.name == focused['name'] and option.autocomplete != None:
+                    return {
+                        "type": InteractionCallbackType.APPLICATION_COMMAND_AUTOCOMPLETE_RESULT,
+                        "data": {
+                            "choices": option.autocomplete.generateJSON(focused.get('value', ''))
+                        }
+                    }
+        return None
+
     async def heartbeat(self):
         """
         Sends heartbeats at a regular interval through the websocket connection. This function will
@@ -357,6 +553,7 @@ class Client:
                     await asyncio.sleep(self.heartbeat_interval / 1000)
                 # Send the heartbeat with the previous sequence value to keep the connection alive.
                 await self.ws.send_json({"op":1, "d":self.last_sequence})
+                self.heartbeat_sent_at = time.monotonic()
                 
             await asyncio.sleep(0)
 
@@ -402,6 +599,8 @@ class Client:
 
             # Send the first interaction.
             interaction = self.messageQueue[0]
+            if self.metrics != None and getattr(interaction, "created_at", None) != None:
+                self.metrics.queue_wait.observe(time.monotonic() - interaction.created_at)
 
             await interaction.performHTTPAction(self.session)
 
@@ -547,8 +746,108 @@ class Client:
         return json_body
 
     async def getVoiceClient(self, guild_id, channel_id, self_mute, self_deaf):
+        """
+        Returns the voice connection of a guild, joining the channel if there is no connection yet. Each
+        guild's connection receives its own voice state and server updates, so any number of guilds can
+        join at the same time.
+
+        """
         if guild_id not in self.voice_clients:
             voice_client = VoiceClient(guild_id, channel_id, self_mute, self_deaf, self)
             self.voice_clients[guild_id] = voice_client
             return voice_client
         return self.voice_clients[guild_id]
+
+    def getVoiceLatencies(self) -> Dict[str, float]:
+        """
+        Returns the latest voice websocket round trip time of each guild's voice connection in seconds.
+        Guilds where no heartbeat has been acknowledged yet are None.
+
+        """
+        return {guild_id: voice_client.latency for guild_id, voice_client in self.voice_clients.items()}
+
+    def recordGateway(self, path : str, compresslevel : int = 6) -> GatewayRecorder:
+        """
+        Starts recording every frame received from the gateway to a compressed file, with the time each
+        frame was received. Recordings can be replayed through a client with `replayRecording()`, such
+        as to benchmark changes against real traffic.
+
+        Parameters
+        -------
+        path: `str`
+            The file to record to. It is replaced if it exists.
+        compresslevel: `int`
+            The gzip compression level, from 1 (fastest) to 9 (smallest).
+
+        Warning
+        -------
+        Recordings contain everything your bot receives, including interaction tokens and message
+        contents. Store them as carefully as your bot token.
+
+        """
+        self.stopRecordingGateway()
+        self.gateway_recorder = GatewayRecorder(path, compresslevel)
+        return self.gateway_recorder
+
+    def stopRecordingGateway(self):
+        """
+        Stops recording the gateway, if it is being recorded, and finishes writing the file.
+
+        """
+        if self.gateway_recorder != None:
+            self.gateway_recorder.close()
+            self.gateway_recorder = None
+
+    def enableMetrics(self, host : str = "127.0.0.1", port : int = None, path : str = "/metrics") -> ClientMetrics:
+        """
+        Starts collecting metrics of the client's internals, such as gateway events, heartbeat latency, the
+        message queue, rate limits, callback durations and voice packets. The metrics can be read in the
+        Prometheus text format with `metrics.generateText()`, or served over HTTP by giving a port.
+
+        Parameters
+        -------
+        host: `str`
+            The address the metrics are served on. Defaults to only local connections.
+        port: `int`
+            The port the metrics are served on. If None, they are not served.
+        path: `str`
+            The path the metrics are served at.
+
+        Warning
+        -------
+        To serve the metrics, this should be called before `run()`, as the server is started with the other
+        coroutines in `self.functions`.
+
+        """
+        if self.metrics == None:
+            self.metrics = ClientMetrics(self)
+            if port != None:
+                self.registerAsyncEvent(self.metrics.serve(host, port, path))
+        return self.metrics
+
+    def getVoiceScheduler(self) -> VoiceScheduler:
+        """
+        Returns the scheduler that sends audio for all of this client's voice connections, creating it
+        if it does not exist yet.
+
+        """
+        if self.voice_scheduler == None:
+            self.voice_scheduler = VoiceScheduler(self.logger, socket_pool=self.getVoiceSocketPool())
+        return self.voice_scheduler
+
+    def getVoiceSocketPool(self) -> VoiceSocketPool:
+        """
+        Returns the shared UDP sockets used by voice connections when `batch_voice_udp` is enabled,
+        or None if each connection uses its own socket.
+
+        With batching enabled, all of this client's voice connections send through a few shared
+        sockets, and the packets due in each 20ms tick are sent with a single `sendmmsg` call on
+        Linux. Elsewhere, packets are still sent one at a time through the shared sockets. This must
+        be set before the first voice connection is made.
+
+        """
+        if not self.batch_voice_udp:
+            return None
+        if self.voice_socket_pool == None:
+            self.voice_socket_pool = VoiceSocketPool()
+        return self.voice_socket_pool
\ No newline at end of file
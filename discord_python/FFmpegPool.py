@@ -0,0 +1,168 @@
+# Keeps FFmpeg processes started ahead of time, so playback does not wait for FFmpeg to start.
+import asyncio
+import collections
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+from typing import (
+    List
+)
+
+from .Voice import FFmpegOpus
+
+class FFmpegPool():
+    """
+    A pool of FFmpeg processes that have already been started and are waiting for input on stdin.
+    Playing a local file takes a waiting process and feeds it the file from a separate thread, so the
+    time spent starting FFmpeg is not added to the time before audio starts. A new process is started
+    in the background to replace each one taken.
+
+    The total number of FFmpeg processes encoding at once is limited, and requests beyond the limit
+    wait for a process to finish.
+
+    """
+
+    executable_path : str = "ffmpeg"
+    size : int = 2
+    max_processes : int = 8
+    input_args : List[str] = ["-probesize", "32768", "-analyzeduration", "0"]
+    idle : collections.deque = None
+    semaphore : asyncio.Semaphore = None
+    closed : bool = False
+    CHUNK_SIZE : int = 65536
+
+    def __init__(self, executable_path : str = "ffmpeg", size : int = 2, max_processes : int = 8, input_args : List[str] = None) -> None:
+        """
+        Creates a pool. Call `start()` from the event loop to start the waiting processes.
+
+        Parameters
+        -------
+        executable_path: `str`
+            The FFmpeg executable.
+        size: `int`
+            The amount of processes kept waiting for input.
+        max_processes: `int`
+            The maximum amount of processes encoding audio at the same time.
+        input_args: `List[str]`
+            Options given to FFmpeg before the input. By default, FFmpeg only probes a small amount of
+            the input so the first frame is encoded sooner.
+
+        """
+        self.executable_path = executable_path
+        self.size = size
+        self.max_processes = max_processes
+        if input_args != None:
+            self.input_args = input_args
+        self.idle = collections.deque()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("Logging")
+        self.closed = False
+
+    async def start(self):
+        """
+        Starts the waiting processes.
+
+        """
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.max_processes)
+        await asyncio.gather(*(self.loop.run_in_executor(None, self.spawn) for _ in range(self.size)))
+
+    def spawn(self):
+        # Started with a blocking call, so this is always run on another thread.
+        args = [self.executable_path] + self.input_args + ["-i", "pipe:0"] + FFmpegOpus.OUTPUT_ARGS
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        try:
+            process = subprocess.Popen(args=args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creationflags)
+        except FileNotFoundError:
+            raise FileNotFoundError("FFmpeg executable was not found.")
+        with self.lock:
+            if self.closed:
+                process.kill()
+                return
+            self.idle.append(process)
+
+    def take(self) -> subprocess.Popen:
+        # Returns a waiting process that is still running, or None if there are none.
+        with self.lock:
+            while self.idle:
+                process = self.idle.popleft()
+                if process.poll() == None:
+                    return process
+        return None
+
+    async def getSource(self, source : str) -> FFmpegOpus:
+        """
+        Returns an `FFmpegOpus` source for a file, using a waiting process if there is one. Sources that
+        are not local files, such as URLs, are started normally, but still count towards the limit.
+
+        Files are read by FFmpeg from a pipe, so formats that need to seek within the file (such as MP4
+        files with the index at the end) should be played with `FFmpegOpus` directly.
+
+        """
+        await self.semaphore.acquire()
+        try:
+            if not os.path.isfile(source):
+                return await self.startSource(source)
+
+            process = self.take()
+            # Replace the process taken, or start one straight away if none were waiting.
+            if process == None:
+                await self.loop.run_in_executor(None, self.spawn)
+                process = self.take()
+            self.loop.run_in_executor(None, self.spawn).add_done_callback(self.spawned)
+            if process == None:
+                # The new process exited straight away, or was taken by another call first.
+                return await self.startSource(source)
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+        threading.Thread(target=self.feed, args=(source, process), daemon=True).start()
+        return FFmpegOpus(source, self.executable_path, process=process)
+
+    async def startSource(self, source : str) -> FFmpegOpus:
+        # Starts FFmpeg normally, releasing its place in the pool once it exits.
+        audio = await self.loop.run_in_executor(None, FFmpegOpus, source, self.executable_path)
+        threading.Thread(target=self.wait_for_exit, args=(audio.process,), daemon=True).start()
+        return audio
+
+    def spawned(self, future : asyncio.Future):
+        # Nothing waits for the processes started in the background, so their errors are logged here.
+        if not future.cancelled() and future.exception() != None:
+            self.logger.error(f"Starting a waiting FFmpeg process failed: {future.exception()!r}")
+
+    def feed(self, source : str, process : subprocess.Popen):
+        try:
+            with open(source, "rb") as file:
+                while True:
+                    chunk = file.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError, OSError):
+            # FFmpeg was stopped before the whole file was read.
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+        self.wait_for_exit(process)
+
+    def wait_for_exit(self, process : subprocess.Popen):
+        process.wait()
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.semaphore.release)
+
+    def close(self):
+        """
+        Stops the waiting processes.
+
+        """
+        with self.lock:
+            self.closed = True
+            while self.idle:
+                self.idle.popleft().kill()
@@ -0,0 +1,211 @@
+# Records the frames received from the gateway, and replays them through a client.
+import asyncio
+import gzip
+import json
+import logging
+import queue
+import threading
+import time
+import aiohttp
+
+from typing import (
+    Iterator,
+    List,
+    Tuple
+)
+
+RECORDING_HEADER : str = "# discord_python gateway recording v1"
+
+class GatewayRecorder():
+    """
+    Writes every frame received from the gateway to a gzip compressed file, with the time it was received.
+    Compressing and writing happen on a separate thread, so recording does not slow down the gateway listener.
+
+    Each line of the file is the seconds since recording started, a tab, and the frame exactly as it was
+    received. The first line is a header.
+
+    """
+
+    path : str = None
+    frames : int = 0
+    start : float = 0
+    closed : bool = False
+
+    def __init__(self, path : str, compresslevel : int = 6) -> None:
+        """
+        Starts recording to a file, replacing it if it exists.
+
+        Parameters
+        -------
+        path: `str`
+            The file to record to. Recordings are gzip compressed, so this usually ends in `.gz`.
+        compresslevel: `int`
+            The gzip compression level, from 1 (fastest) to 9 (smallest).
+
+        """
+        self.path = path
+        self.file = gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel)
+        self.file.write(f"{RECORDING_HEADER} {json.dumps({'started_at': time.time()})}\n")
+        self.start = time.monotonic()
+        self.frames = 0
+        self.closed = False
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def record(self, data : str):
+        """
+        Records a frame received from the gateway.
+
+        """
+        if self.closed:
+            return
+        self.frames += 1
+        self.queue.put(f"{time.monotonic() - self.start:.6f}\t{data}\n")
+
+    def write_frames(self):
+        while True:
+            line = self.queue.get()
+            if line == None:
+                break
+            self.file.write(line)
+        self.file.close()
+
+    def close(self):
+        """
+        Stops recording. Frames already recorded are written before the file is closed.
+
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+def readRecording(path : str) -> Iterator[Tuple[float, str]]:
+    """
+    Reads a recording made by `GatewayRecorder`, yielding the time and data of each frame.
+
+    Raises
+    -------
+    ValueError
+        Raised if the file is not a gateway recording.
+
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        header = file.readline()
+        if not header.startswith(RECORDING_HEADER):
+            raise ValueError(f"{path} is not a gateway recording.")
+        for line in file:
+            timestamp, data = line.rstrip("\n").split("\t", 1)
+            yield float(timestamp), data
+
+def writeRecording(path : str, frames : List[Tuple[float, str]], compresslevel : int = 6):
+    """
+    Writes frames to a recording without a gateway connection, such as to build a synthetic recording.
+
+    """
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel) as file:
+        file.write(f"{RECORDING_HEADER} {json.dumps({'started_at': time.time()})}\n")
+        for timestamp, data in frames:
+            file.write(f"{timestamp:.6f}\t{data}\n")
+
+class ReplayWebsocket():
+    """
+    Stands in for a client's gateway websocket, returning the frames of a recording as if they had been
+    received. Anything the client sends is counted and discarded.
+
+    """
+
+    frames : List[Tuple[float, str]] = None
+    speed : float = 1
+    replayed : int = 0
+    sent : int = 0
+    closed : bool = False
+
+    def __init__(self, frames : List[Tuple[float, str]], speed : float = 1) -> None:
+        """
+        Parameters
+        -------
+        frames: `List[Tuple[float, str]]`
+            The frames to replay, as returned by `readRecording()`.
+        speed: `float`
+            How many times faster than it was recorded to replay. None replays as fast as possible.
+
+        """
+        self.frames = frames
+        self.speed = speed
+        self.replayed = 0
+        self.sent = 0
+        self.closed = False
+        self.finished = asyncio.Event()
+        self.start = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> aiohttp.WSMessage:
+        if self.replayed >= len(self.frames):
+            self.finished.set()
+            raise StopAsyncIteration
+        timestamp, data = self.frames[self.replayed]
+        if self.start == None:
+            self.start = time.monotonic() - (timestamp / self.speed if self.speed else 0)
+        if self.speed:
+            delay = self.start + timestamp / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self.replayed += 1
+        return aiohttp.WSMessage(aiohttp.WSMsgType.TEXT, data, None)
+
+    async def send_json(self, data):
+        self.sent += 1
+
+    async def send_str(self, data):
+        self.sent += 1
+
+    async def close(self):
+        self.closed = True
+        self.finished.set()
+
+async def replayRecording(client, frames : List[Tuple[float, str]], speed : float = 1) -> ReplayWebsocket:
+    """
+    Replays recorded frames through a client's gateway listener, so they are decoded and dispatched exactly
+    as if they had been received from the gateway. This returns once every frame has been handled.
+
+    Parameters
+    -------
+    client: `Client.Client`
+        The client to replay through. It should not be connected to the gateway.
+    frames: `List[Tuple[float, str]]`
+        The frames to replay, as returned by `readRecording()`.
+    speed: `float`
+        How many times faster than it was recorded to replay. None replays as fast as possible.
+
+    Returns
+    -------
+    :class:`ReplayWebsocket`
+        The websocket the frames were replayed from, which counts the frames replayed.
+
+    """
+    ws = ReplayWebsocket(frames, speed)
+    client.ws = ws
+    # Normally set by Client.eventHandler before the listener starts.
+    client.reconnect = False
+    loop = asyncio.get_running_loop()
+    listener = loop.create_task(client.websocketListener())
+    finished = loop.create_task(ws.finished.wait())
+    await asyncio.wait((listener, finished), return_when=asyncio.FIRST_COMPLETED)
+    if listener.done():
+        # The listener returned or raised before the end of the recording.
+        finished.cancel()
+        listener.result()
+    else:
+        listener.cancel()
+        try:
+            await listener
+        except asyncio.CancelledError:
+            pass
+    if ws.replayed < len(frames):
+        logging.getLogger("Logging").warning(f"Replay stopped after {ws.replayed} of {len(frames)} frames.")
+    return ws
@@ -1,8 +1,10 @@
 # Allows users to easily create a response for an interaction.
-from .Message import InteractionCallbackType
+from .Message import InteractionCallbackType, takeDeferredEdit, DISCORD_HTTP_API_BASE
 import logging
+import time
 from .ApplicationCommands import MessageComponentCallback
 from .EmbedBuilder import Embed
+from .Attachments import Attachment, createMultipart
 
 from typing import (
     List
@@ -418,8 +420,10 @@ class Interaction:
     interaction_token = None
     bot_token = None
     options = []
+    application_id = None
+    client = None
 
-    def __init__(self, interaction_id, interaction_token, user_id, guild_id, bot_token, options=[]) -> None:
+    def __init__(self, interaction_id, interaction_token, user_id, guild_id, bot_token, options=[], application_id=None, client=None) -> None:
         """
         Creates an interaction object. This should not be manually called, as it provides no functionality
         other than for providing Interaction information to callback functions.
@@ -442,6 +446,10 @@ class Interaction:
         options: `List[Dict[]]`
             The values returned from the parameters of a command. This is optional and will not always be present. If you
             have a required parameter in your command, this should be populated.
+        application_id: `str`
+            The id of the application the interaction was sent to. This is needed for followup messages.
+        client: `Client.Client`
+            The client that received the interaction. Its http session is used to respond directly.
         
 
         """
@@ -451,6 +459,138 @@ class Interaction:
         self.options = options
         self.guild_id = guild_id
         self.user_id = user_id
+        self.application_id = application_id
+        self.client = client
+        if application_id == None and client != None:
+            self.application_id = client.application_id
+
+    async def sendJSON(self, method : str, url : str, json, attachments : List[Attachment] = None):
+        """
+        Sends a request straight away on the client's http session, rather than through the message queue.
+        Interaction and webhook endpoints are authenticated by the interaction token, so no Authorization
+        header is sent and these requests are not limited by the bot's global rate limit.
+
+        Returns
+        -------
+        :class:`aiohttp.ClientResponse`
+            The response from the discord API.
+
+        """
+        start = time.perf_counter()
+        if attachments:
+            result = await self.client.session.request(method, url, data=createMultipart(json, attachments))
+        elif isinstance(json, (bytes, bytearray)):
+            # The JSON has already been serialized, such as by a ResponseTemplate.
+            result = await self.client.session.request(method, url, data=json, headers={"Content-Type": "application/json"})
+        else:
+            result = await self.client.session.request(method, url, json=json)
+        if self.client.metrics != None:
+            self.client.metrics.observeResponse(method, result, time.perf_counter() - start)
+        if result.status >= 400:
+            self.client.logger.error(f"{method} {url} failed with status {result.status}: {await result.text()}")
+        return result
+
+    @staticmethod
+    def getMessageJSON(response):
+        # Followups and edits take the message itself rather than an interaction callback.
+        if isinstance(response, InteractionResponse):
+            return response.json["data"]
+        return response
+
+    async def respond(self, response):
+        """
+        Sends the first response to this interaction immediately, instead of adding a `Message` to the 
+        message queue. If the interaction was received by an `InteractionServer`, the response is returned
+        in the body of its HTTP request instead.
+
+        Parameters
+        -------
+        response: `InteractionResponse`
+            The response to send. This can also be the JSON of a response, either as a dictionary or as
+            bytes from a `ResponseTemplate`. Any attachments of the response are uploaded with it.
+
+        """
+        json = response.json if isinstance(response, InteractionResponse) else response
+        attachments = getattr(response, "attachments", None)
+        url = f"{self.client.discord_http_api_base}/interactions/{self.interaction_id}/{self.interaction_token}/callback"
+
+        future = self.client.inline_responses.pop(url, None)
+        if future != None and not future.done():
+            future.set_result((json, attachments))
+            return
+
+        deferred = takeDeferredEdit(self.client, url, json)
+        if deferred != None:
+            # The InteractionServer already deferred this interaction, so the original response is edited.
+            original_url, message_json = deferred
+            if message_json != None:
+                await self.sendJSON("PATCH", original_url, message_json, attachments)
+            return
+
+        await self.sendJSON("POST", url, json, attachments)
+
+    async def defer(self, ephemeral=False):
+        """
+        Acknowledges this interaction without a message, showing that the application is thinking. The
+        message can be sent later using `editOriginal()`.
+
+        Parameters
+        -------
+        ephemeral: `bool`
+            Whether the message sent later will only be visible to the user who triggered the interaction.
+
+        """
+        await self.respond({"type": InteractionCallbackType.DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE, "data": {"flags": 1 << 6 if ephemeral else 0}})
+
+    async def followup(self, response):
+        """
+        Sends another message in response to this interaction, after it has been responded to.
+
+        Parameters
+        -------
+        response: `InteractionResponseText`
+            The message to send. This can also be the JSON of a message as a dictionary.
+
+        Returns
+        -------
+        :class:`Dict[]`
+            The message that was created, or None if it could not be sent.
+
+        """
+        url = f"{self.client.discord_http_api_base}/webhooks/{self.application_id}/{self.interaction_token}"
+        result = await self.sendJSON("POST", url, self.getMessageJSON(response), getattr(response, "attachments", None))
+        if result.status >= 400:
+            return None
+        return await result.json()
+
+    async def editOriginal(self, response):
+        """
+        Edits the first response to this interaction, or sends it if the interaction was deferred.
+
+        Parameters
+        -------
+        response: `InteractionResponseText`
+            The new message. This can also be the JSON of a message as a dictionary.
+
+        Returns
+        -------
+        :class:`Dict[]`
+            The message that was edited, or None if it could not be edited.
+
+        """
+        url = f"{self.client.discord_http_api_base}/webhooks/{self.application_id}/{self.interaction_token}/messages/@original"
+        result = await self.sendJSON("PATCH", url, self.getMessageJSON(response), getattr(response, "attachments", None))
+        if result.status >= 400:
+            return None
+        return await result.json()
+
+    async def deleteOriginal(self):
+        """
+        Deletes the first response to this interaction.
+
+        """
+        url = f"{self.client.discord_http_api_base}/webhooks/{self.application_id}/{self.interaction_token}/messages/@original"
+        await self.sendJSON("DELETE", url, None)
 
 class InteractionResponse:
     """
@@ -478,7 +618,8 @@ class InteractionResponse:
         """
         self.ephemeral = ephemeral
         self.interaction = interaction
-        self.url = f"https://discord.com/api/v10/interactions/{interaction.interaction_id}/{interaction.interaction_token}/callback"
+        api_base = interaction.client.discord_http_api_base if interaction.client != None else DISCORD_HTTP_API_BASE
+        self.url = f"{api_base}/interactions/{interaction.interaction_id}/{interaction.interaction_token}/callback"
 
 class InteractionResponseText(InteractionResponse):
     """
@@ -491,6 +632,7 @@ class InteractionResponseText(InteractionResponse):
     components : List[Component] = []
     action_rows : List[ActionRow] = []
     embeds : List[Embed] = []
+    attachments : List[Attachment] = []
     text : str = None
     flag : int = 0
 
@@ -516,6 +658,7 @@ class InteractionResponseText(InteractionResponse):
         self.action_rows = []
         self.components = []
         self.embeds = []
+        self.attachments = []
 
         flag = 0
         if ephemeral:
@@ -589,6 +732,24 @@ class InteractionResponseText(InteractionResponse):
         self.embeds.append(embed)
         self.generateJSON()
 
+    def addAttachment(self, attachment : Attachment):
+        """
+        Adds a file to the response. The file is uploaded when the response is sent.
+
+        Parameters
+        -------
+        attachment: `Attachment`
+            The file that you want to attach to this response.
+
+        Warning
+        -------
+        When sending this response through a `Message`, the attachments must also be given to the `Message`.
+
+        """
+
+        self.attachments.append(attachment)
+        self.generateJSON()
+
     def generateJSON(self):
         """
         Generates the JSON to be set in a HTTP request to the API endpoint for the action row.
@@ -632,6 +793,9 @@ class InteractionResponseText(InteractionResponse):
             }
         }
 
+        if len(self.attachments) != 0:
+            self.json["data"]["attachments"] = [attachment.generateJSON(id) for id, attachment in enumerate(self.attachments)]
+
         return self.json
 
 class InteractionResponseModal(InteractionResponse):
@@ -0,0 +1,175 @@
+# Receives interactions as HTTP requests instead of through the gateway.
+import asyncio
+import json
+import logging
+from aiohttp import web
+import nacl.signing
+from nacl.exceptions import BadSignatureError
+
+from .Message import InteractionCallbackType
+from .Attachments import createMultipart
+
+INTERACTION_TOKEN_LIFETIME : float = 15 * 60
+
+class InteractionServer():
+    """
+    A web server that receives interactions from discord through the Interactions Endpoint URL of your
+    application. Requests are verified with your application's public key, and the first response to
+    an interaction is returned in the body of the HTTP response, saving a request to the callback
+    endpoint. As no gateway connection is needed, many of these servers can run behind a load balancer.
+
+    """
+
+    client = None
+    verify_key : nacl.signing.VerifyKey = None
+    host : str = "0.0.0.0"
+    port : int = 8080
+    path : str = "/interactions"
+    response_timeout : float = 2.5
+    runner : web.AppRunner = None
+    logger : logging.Logger = None
+
+    def __init__(self, client, public_key : str, host : str = "0.0.0.0", port : int = 8080, path : str = "/interactions", response_timeout : float = 2.5) -> None:
+        """
+        Creates an interaction server. The server does not start until `start()` is awaited.
+
+        Parameters
+        -------
+        client: `Client.Client`
+            The client whose commands and message callbacks will handle the interactions.
+        public_key: `str`
+            The public key of your application, found on the discord developer portal.
+        host: `str`
+            The address the server listens on. Defaults to all addresses.
+        port: `int`
+            The port the server listens on. Defaults to 8080.
+        path: `str`
+            The path of the Interactions Endpoint URL. Defaults to `/interactions`.
+        response_timeout: `float`
+            How long to wait for a callback function to respond before deferring the response. Discord
+            requires a response within 3 seconds.
+
+        """
+        self.client = client
+        self.verify_key = nacl.signing.VerifyKey(bytes.fromhex(public_key))
+        self.host = host
+        self.port = port
+        self.path = path
+        self.response_timeout = response_timeout
+        self.logger = client.logger
+
+    def verifyRequest(self, signature : str, timestamp : str, body : bytes) -> bool:
+        """
+        Verifies that a request was sent by discord, using the Ed25519 signature in its headers.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the signature is valid.
+
+        """
+        if signature == None or timestamp == None:
+            return False
+        try:
+            self.verify_key.verify(timestamp.encode() + body, bytes.fromhex(signature))
+        except (BadSignatureError, ValueError):
+            return False
+        return True
+
+    def createResponse(self, response) -> web.Response:
+        if isinstance(response, (bytes, bytearray)):
+            # The JSON has already been serialized, such as by a ResponseTemplate.
+            return web.Response(body=response, content_type="application/json")
+        return web.Response(text=json.dumps(response), content_type="application/json")
+
+    async def handleRequest(self, request : web.Request) -> web.Response:
+        """
+        Handles a single interaction request. PINGs are answered immediately, autocomplete interactions
+        are answered from their index, and every other interaction is dispatched to its callback function.
+        The first response the callback function sends is returned as the body of this request.
+
+        """
+        body = await request.read()
+        if not self.verifyRequest(request.headers.get("X-Signature-Ed25519"), request.headers.get("X-Signature-Timestamp"), body):
+            return web.Response(status=401, text="invalid request signature")
+
+        interaction_data = json.loads(body)
+        self.logger.debug(interaction_data)
+
+        if interaction_data['type'] == 1:
+            return self.createResponse({"type": InteractionCallbackType.PONG})
+
+        if interaction_data['type'] == 4:
+            response = self.client.generateAutocompleteResponse(interaction_data)
+            if response == None:
+                response = {"type": InteractionCallbackType.APPLICATION_COMMAND_AUTOCOMPLETE_RESULT, "data": {"choices": []}}
+            return self.createResponse(response)
+
+        # Responses sent to the callback URL of this interaction are returned here instead.
+        url = self.client.discord_http_api_base + f"/interactions/{interaction_data['id']}/{interaction_data['token']}/callback"
+        future = asyncio.get_running_loop().create_future()
+        self.client.inline_responses[url] = future
+
+        if not self.client.dispatchInteraction(interaction_data):
+            self.client.inline_responses.pop(url, None)
+            self.logger.warning(f"No callback function found for interaction {interaction_data['id']}.")
+            return web.Response(status=404, text="unknown interaction")
+
+        try:
+            response, attachments = await asyncio.wait_for(future, self.response_timeout)
+        except asyncio.TimeoutError:
+            self.client.inline_responses.pop(url, None)
+            self.logger.warning(f"No response to interaction {interaction_data['id']} within {self.response_timeout} seconds, deferring.")
+            # The callback function's response is sent later by editing the original response instead.
+            self.client.deferred_responses[url] = self.client.discord_http_api_base + f"/webhooks/{interaction_data['application_id']}/{interaction_data['token']}/messages/@original"
+            # Interaction tokens expire after 15 minutes, so responses that never come are forgotten.
+            asyncio.get_running_loop().call_later(INTERACTION_TOKEN_LIFETIME, self.client.deferred_responses.pop, url, None)
+            return self.createResponse(self.createDeferredResponse(interaction_data))
+
+        if attachments:
+            # Files cannot be returned in the HTTP response, so the interaction is deferred and the files
+            # are uploaded by editing the original response once the deferral has been sent.
+            deferred = self.createResponse(self.createDeferredResponse(interaction_data))
+            await deferred.prepare(request)
+            await deferred.write_eof()
+            await self.uploadAttachments(interaction_data, response, attachments)
+            return deferred
+        return self.createResponse(response)
+
+    def createDeferredResponse(self, interaction_data):
+        if interaction_data['type'] == 2:
+            return {"type": InteractionCallbackType.DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE}
+        return {"type": InteractionCallbackType.DEFERRED_UPDATE_MESSAGE}
+
+    async def uploadAttachments(self, interaction_data, response, attachments):
+        """
+        Sends a response with attachments by editing the original response of a deferred interaction.
+
+        """
+        url = self.client.discord_http_api_base + f"/webhooks/{interaction_data['application_id']}/{interaction_data['token']}/messages/@original"
+        message_json = response["data"] if isinstance(response, dict) else json.loads(response)["data"]
+        result = await self.client.session.patch(url, data=createMultipart(message_json, attachments))
+        if result.status >= 400:
+            self.logger.error(f"Uploading attachments for interaction {interaction_data['id']} failed with status {result.status}: {await result.text()}")
+
+    async def start(self):
+        """
+        Starts the web server. This returns once the server is listening.
+
+        """
+        app = web.Application()
+        app.router.add_post(self.path, self.handleRequest)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.logger.info(f"Interaction server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """
+        Stops the web server.
+
+        """
+        if self.runner != None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -3,7 +3,13 @@
 from enum import Enum, IntEnum
 import aiohttp
 import asyncio
+import json
 import logging
+import time
+from .Attachments import createMultipart
+
+# The default base URL of the discord REST API. Clients can point elsewhere, such as to a MockDiscordServer.
+DISCORD_HTTP_API_BASE = "https://discord.com/api/v10"
 
 class HTTPMethods(Enum):
     GET = 1
@@ -20,19 +26,44 @@ class InteractionCallbackType(IntEnum):
     APPLICATION_COMMAND_AUTOCOMPLETE_RESULT = 8
     MODAL = 9
 
+def takeDeferredEdit(client, url : str, response):
+    """
+    Returns the URL and message JSON that a response to an interaction deferred by an `InteractionServer`
+    should be sent as, or None if the interaction was not deferred. The interaction has already been
+    acknowledged, so the message is sent by editing its original response instead of to its callback URL.
+    The message JSON is None if the response only defers the interaction again.
+
+    """
+    original_url = client.deferred_responses.get(url)
+    if original_url == None:
+        return None
+    if isinstance(response, (bytes, bytearray)):
+        response = json.loads(response)
+    if response.get("type") in (InteractionCallbackType.DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE, InteractionCallbackType.DEFERRED_UPDATE_MESSAGE):
+        # Deferring again would fail, and the message that follows still needs to edit the original response.
+        return original_url, None
+    del client.deferred_responses[url]
+    return original_url, response.get("data") or {}
+
 class Message:
     url : str = None
     method = None
     json = None
     client = None
     logger = None
+    attachments = None
+    created_at : float = None
 
-    def __init__(self, url, method, json, client) -> None:
+    def __init__(self, url, method, json, client, attachments=None) -> None:
         self.url = url
         self.method = method
         self.json = json
         self.client = client
+        # Files uploaded with the message. The JSON must describe them in its attachments field.
+        self.attachments = attachments
         self.logger = logging.getLogger("Logging")
+        # Used to measure how long the message waited in the message queue.
+        self.created_at = time.monotonic()
 
     async def performHTTPAction(self, http : aiohttp.ClientSession):
         self.headers = {
@@ -42,8 +73,39 @@ class Message:
         if self.method == HTTPMethods.GET:
             return
         if self.method == HTTPMethods.POST:
+            future = self.client.inline_responses.pop(self.url, None)
+            if future != None and not future.done():
+                # The interaction was received by an InteractionServer, which sends this as its HTTP response.
+                future.set_result((self.json, self.attachments))
+                return
+            deferred = takeDeferredEdit(self.client, self.url, self.json)
+            if deferred != None:
+                url, message_json = deferred
+                if message_json == None:
+                    return
+                self.logger.debug(f"Interaction was deferred, editing the original response: {message_json}")
+                start = time.perf_counter()
+                if self.attachments:
+                    result = await http.patch(url=url, data=createMultipart(message_json, self.attachments))
+                else:
+                    result = await http.patch(url=url, json=message_json)
+                if self.client.metrics != None:
+                    self.client.metrics.observeResponse("PATCH", result, time.perf_counter() - start)
+                if result.status >= 400:
+                    self.logger.error(f"Editing deferred response failed with status {result.status}: {await result.text()}")
+                return
             self.logger.debug(f"Sending JSON: {self.json} to {self.url}")
-            result = await http.post(url=self.url, json=self.json, headers=self.headers)
+            start = time.perf_counter()
+            if self.attachments:
+                result = await http.post(url=self.url, data=createMultipart(self.json, self.attachments), headers=self.headers)
+            elif isinstance(self.json, (bytes, bytearray)):
+                # The JSON has already been serialized, such as by a ResponseTemplate.
+                self.headers["Content-Type"] = "application/json"
+                result = await http.post(url=self.url, data=self.json, headers=self.headers)
+            else:
+                result = await http.post(url=self.url, json=self.json, headers=self.headers)
+            if self.client.metrics != None:
+                self.client.metrics.observeResponse("POST", result, time.perf_counter() - start)
             self.logger.debug(f"Posting from queue - Response: {result.status}")
             self.logger.debug(f"Text received: f{await result.text()}")
             return
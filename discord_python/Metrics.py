@@ -0,0 +1,356 @@
+# Counters, gauges and histograms of a client's internals, exposed in the Prometheus text format.
+import asyncio
+import bisect
+import logging
+import math
+import time
+from aiohttp import web
+
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Tuple
+)
+
+# Seconds, from 1ms to 10s, suiting request times and callback durations.
+DEFAULT_BUCKETS : Tuple[float] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def formatValue(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if math.isnan(value):
+            return "NaN"
+        return repr(value)
+    return str(int(value))
+
+def escapeLabelValue(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def formatLabels(names : Tuple[str], values : Tuple, extra : str = None) -> str:
+    pairs = [f'{name}="{escapeLabelValue(value)}"' for name, value in zip(names, values)]
+    if extra != None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def generateValueSamples(metric) -> List[str]:
+    # The samples of a counter or gauge, from its function if it has one.
+    values = metric.values
+    if metric.function != None:
+        values = metric.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+    return [f"{metric.name}{formatLabels(metric.labels, labels)} {formatValue(value)}" for labels, value in list(values.items()) if value != None]
+
+class Metric():
+    """
+    The base class of each type of metric. A metric has a value for every combination of label values
+    it has been given, with the label values passed as a tuple in the same order as `labels`.
+
+    """
+
+    type : str = "untyped"
+    name : str = None
+    help : str = None
+    labels : Tuple[str] = ()
+
+    def __init__(self, name : str, help : str, labels : Tuple[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def generateSamples(self) -> List[str]:
+        return []
+
+    def generateText(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += self.generateSamples()
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    """
+    A count that only increases, such as the amount of events received. Like a `Gauge`, a counter can be
+    given a function to read counts that are already kept elsewhere when the metrics are collected.
+
+    """
+
+    type : str = "counter"
+    values : Dict[Tuple, float] = None
+    function : Callable = None
+
+    def __init__(self, name : str, help : str, labels : Tuple[str] = (), function : Callable = None) -> None:
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.function = function
+
+    def inc(self, label_values : Tuple = (), amount : float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, label_values : Tuple = ()) -> float:
+        return self.values.get(label_values, 0)
+
+    def generateSamples(self) -> List[str]:
+        return generateValueSamples(self)
+
+class Gauge(Metric):
+    """
+    A value that can go up and down. Instead of being set, a gauge can be given a function that is called
+    every time the metrics are collected, which returns the value, or a dictionary of values keyed by their
+    label values. Values that are None are left out.
+
+    """
+
+    type : str = "gauge"
+    values : Dict[Tuple, float] = None
+    function : Callable = None
+
+    def __init__(self, name : str, help : str, labels : Tuple[str] = (), function : Callable = None) -> None:
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.function = function
+
+    def set(self, value : float, label_values : Tuple = ()):
+        self.values[label_values] = value
+
+    def get(self, label_values : Tuple = ()) -> float:
+        return self.values.get(label_values)
+
+    def generateSamples(self) -> List[str]:
+        return generateValueSamples(self)
+
+class Histogram(Metric):
+    """
+    Counts observations, such as durations, in buckets of upper bounds, along with their count and sum.
+
+    """
+
+    type : str = "histogram"
+    buckets : Tuple[float] = DEFAULT_BUCKETS
+    values : Dict[Tuple, List] = None
+
+    def __init__(self, name : str, help : str, labels : Tuple[str] = (), buckets : Tuple[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value : float, label_values : Tuple = ()):
+        state = self.values.get(label_values)
+        if state == None:
+            # The count in each bucket, then the total count and sum.
+            state = self.values[label_values] = [[0] * len(self.buckets), 0, 0.0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[0][index] += 1
+        state[1] += 1
+        state[2] += value
+
+    def getCount(self, label_values : Tuple = ()) -> int:
+        state = self.values.get(label_values)
+        return state[1] if state != None else 0
+
+    def generateSamples(self) -> List[str]:
+        lines = []
+        for label_values, (counts, count, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = formatLabels(self.labels, label_values, 'le="' + formatValue(float(bound)) + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = formatLabels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{formatLabels(self.labels, label_values)} {formatValue(total)}")
+            lines.append(f"{self.name}_count{formatLabels(self.labels, label_values)} {count}")
+        return lines
+
+class MetricsRegistry():
+    """
+    A collection of metrics that can be rendered in the Prometheus text exposition format, and
+    optionally served over HTTP for Prometheus to scrape.
+
+    """
+
+    metrics : Dict[str, Metric] = None
+    runner : web.AppRunner = None
+
+    def __init__(self) -> None:
+        self.metrics = {}
+        self.logger = logging.getLogger("Logging")
+
+    def register(self, metric : Metric) -> Metric:
+        """
+        Adds a metric to the registry, and returns it.
+
+        Raises
+        -------
+        ValueError
+            Raised if a metric with the same name is already registered.
+
+        """
+        if metric.name in self.metrics:
+            raise ValueError(f"A metric named {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name : str, help : str, labels : Tuple[str] = (), function : Callable = None) -> Counter:
+        return self.register(Counter(name, help, labels, function))
+
+    def gauge(self, name : str, help : str, labels : Tuple[str] = (), function : Callable = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, function))
+
+    def histogram(self, name : str, help : str, labels : Tuple[str] = (), buckets : Tuple[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def generateText(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        """
+        sections = []
+        for metric in list(self.metrics.values()):
+            try:
+                sections.append(metric.generateText())
+            except Exception as e:
+                # A failing gauge function should not stop the other metrics from being collected.
+                self.logger.warning(f"Could not collect metric {metric.name}: {e!r}")
+        return "".join(sections)
+
+    async def handleRequest(self, request : web.Request) -> web.Response:
+        return web.Response(text=self.generateText(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self, host : str = "127.0.0.1", port : int = 9100, path : str = "/metrics"):
+        """
+        Starts serving the metrics over HTTP. This returns once the server is listening.
+
+        Parameters
+        -------
+        host: `str`
+            The address the server listens on. Defaults to only local connections.
+        port: `int`
+            The port the server listens on.
+        path: `str`
+            The path the metrics are served at.
+
+        """
+        app = web.Application()
+        app.router.add_get(path, self.handleRequest)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.logger.info(f"Serving metrics on http://{host}:{port}{path}")
+
+    async def serve(self, host : str = "127.0.0.1", port : int = 9100, path : str = "/metrics"):
+        """
+        Serves the metrics over HTTP until cancelled. This can be registered with `Client.registerAsyncEvent()`.
+
+        """
+        await self.start(host, port, path)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """
+        Stops serving the metrics.
+
+        """
+        if self.runner != None:
+            await self.runner.cleanup()
+            self.runner = None
+
+class ClientMetrics(MetricsRegistry):
+    """
+    The metrics of a `Client`. Counters and histograms are updated as the client runs, and gauges such
+    as queue depth, task count and voice statistics are read from the client when the metrics are collected.
+
+    """
+
+    client = None
+
+    def __init__(self, client) -> None:
+        super().__init__()
+        self.client = client
+
+        self.gateway_messages = self.counter("discord_gateway_messages_total", "Gateway messages received, by opcode.", ("op",))
+        self.gateway_events = self.counter("discord_gateway_events_total", "Gateway dispatch events received, by type.", ("type",))
+        self.heartbeat_latency = self.histogram("discord_gateway_heartbeat_latency_seconds", "Time from sending a gateway heartbeat to its acknowledgement.")
+        self.gauge("discord_gateway_latency_seconds", "The latest gateway heartbeat round trip time.", function=lambda: client.latency)
+
+        self.gauge("discord_http_queue_depth", "Messages waiting in the message queue.", function=lambda: len(client.messageQueue))
+        self.queue_wait = self.histogram("discord_http_queue_wait_seconds", "Time messages waited in the message queue before being sent.")
+        self.request_duration = self.histogram("discord_http_request_duration_seconds", "Time taken by HTTP requests to discord.", ("method",))
+        self.responses = self.counter("discord_http_responses_total", "HTTP responses from discord, by status code.", ("status",))
+        self.rate_limited = self.counter("discord_http_rate_limited_total", "HTTP requests rejected with a 429, by rate limit bucket and scope.", ("bucket", "scope"))
+
+        self.callback_duration = self.histogram("discord_callback_duration_seconds", "Time taken by command and component callbacks.", ("callback",))
+        self.callback_errors = self.counter("discord_callback_errors_total", "Command and component callbacks that raised an exception.", ("callback",))
+        self.gauge("discord_asyncio_tasks", "Tasks alive in the event loop.", function=self.countTasks)
+
+        self.gauge("discord_registered_commands", "Application commands registered with the client.", function=lambda: len(client.commands))
+        self.gauge("discord_message_callbacks", "Message component callbacks registered with the client.", function=lambda: len(client.message_callbacks))
+        self.gauge("discord_pending_inline_responses", "Interactions from an InteractionServer waiting for their first response.", function=lambda: len(client.inline_responses))
+
+        self.gauge("discord_voice_connections", "Voice connections, by whether they are playing.", ("playing",), function=self.countVoiceConnections)
+        self.counter("discord_voice_packets_sent_total", "Voice packets sent, by guild.", ("guild",),
+            function=lambda: {(guild_id,): voice_client.packets_sent for guild_id, voice_client in list(client.voice_clients.items())})
+        self.counter("discord_voice_underruns_total", "Frames where audio was not ready in time, by guild.", ("guild",),
+            function=lambda: {(guild_id,): voice_client.underruns for guild_id, voice_client in list(client.voice_clients.items())})
+        self.gauge("discord_voice_latency_seconds", "The latest voice websocket round trip time, by guild.", ("guild",),
+            function=lambda: {(guild_id,): latency for guild_id, latency in client.getVoiceLatencies().items()})
+        self.counter("discord_voice_packets_received_total", "Voice packets received from other users, by guild and result.", ("guild", "result"), function=self.countReceivedPackets)
+        self.counter("discord_voice_scheduler_ticks_total", "Voice scheduler ticks run, late, and skipped to catch up.", ("kind",), function=self.countSchedulerTicks)
+
+    def countTasks(self) -> int:
+        try:
+            return len(asyncio.all_tasks())
+        except RuntimeError:
+            # Collected from outside the event loop.
+            return None
+
+    def countVoiceConnections(self) -> Dict[Tuple, int]:
+        playing = sum(1 for voice_client in list(self.client.voice_clients.values()) if voice_client.is_playing)
+        return {("true",): playing, ("false",): len(self.client.voice_clients) - playing}
+
+    def countReceivedPackets(self) -> Dict[Tuple, int]:
+        values = {}
+        for guild_id, voice_client in list(self.client.voice_clients.items()):
+            receiver = voice_client.receiver
+            buffers = list(receiver.buffers.values())
+            values[(guild_id, "received")] = sum(buffer.received for buffer in buffers)
+            values[(guild_id, "lost")] = sum(buffer.lost for buffer in buffers)
+            values[(guild_id, "late")] = sum(buffer.late for buffer in buffers)
+            values[(guild_id, "error")] = receiver.errors
+        return values
+
+    def countSchedulerTicks(self) -> Dict[Tuple, int]:
+        scheduler = self.client.voice_scheduler
+        if scheduler == None:
+            return {}
+        return {("total",): scheduler.ticks, ("late",): scheduler.late_ticks, ("skipped",): scheduler.skipped_ticks}
+
+    def observeResponse(self, method : str, response, duration : float):
+        """
+        Records the status, duration and any rate limit of a response from discord.
+
+        """
+        self.request_duration.observe(duration, (method,))
+        self.responses.inc((str(response.status),))
+        if response.status == 429:
+            headers = response.headers
+            self.rate_limited.inc((headers.get("X-RateLimit-Bucket", "unknown"), headers.get("X-RateLimit-Scope", "unknown")))
+
+    async def timeCallback(self, name : str, coroutine):
+        """
+        Runs a command or component callback, recording how long it took and whether it raised.
+
+        """
+        start = time.perf_counter()
+        try:
+            return await coroutine
+        except Exception:
+            self.callback_errors.inc((name,))
+            raise
+        finally:
+            self.callback_duration.observe(time.perf_counter() - start, (name,))
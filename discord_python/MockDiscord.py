@@ -0,0 +1,527 @@
+# A local stand-in for the discord gateway and REST API, for testing and load testing without discord.
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import random
+import time
+from aiohttp import web
+
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Tuple
+)
+
+# The path segments whose id is part of a rate limit bucket, as described by discord's documentation.
+MAJOR_PARAMETERS = ("channels", "guilds", "webhooks", "interactions")
+
+def createInteractionEvent(rng : random.Random, sequence : int, command_name : str = "ping", application_id : str = "100000000000000001") -> Tuple[str, Dict]:
+    """
+    Creates a synthetic INTERACTION_CREATE event for an application command, with a member and an
+    option, similar in size to those sent by discord.
+
+    """
+    user_id = str(200000000000000000 + rng.randrange(100000))
+    guild_id = str(300000000000000000 + rng.randrange(100))
+    return "INTERACTION_CREATE", {
+        "id": str(400000000000000000 + sequence),
+        "application_id": application_id,
+        "type": 2,
+        "token": f"mock-token-{sequence}-{rng.getrandbits(64):016x}",
+        "version": 1,
+        "guild_id": guild_id,
+        "channel_id": str(500000000000000000 + rng.randrange(1000)),
+        "locale": "en-GB",
+        "guild_locale": "en-US",
+        "app_permissions": "562949953421311",
+        "entitlements": [],
+        "member": {
+            "user": {"id": user_id, "username": f"user{user_id[-5:]}", "global_name": None, "avatar": None, "discriminator": "0", "public_flags": 0},
+            "roles": [str(600000000000000000 + rng.randrange(50)) for _ in range(rng.randrange(1, 4))],
+            "nick": None,
+            "joined_at": "2023-01-01T00:00:00.000000+00:00",
+            "permissions": "562949953421311",
+            "deaf": False,
+            "mute": False,
+            "pending": False,
+            "flags": 0,
+        },
+        "data": {
+            "id": "700000000000000001",
+            "name": command_name,
+            "type": 1,
+            "options": [{"name": "text", "type": 3, "value": "".join(rng.choice("abcdefghij ") for _ in range(rng.randrange(5, 40)))}],
+        },
+    }
+
+def createMessageEvent(rng : random.Random, sequence : int) -> Tuple[str, Dict]:
+    """
+    Creates a synthetic MESSAGE_CREATE event.
+
+    """
+    user_id = str(200000000000000000 + rng.randrange(100000))
+    return "MESSAGE_CREATE", {
+        "id": str(800000000000000000 + sequence),
+        "type": 0,
+        "channel_id": str(500000000000000000 + rng.randrange(1000)),
+        "guild_id": str(300000000000000000 + rng.randrange(100)),
+        "author": {"id": user_id, "username": f"user{user_id[-5:]}", "avatar": None, "discriminator": "0", "public_flags": 0},
+        "content": "".join(rng.choice("abcdefghij ") for _ in range(rng.randrange(10, 200))),
+        "timestamp": "2024-01-01T00:00:00.000000+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "flags": 0,
+        "nonce": str(rng.getrandbits(60)),
+    }
+
+def createGuildCreateEvent(rng : random.Random, sequence : int, members : int = 100, channels : int = 30, roles : int = 20) -> Tuple[str, Dict]:
+    """
+    Creates a synthetic GUILD_CREATE event, like those sent for every guild after READY.
+
+    """
+    guild_id = str(300000000000000000 + sequence)
+    return "GUILD_CREATE", {
+        "id": guild_id,
+        "name": f"Guild {sequence}",
+        "icon": None,
+        "owner_id": str(200000000000000000 + rng.randrange(100000)),
+        "member_count": members,
+        "large": members > 250,
+        "unavailable": False,
+        "joined_at": "2023-01-01T00:00:00.000000+00:00",
+        "features": [],
+        "roles": [{"id": str(600000000000000000 + index), "name": f"role-{index}", "color": rng.randrange(0xFFFFFF), "hoist": False,
+            "position": index, "permissions": str(rng.getrandbits(40)), "managed": False, "mentionable": False} for index in range(roles)],
+        "channels": [{"id": str(500000000000000000 + sequence * 1000 + index), "type": rng.choice((0, 2, 4)), "name": f"channel-{index}",
+            "position": index, "permission_overwrites": [], "parent_id": None} for index in range(channels)],
+        "members": [{"user": {"id": str(200000000000000000 + rng.randrange(100000)), "username": f"user{index}", "avatar": None, "discriminator": "0"},
+            "roles": [str(600000000000000000 + rng.randrange(roles))] if roles else [], "joined_at": "2023-01-01T00:00:00.000000+00:00",
+            "deaf": False, "mute": False, "flags": 0} for index in range(members)],
+        "voice_states": [],
+        "presences": [],
+        "threads": [],
+    }
+
+class RateLimitBucket():
+    """
+    The rate limit of a single route, allowing `limit` requests every `period` seconds.
+
+    """
+
+    limit : int = 5
+    period : float = 5
+    remaining : int = 5
+    reset_at : float = 0
+    hits : int = 0
+
+    def __init__(self, name : str, limit : int, period : float) -> None:
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.remaining = limit
+        self.reset_at = 0
+        self.hits = 0
+
+    def take(self, now : float) -> bool:
+        """
+        Uses one request from the bucket, returning False if the bucket is exhausted.
+
+        """
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.period
+        if self.remaining == 0:
+            self.hits += 1
+            return False
+        self.remaining -= 1
+        return True
+
+    def headers(self, now : float) -> Dict[str, str]:
+        reset_after = max(0, self.reset_at - now)
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": f"{time.time() + reset_after:.3f}",
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            "X-RateLimit-Bucket": self.name,
+        }
+
+class MockGatewaySession():
+    """
+    The state of one gateway session, kept after its websocket closes so that it can be resumed.
+
+    """
+
+    session_id : str = None
+    sequence : int = 0
+    ws : web.WebSocketResponse = None
+    # Every dispatch sent, so a resume can replay the events that were missed.
+    events : collections.deque = None
+    stream_task : asyncio.Task = None
+    # The synthetic events sent so far, which carries on from where it was after a resume.
+    streamed : int = 0
+
+    def __init__(self, session_id : str, max_events : int = 10000) -> None:
+        self.session_id = session_id
+        self.sequence = 0
+        self.events = collections.deque(maxlen=max_events)
+        self.streamed = 0
+
+class MockDiscordServer():
+    """
+    A local server that behaves enough like discord for a `Client` to connect, receive events and send
+    requests, without a network connection or a bot token.
+
+    The gateway sends HELLO, acknowledges heartbeats, answers IDENTIFY with READY and RESUME with the
+    missed events followed by RESUMED, and can send RECONNECT (op 7) and INVALID SESSION (op 9). Once a
+    session is ready, synthetic dispatch events are sent at the configured rate.
+
+    The REST API accepts any request under `/api/v10`. Each route has a rate limit bucket and the bot
+    has a global limit, reported with discord's rate limit headers, and requests over either limit are
+    answered with a 429. Interaction and webhook routes are not part of the global limit. Every request
+    is recorded, so the requests a test made can be checked afterwards.
+
+    Events are generated from a seeded random number generator, so the same settings always produce the
+    same events.
+
+    """
+
+    host : str = "127.0.0.1"
+    port : int = 0
+    heartbeat_interval : int = 41250
+    event_rate : float = 0
+    event_count : int = None
+    event_factory : Callable = None
+    route_limit : int = 5
+    route_period : float = 5
+    global_limit : int = 50
+    seed : int = 0
+    application_id : str = "100000000000000001"
+    user_id : str = "100000000000000002"
+
+    sessions : Dict[str, MockGatewaySession] = None
+    buckets : Dict[str, RateLimitBucket] = None
+    requests : List[Tuple[float, str, str, int]] = None
+    received : List[Dict] = None
+    events_sent : int = 0
+    runner : web.AppRunner = None
+
+    def __init__(self, host : str = "127.0.0.1", port : int = 0, heartbeat_interval : int = 41250, event_rate : float = 0, event_count : int = None,
+            event_factory : Callable = None, route_limit : int = 5, route_period : float = 5, global_limit : int = 50, seed : int = 0) -> None:
+        """
+        Creates a mock server. The server does not start until `start()` is awaited.
+
+        Parameters
+        -------
+        host: `str`
+            The address the server listens on.
+        port: `int`
+            The port the server listens on. Defaults to any free port, which is available as `port` once started.
+        heartbeat_interval: `int`
+            The heartbeat interval sent in HELLO, in milliseconds.
+        event_rate: `float`
+            The dispatch events sent per second to each ready session. 0 sends no events, and None sends
+            them as fast as possible.
+        event_count: `int`
+            The amount of events sent to each session. Defaults to no limit.
+        event_factory: `Callable[[random.Random, int], Tuple[str, Dict]]`
+            Creates the type and data of each event from the random number generator and the event's number.
+            Defaults to `createInteractionEvent`.
+        route_limit: `int`
+            The requests allowed in each route's rate limit bucket per `route_period`.
+        route_period: `float`
+            The length of each route's rate limit window in seconds.
+        global_limit: `int`
+            The requests per second allowed across all routes that are part of the global limit.
+        seed: `int`
+            The seed of the random number generator used for events.
+
+        """
+        self.host = host
+        self.port = port
+        self.heartbeat_interval = heartbeat_interval
+        self.event_rate = event_rate
+        self.event_count = event_count
+        self.event_factory = event_factory if event_factory != None else createInteractionEvent
+        self.route_limit = route_limit
+        self.route_period = route_period
+        self.global_limit = global_limit
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.sessions = {}
+        self.buckets = {}
+        self.global_bucket = RateLimitBucket("global", global_limit, 1)
+        self.requests = []
+        self.received = []
+        self.events_sent = 0
+        self.logger = logging.getLogger("Logging")
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def api_base(self) -> str:
+        """
+        The URL to use as a client's `discord_http_api_base`.
+
+        """
+        return self.base_url + "/api/v10"
+
+    @property
+    def oauth_base(self) -> str:
+        """
+        The URL to use as a client's `discord_http_oauth_base`.
+
+        """
+        return self.base_url + "/api/oauth2"
+
+    @property
+    def gateway_url(self) -> str:
+        return f"ws://{self.host}:{self.port}/gateway"
+
+    def configureClient(self, client):
+        """
+        Points a client's REST API URLs at this server.
+
+        """
+        client.discord_http_api_base = self.api_base
+        client.discord_http_oauth_base = self.oauth_base
+
+    async def start(self):
+        """
+        Starts the server. This returns once the server is listening.
+
+        """
+        app = web.Application()
+        app.router.add_get("/gateway", self.handleGateway)
+        app.router.add_get("/api/v10/gateway/bot", self.handleGatewayBot)
+        app.router.add_get("/api/oauth2/applications/@me", self.handleApplication)
+        app.router.add_route("*", "/api/v10/{path:.*}", self.handleREST)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.logger.info(f"Mock discord server listening on {self.base_url}")
+
+    async def stop(self):
+        """
+        Stops the server, closing every gateway connection.
+
+        """
+        for session in self.sessions.values():
+            if session.stream_task != None:
+                session.stream_task.cancel()
+            if session.ws != None:
+                await session.ws.close()
+        if self.runner != None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    # Gateway
+
+    async def send(self, ws : web.WebSocketResponse, op : int, d = None, t : str = None, s : int = None):
+        await ws.send_str(json.dumps({"op": op, "d": d, "s": s, "t": t}))
+
+    async def dispatch(self, session : MockGatewaySession, t : str, d : Dict):
+        """
+        Sends a dispatch event to a session, numbering it with the session's next sequence.
+
+        """
+        session.sequence += 1
+        payload = json.dumps({"op": 0, "d": d, "s": session.sequence, "t": t})
+        session.events.append((session.sequence, payload))
+        self.events_sent += 1
+        if session.ws != None and not session.ws.closed:
+            await session.ws.send_str(payload)
+
+    async def handleGateway(self, request : web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await self.send(ws, 10, {"heartbeat_interval": self.heartbeat_interval})
+        session = None
+
+        async for message in ws:
+            if message.type != web.WSMsgType.TEXT:
+                continue
+            payload = json.loads(message.data)
+            self.received.append(payload)
+            op = payload.get("op")
+            if op == 1:
+                await self.send(ws, 11)
+            elif op == 2:
+                session = self.identify(ws)
+                await self.dispatch(session, "READY", {
+                    "v": 10,
+                    "user": {"id": self.user_id, "username": "mock-bot", "discriminator": "0", "bot": True},
+                    "guilds": [],
+                    "session_id": session.session_id,
+                    "resume_gateway_url": self.gateway_url,
+                    "application": {"id": self.application_id, "flags": 0},
+                })
+                self.startStream(session)
+            elif op == 6:
+                session = await self.resume(ws, payload["d"])
+        if session != None and session.ws is ws:
+            session.ws = None
+        return ws
+
+    def identify(self, ws : web.WebSocketResponse) -> MockGatewaySession:
+        session_id = hashlib.sha1(f"{self.seed}-{len(self.sessions)}".encode()).hexdigest()
+        session = MockGatewaySession(session_id)
+        session.ws = ws
+        self.sessions[session_id] = session
+        return session
+
+    async def resume(self, ws : web.WebSocketResponse, d : Dict) -> MockGatewaySession:
+        session = self.sessions.get(d.get("session_id"))
+        sequence = d.get("seq") or 0
+        if session == None or (session.events and session.events[0][0] > sequence + 1):
+            # Unknown session, or the missed events are no longer kept.
+            await self.send(ws, 9, False)
+            return None
+        if session.ws != None and not session.ws.closed:
+            await session.ws.close()
+        session.ws = ws
+        for event_sequence, payload in list(session.events):
+            if event_sequence > sequence:
+                await ws.send_str(payload)
+        await self.dispatch(session, "RESUMED", None)
+        self.startStream(session)
+        return session
+
+    def startStream(self, session : MockGatewaySession):
+        if self.event_rate == 0 or (session.stream_task != None and not session.stream_task.done()):
+            return
+        session.stream_task = asyncio.get_running_loop().create_task(self.streamEvents(session))
+
+    async def streamEvents(self, session : MockGatewaySession):
+        """
+        Sends events to a session at `event_rate` per second until `event_count` have been sent. Events are
+        scheduled against a monotonic clock, so the rate does not drift when sending falls behind.
+
+        """
+        start = time.monotonic()
+        # Paced from where the stream was, so a resumed session does not receive a burst of events.
+        start -= session.streamed / self.event_rate if self.event_rate else 0
+        while self.event_count == None or session.streamed < self.event_count:
+            sent = session.streamed
+            if session.ws == None or session.ws.closed:
+                # Paused until the session is resumed.
+                return
+            if self.event_rate == None:
+                due = 100
+            else:
+                due = int((time.monotonic() - start) * self.event_rate) + 1 - sent
+                if due <= 0:
+                    await asyncio.sleep((sent + 1) / self.event_rate - (time.monotonic() - start))
+                    continue
+            if self.event_count != None:
+                due = min(due, self.event_count - sent)
+            for _ in range(due):
+                session.streamed += 1
+                t, d = self.event_factory(self.rng, session.sequence + 1)
+                await self.dispatch(session, t, d)
+            await asyncio.sleep(0)
+
+    async def requestReconnect(self):
+        """
+        Sends RECONNECT (op 7) to every connected session, asking the clients to resume on a new connection.
+
+        """
+        for session in self.sessions.values():
+            if session.ws != None and not session.ws.closed:
+                await self.send(session.ws, 7)
+
+    async def invalidateSessions(self, resumable : bool = False):
+        """
+        Sends INVALID SESSION (op 9) to every connected session. Sessions that are not resumable are forgotten.
+
+        """
+        for session_id, session in list(self.sessions.items()):
+            if session.ws != None and not session.ws.closed:
+                await self.send(session.ws, 9, resumable)
+            if not resumable:
+                if session.stream_task != None:
+                    session.stream_task.cancel()
+                del self.sessions[session_id]
+
+    # REST
+
+    async def handleGatewayBot(self, request : web.Request) -> web.Response:
+        return web.json_response({"url": self.gateway_url, "shards": 1, "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}})
+
+    async def handleApplication(self, request : web.Request) -> web.Response:
+        return web.json_response({"id": self.application_id, "name": "mock-application", "bot": {"id": self.user_id}})
+
+    def getBucket(self, method : str, path : str) -> RateLimitBucket:
+        # Ids are replaced in the route, except for major parameters, which give each channel, guild,
+        # webhook and interaction its own bucket.
+        segments = path.strip("/").split("/")
+        route = []
+        for index, segment in enumerate(segments):
+            previous = segments[index - 1] if index > 0 else None
+            if segment.isdigit() and previous not in MAJOR_PARAMETERS:
+                route.append(":id")
+            else:
+                route.append(segment)
+        key = method + " /" + "/".join(route)
+        bucket = self.buckets.get(key)
+        if bucket == None:
+            name = hashlib.sha1(key.encode()).hexdigest()[:16]
+            bucket = self.buckets[key] = RateLimitBucket(name, self.route_limit, self.route_period)
+        return bucket
+
+    def rateLimited(self, bucket : RateLimitBucket, now : float, scope : str) -> web.Response:
+        retry_after = max(0, bucket.reset_at - now)
+        headers = bucket.headers(now)
+        headers["Retry-After"] = f"{retry_after:.3f}"
+        headers["X-RateLimit-Scope"] = scope
+        if scope == "global":
+            headers["X-RateLimit-Global"] = "true"
+        return web.json_response({"message": "You are being rate limited.", "retry_after": retry_after, "global": scope == "global"}, status=429, headers=headers)
+
+    async def handleREST(self, request : web.Request) -> web.Response:
+        path = request.match_info["path"]
+        now = time.monotonic()
+        await request.read()
+
+        segments = path.split("/")
+        # Interactions and webhooks are authenticated by their token, and do not count towards the global limit.
+        if segments[0] not in ("interactions", "webhooks") and not self.global_bucket.take(now):
+            response = self.rateLimited(self.global_bucket, now, "global")
+        else:
+            bucket = self.getBucket(request.method, path)
+            if not bucket.take(now):
+                response = self.rateLimited(bucket, now, "user")
+            elif segments[0] == "interactions" and segments[-1] == "callback":
+                response = web.Response(status=204, headers=bucket.headers(now))
+            else:
+                response = web.json_response({"id": str(900000000000000000 + len(self.requests))}, headers=bucket.headers(now))
+        self.requests.append((now, request.method, "/" + path, response.status))
+        return response
+
+    def getStatistics(self) -> Dict:
+        """
+        Returns counts of the requests received, by status and by route, and the rate limit hits of each bucket.
+
+        """
+        statuses = collections.Counter(status for _, _, _, status in self.requests)
+        return {
+            "requests": len(self.requests),
+            "statuses": dict(statuses),
+            "rate_limited": statuses.get(429, 0),
+            "global_rate_limited": self.global_bucket.hits,
+            "bucket_hits": {key: bucket.hits for key, bucket in self.buckets.items() if bucket.hits},
+            "events_sent": self.events_sent,
+        }
@@ -1,89 +1,218 @@
-
 from typing import (
-    IO
+    IO,
+    List
 )
 
+import mmap
+import logging
 import struct
 
+# Capture pattern, version, header type, granule position, serial number, page sequence number,
+# checksum and the number of segments.
+OGG_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+
+CONTINUED_PACKET = 0x01
+
+def generate_crc_table():
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+CRC_TABLE = generate_crc_table()
+
+def ogg_crc(data, crc : int = 0) -> int:
+    """
+    Calculates the CRC used by Ogg pages, which uses the polynomial 0x04C11DB7 with no reflection.
+
+    """
+    table = CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+class OggPage():
+    granule : int = 0
+    serial : int = 0
+    sequence : int = 0
+    flags : int = 0
+    segment_table : bytes = None
+    body : memoryview = None
+    offset : int = 0
+
+    def __init__(self, granule, serial, sequence, flags, segment_table, body, offset) -> None:
+        self.granule = granule
+        self.serial = serial
+        self.sequence = sequence
+        self.flags = flags
+        self.segment_table = segment_table
+        self.body = body
+        self.offset = offset
+
 class OggStream():
+    """
+    Demuxes the packets of an Ogg stream. Data is read in large chunks, page headers are parsed
+    with `struct`, and packets are returned as memoryviews of the data read, so a packet is only
+    copied if it continues across pages. The stream can also be a buffer such as an mmap of a
+    file, in which case nothing is read at all.
+
+    """
     stream : IO[bytes] = None
-    segtable : bytes = None
-
-    def __init__(self, stream : IO[bytes]) -> None:
-        self.stream = stream
-
-    def parse_ogg_page(self):
-        #print(f'SEGTABLE: {self.segtable}')
-        if not self.segtable:
-            # HEADER - Check if starts with "OggS" (4 bytes)
-            header = self.stream.read(4)
-            #print(header)
-            #if header == b"OggS":
-            #    print("WE HAVE A PAGE!")
-            #else:
-            #    print(f"OggS header not found. Header was: {header}")
-            #    return b'', True
-            if header != b'OggS':
-                return b'', True
-            version = self.stream.read(1)
-            #print(f"VERSION: {version}")
-            flags = self.stream.read(1)
-            #print(f"FLAGS: {flags}")
-            #if flags[0] & 0x01 != 0:
-            #    print("contains continued data")
-            #if flags[0] & 0x02 != 0:
-            #    print("first page of logical bitstream")
-            #if flags[0] & 0x04 != 0:
-            #    print("last page of logical bitstream")
-            granule = self.stream.read(8)
-            #print(f"GRANULE: {granule}")
-            bitstream_serial_number = self.stream.read(4)
-            #print(f"SERIAL_NO: {bitstream_serial_number}")
-            page_sequence_number = self.stream.read(4)
-            #print(f"PAGE_SEQ_NO: {page_sequence_number}")
-            checksum = self.stream.read(4)
-            #print(f"CRC_CHECKSUM: {checksum}")
-            number_page_segments = self.stream.read(1)
-            #print(number_page_segments)
-            seg_table_length = int.from_bytes(number_page_segments, byteorder="little")
-            #print(f"PAGE_SEGMENTS_NO: {seg_table_length}")
-            segment_table = self.stream.read(seg_table_length)
-            #print(f"SEG_TABLE: {segment_table}")
-            self.segtable = segment_table
-
-        total_size = 0
-        final = 0
-        index = 0
-        for byte in self.segtable:
-            index += 1
-            #print(byte)
-            total_size += byte
-            final = byte
-            if byte != 255:
-                # This packet is only this big. Remove these packets from the list to read.
-                self.segtable = self.segtable[index:]
-                break
-
-        body = self.stream.read(total_size)
-
-        #print(body)
-        if final == 255:
-            return (body, False)
-        return (body, True)
+    buffer = None
+    view : memoryview = None
+    offset : int = 0
+    position : int = 0
+    chunk_size : int = 65536
+    verify_crc : bool = False
+    skip_headers : bool = True
+
+    def __init__(self, stream, verify_crc : bool = False, skip_headers : bool = True, chunk_size : int = 65536) -> None:
+        """
+        Creates an Ogg demuxer.
+
+        Parameters
+        -------
+        stream: `IO[bytes]`
+            The stream to read from. This can also be `bytes` or an `mmap` containing the whole file.
+        verify_crc: `bool`
+            Whether the checksum of every page is checked. Pages with an incorrect checksum are skipped.
+        skip_headers: `bool`
+            Whether the OpusHead and OpusTags header packets are skipped.
+        chunk_size: `int`
+            The amount of bytes read from the stream at once.
 
+        """
+        self.verify_crc = verify_crc
+        self.skip_headers = skip_headers
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger("Logging")
+        if isinstance(stream, memoryview):
+            stream = stream.tobytes()
+        if isinstance(stream, (bytes, bytearray, mmap.mmap)):
+            self.stream = None
+            self.buffer = stream
+        else:
+            self.stream = stream
+            self.buffer = b''
+            # read1 returns whatever is available, so a pipe does not wait for a whole chunk.
+            self.read_chunk = getattr(stream, "read1", stream.read)
+        self.view = memoryview(self.buffer)
+        self.offset = 0
+        self.position = 0
+
+    @classmethod
+    def fromFile(cls, path : str, **kwargs):
+        """
+        Creates an Ogg demuxer over a memory mapped file, so pages are parsed without reading the
+        file through system calls.
+
+        """
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, **kwargs)
+
+    def ensure(self, length : int) -> bool:
+        # Makes sure at least length bytes are available after the current offset. Only the
+        # unparsed end of the previous chunk is copied when more data is read.
+        while len(self.buffer) - self.offset < length:
+            if self.stream == None:
+                return False
+            chunk = self.read_chunk(max(self.chunk_size, length))
+            if not chunk:
+                return False
+            self.position += self.offset
+            self.buffer = b''.join((self.view[self.offset:], chunk))
+            self.view = memoryview(self.buffer)
+            self.offset = 0
+        return True
+
+    def seek(self, offset : int):
+        """
+        Moves to a byte offset in a buffer, such as the offset of a page. Streams cannot be seeked.
+
+        """
+        if self.stream != None:
+            raise ValueError("Only Ogg streams over a buffer can be seeked.")
+        self.offset = offset
 
     def iterate_pages(self):
-        partial = b''
-        page, complete = self.parse_ogg_page()
-        while page:
-            partial += page
-            if complete:
-                yield partial
-                partial = b''
-            page, complete = self.parse_ogg_page()
-            
+        """
+        Yields every page of the stream as an `OggPage`.
+
+        """
+        header_size = OGG_PAGE_HEADER.size
+        while self.ensure(header_size):
+            capture, version, flags, granule, serial, sequence, checksum, segment_count = OGG_PAGE_HEADER.unpack_from(self.buffer, self.offset)
+            if capture != b'OggS':
+                # Lost sync with the pages, so skip ahead to the next capture pattern.
+                next_page = self.buffer.find(b'OggS', self.offset + 1)
+                if next_page == -1:
+                    self.offset = max(self.offset, len(self.buffer) - 3)
+                    if not self.ensure(header_size + 3):
+                        return
+                    continue
+                self.offset = next_page
+                continue
+
+            if not self.ensure(header_size + segment_count):
+                return
+            segment_table = bytes(self.view[self.offset + header_size:self.offset + header_size + segment_count])
+            page_size = header_size + segment_count + sum(segment_table)
+            if not self.ensure(page_size):
+                return
+
+            start = self.offset
+            self.offset += page_size
+            if self.verify_crc:
+                crc = ogg_crc(self.view[start:start + 22])
+                crc = ogg_crc(b'\x00\x00\x00\x00', crc)
+                crc = ogg_crc(self.view[start + 26:start + page_size], crc)
+                if crc != checksum:
+                    self.logger.warning(f"Skipping Ogg page {sequence} with an incorrect checksum.")
+                    continue
+
+            body = self.view[start + header_size + segment_count:start + page_size]
+            yield OggPage(granule, serial, sequence, flags, segment_table, body, self.position + start)
 
     def iterate_packets(self):
-        # Get a new page
+        """
+        Yields every packet of the stream. Packets that fit within a page are memoryviews of the
+        data read, and packets continued across pages are joined into `bytes`.
+
+        """
+        partial : List = []
         for page in self.iterate_pages():
-            yield page
\ No newline at end of file
+            if not page.flags & CONTINUED_PACKET and partial:
+                # The rest of the packet was lost.
+                partial = []
+            skip_continuation = page.flags & CONTINUED_PACKET and not partial
+
+            body = page.body
+            start = 0
+            end = 0
+            for lacing in page.segment_table:
+                end += lacing
+                if lacing == 255:
+                    continue
+                if skip_continuation:
+                    # A continuation of a packet whose start was not read, such as after seeking.
+                    skip_continuation = False
+                    start = end
+                    continue
+                if partial:
+                    partial.append(body[start:end])
+                    packet = b''.join(partial)
+                    partial = []
+                else:
+                    packet = body[start:end]
+                start = end
+                if len(packet) == 0:
+                    continue
+                if self.skip_headers and packet[:8] in (b'OpusHead', b'OpusTags'):
+                    continue
+                yield packet
+            if start != end and not skip_continuation:
+                partial.append(body[start:end])
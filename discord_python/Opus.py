@@ -0,0 +1,206 @@
+# A minimal ctypes binding to libopus for encoding and decoding voice audio.
+import ctypes
+import ctypes.util
+import sys
+
+SAMPLE_RATE : int = 48000
+CHANNELS : int = 2
+# 20ms of audio at 48kHz.
+FRAME_SAMPLES : int = 960
+FRAME_BYTES : int = FRAME_SAMPLES * CHANNELS * 2
+# The largest packet Opus can produce for a single frame.
+MAX_PACKET_SIZE : int = 1275 * 3 + 7
+
+OPUS_APPLICATION_VOIP = 2048
+OPUS_APPLICATION_AUDIO = 2049
+OPUS_APPLICATION_RESTRICTED_LOWDELAY = 2051
+
+OPUS_SET_BITRATE_REQUEST = 4002
+OPUS_SET_INBAND_FEC_REQUEST = 4012
+OPUS_SET_PACKET_LOSS_PERC_REQUEST = 4014
+
+libopus = None
+
+def loadOpus(path : str = None) -> bool:
+    """
+    Loads libopus. This is done automatically the first time an encoder or decoder is created, but
+    can be called with the path of the library if it is not installed where it can be found.
+
+    Returns
+    -------
+    :class:`bool`
+        Whether libopus was loaded.
+
+    """
+    global libopus
+    if libopus != None:
+        return True
+    if path == None:
+        path = ctypes.util.find_library("opus")
+        if path == None and sys.platform == "win32":
+            path = "opus.dll"
+    if path == None:
+        return False
+    try:
+        library = ctypes.cdll.LoadLibrary(path)
+    except OSError:
+        return False
+
+    library.opus_strerror.restype = ctypes.c_char_p
+    library.opus_strerror.argtypes = [ctypes.c_int]
+    library.opus_encoder_create.restype = ctypes.c_void_p
+    library.opus_encoder_create.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+    library.opus_encode.restype = ctypes.c_int32
+    library.opus_encode.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int32]
+    library.opus_encoder_ctl.restype = ctypes.c_int
+    library.opus_encoder_ctl.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+    library.opus_encoder_destroy.restype = None
+    library.opus_encoder_destroy.argtypes = [ctypes.c_void_p]
+    library.opus_decoder_create.restype = ctypes.c_void_p
+    library.opus_decoder_create.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+    library.opus_decode.restype = ctypes.c_int
+    library.opus_decode.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int32, ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+    library.opus_decoder_destroy.restype = None
+    library.opus_decoder_destroy.argtypes = [ctypes.c_void_p]
+    libopus = library
+    return True
+
+def isOpusLoaded() -> bool:
+    return libopus != None
+
+def getOpus():
+    if not loadOpus():
+        raise RuntimeError("libopus could not be found. Install it, or call loadOpus() with the path of the library.")
+    return libopus
+
+def checkError(result : int) -> int:
+    if result < 0:
+        raise RuntimeError(f"Opus error: {libopus.opus_strerror(result).decode()}")
+    return result
+
+def opusPacketSamples(packet) -> int:
+    """
+    Returns the number of samples per channel at 48kHz in an Opus packet, read from its TOC byte.
+    This does not need libopus.
+
+    """
+    if len(packet) == 0:
+        return 0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        # SILK: 10, 20, 40 or 60ms.
+        frame_samples = (480, 960, 1920, 2880)[config & 3]
+    elif config < 16:
+        # Hybrid: 10 or 20ms.
+        frame_samples = (480, 960)[config & 1]
+    else:
+        # CELT: 2.5, 5, 10 or 20ms.
+        frame_samples = (120, 240, 480, 960)[config & 3]
+    code = toc & 3
+    if code == 0:
+        frames = 1
+    elif code < 3:
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame_samples * frames
+
+class OpusEncoder():
+    """
+    Encodes 20ms frames of 16 bit stereo PCM at 48kHz into Opus packets.
+
+    """
+
+    encoder = None
+    bitrate : int = 128000
+
+    def __init__(self, bitrate : int = 128000, application : int = OPUS_APPLICATION_AUDIO, expected_packet_loss : int = 0) -> None:
+        """
+        Creates an Opus encoder.
+
+        Parameters
+        -------
+        bitrate: `int`
+            The target bitrate in bits per second. Defaults to 128kbps.
+        application: `int`
+            The Opus application, which tunes the encoder for music or speech.
+        expected_packet_loss: `int`
+            The expected packet loss as a percentage. Forward error correction is enabled if this is above 0.
+
+        Raises
+        -------
+        RuntimeError
+            Raised if libopus could not be loaded.
+
+        """
+        opus = getOpus()
+        error = ctypes.c_int(0)
+        self.encoder = opus.opus_encoder_create(SAMPLE_RATE, CHANNELS, application, ctypes.byref(error))
+        checkError(error.value)
+        self.output = ctypes.create_string_buffer(MAX_PACKET_SIZE)
+        self.setBitrate(bitrate)
+        if expected_packet_loss > 0:
+            checkError(opus.opus_encoder_ctl(self.encoder, OPUS_SET_INBAND_FEC_REQUEST, 1))
+            checkError(opus.opus_encoder_ctl(self.encoder, OPUS_SET_PACKET_LOSS_PERC_REQUEST, expected_packet_loss))
+
+    def setBitrate(self, bitrate : int):
+        self.bitrate = bitrate
+        checkError(libopus.opus_encoder_ctl(self.encoder, OPUS_SET_BITRATE_REQUEST, bitrate))
+
+    def encode(self, pcm : bytes) -> bytes:
+        """
+        Encodes one frame of PCM. The output buffer is reused, so only the packet itself is copied.
+
+        """
+        length = checkError(libopus.opus_encode(self.encoder, pcm, FRAME_SAMPLES, self.output, MAX_PACKET_SIZE))
+        # Slicing the array copies only the packet, where `.raw` would copy the whole buffer first.
+        return self.output[:length]
+
+    def __del__(self):
+        if self.encoder != None and libopus != None:
+            libopus.opus_encoder_destroy(self.encoder)
+            self.encoder = None
+
+class OpusDecoder():
+    """
+    Decodes Opus packets into 16 bit stereo PCM at 48kHz.
+
+    """
+
+    decoder = None
+
+    def __init__(self) -> None:
+        """
+        Creates an Opus decoder.
+
+        Raises
+        -------
+        RuntimeError
+            Raised if libopus could not be loaded.
+
+        """
+        opus = getOpus()
+        error = ctypes.c_int(0)
+        self.decoder = opus.opus_decoder_create(SAMPLE_RATE, CHANNELS, ctypes.byref(error))
+        checkError(error.value)
+        # Large enough for the longest packet Opus allows, which is 120ms.
+        self.max_samples = FRAME_SAMPLES * 6
+        self.output = ctypes.create_string_buffer(self.max_samples * CHANNELS * 2)
+
+    def decode(self, data : bytes = None) -> bytes:
+        """
+        Decodes a packet. If `data` is None, a frame is generated to conceal a lost packet.
+
+        """
+        if data == None:
+            samples = libopus.opus_decode(self.decoder, None, 0, self.output, FRAME_SAMPLES, 0)
+        else:
+            samples = libopus.opus_decode(self.decoder, data, len(data), self.output, self.max_samples, 0)
+        checkError(samples)
+        return self.output[:samples * CHANNELS * 2]
+
+    def __del__(self):
+        if self.decoder != None and libopus != None:
+            libopus.opus_decoder_destroy(self.decoder)
+            self.decoder = None
@@ -0,0 +1,352 @@
+# An on-disk cache of encoded Opus packets, so audio that is played often is only encoded once.
+import asyncio
+import bisect
+import collections
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from typing import (
+    Dict,
+    List,
+    Tuple
+)
+
+from .Voice import FFmpegOpus
+from .Opus import opusPacketSamples
+
+# Files start with a magic number and version, followed by each packet prefixed with its length. They end
+# with a seek table of the sample position and file offset of a packet every second, then the offset of
+# the seek table and a trailing magic number.
+CACHE_MAGIC = b"DPOC\x02"
+PACKET_LENGTH = struct.Struct(">H")
+SEEK_ENTRY = struct.Struct(">QQ")
+SEEK_TRAILER = struct.Struct(">Q4s")
+SEEK_MAGIC = b"DPSK"
+SEEK_INTERVAL = 48000
+CACHE_EXTENSION = ".opus-cache"
+
+class CachedOpus():
+    """
+    An audio source that plays Opus packets from a cache file. The file is memory mapped, so frames
+    are read straight from the page cache without FFmpeg or a reading thread.
+
+    """
+
+    path : str = None
+    mapped : mmap.mmap = None
+    view : memoryview = None
+    offset : int = 0
+    end : int = 0
+    seek_samples : List[int] = []
+    seek_offsets : List[int] = []
+    start : float = 0
+
+    def __init__(self, path : str) -> None:
+        """
+        Opens a cache file for playback.
+
+        Raises
+        -------
+        ValueError
+            Raised if the file is not an Opus cache file.
+
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self.mapped)
+        if self.mapped[:len(CACHE_MAGIC)] != CACHE_MAGIC or size < len(CACHE_MAGIC) + SEEK_TRAILER.size:
+            self.mapped.close()
+            raise ValueError(f"{path} is not an Opus cache file.")
+        table_offset, magic = SEEK_TRAILER.unpack_from(self.mapped, size - SEEK_TRAILER.size)
+        table_end = size - SEEK_TRAILER.size
+        if magic != SEEK_MAGIC or not len(CACHE_MAGIC) <= table_offset <= table_end or (table_end - table_offset) % SEEK_ENTRY.size:
+            self.mapped.close()
+            raise ValueError(f"{path} has no seek table.")
+        self.seek_samples = []
+        self.seek_offsets = []
+        for samples, offset in SEEK_ENTRY.iter_unpack(self.mapped[table_offset:table_end]):
+            self.seek_samples.append(samples)
+            self.seek_offsets.append(offset)
+        self.view = memoryview(self.mapped)
+        self.offset = len(CACHE_MAGIC)
+        self.end = table_offset
+
+    async def wait_until_ready(self, timeout : float = 5):
+        pass
+
+    def seek(self, position : float):
+        """
+        Moves playback to `position` seconds. The seek table gives the packet at the start of the second
+        before the position, and the packet lengths are walked from there.
+
+        """
+        if self.view == None:
+            return
+        self.start = max(position, 0)
+        target = int(self.start * 48000)
+        entry = bisect.bisect_right(self.seek_samples, target) - 1
+        if entry >= 0:
+            samples = self.seek_samples[entry]
+            offset = self.seek_offsets[entry]
+        else:
+            samples = 0
+            offset = len(CACHE_MAGIC)
+        end = self.end
+        while offset + 2 <= end:
+            (length,) = PACKET_LENGTH.unpack_from(self.view, offset)
+            samples += opusPacketSamples(self.view[offset + 2:offset + 3 + (length > 1)])
+            if samples > target:
+                break
+            offset += 2 + length
+        self.offset = offset
+
+    def read(self):
+        """
+        Returns the next frame, or `b''` once every frame has been played.
+
+        """
+        if self.view == None or self.offset + 2 > self.end:
+            return b''
+        (length,) = PACKET_LENGTH.unpack_from(self.view, self.offset)
+        start = self.offset + 2
+        self.offset = start + length
+        return self.view[start:self.offset]
+
+    def stop(self):
+        # The mapping itself is closed once the last frame read from it is no longer used.
+        self.view = None
+
+class OpusCacheWriter():
+    """
+    Writes packets to a temporary file, which is only added to the cache once `commit` is called,
+    so audio that was cut short is never cached.
+
+    """
+
+    cache = None
+    key : str = None
+    temp_path : str = None
+    file = None
+    offset : int = 0
+    samples : int = 0
+    seek_table : List[Tuple[int, int]] = []
+
+    def __init__(self, cache, key : str) -> None:
+        self.cache = cache
+        self.key = key
+        handle, self.temp_path = tempfile.mkstemp(suffix=".tmp", dir=cache.directory)
+        self.file = os.fdopen(handle, "wb")
+        self.file.write(CACHE_MAGIC)
+        self.offset = len(CACHE_MAGIC)
+        self.samples = 0
+        self.seek_table = []
+
+    def write(self, packet):
+        if self.samples >= len(self.seek_table) * SEEK_INTERVAL:
+            self.seek_table.append((self.samples, self.offset))
+        self.file.write(PACKET_LENGTH.pack(len(packet)))
+        self.file.write(packet)
+        self.offset += 2 + len(packet)
+        self.samples += opusPacketSamples(packet[:2])
+
+    def commit(self):
+        for samples, offset in self.seek_table:
+            self.file.write(SEEK_ENTRY.pack(samples, offset))
+        self.file.write(SEEK_TRAILER.pack(self.offset, SEEK_MAGIC))
+        self.file.close()
+        self.cache.add(self.key, self.temp_path)
+        self.temp_path = None
+
+    def close(self):
+        """
+        Closes the writer, deleting the temporary file if it was not committed.
+
+        """
+        self.file.close()
+        if self.temp_path != None:
+            self.cache.removeFile(self.temp_path)
+            self.temp_path = None
+
+class OpusCache():
+    """
+    A content addressed cache of Opus packets on disk. Audio is keyed by a hash of the contents of the
+    file (or of the URL for streams) and the encoding settings, and the least recently played audio
+    is removed once the cache grows past its size limit.
+
+    """
+
+    directory : str = None
+    max_size : int = 512 * 1024 * 1024
+    total_size : int = 0
+    entries : collections.OrderedDict = None
+    hashes : Dict[Tuple, str] = None
+    hits : int = 0
+    misses : int = 0
+
+    def __init__(self, directory : str, max_size : int = 512 * 1024 * 1024) -> None:
+        """
+        Creates a cache in a directory, picking up anything already cached there.
+
+        Parameters
+        -------
+        directory: `str`
+            The directory the cache files are stored in. It is created if it does not exist.
+        max_size: `int`
+            The maximum total size of the cache in bytes. Defaults to 512MiB.
+
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.logger = logging.getLogger("Logging")
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hashes = {}
+        self.total_size = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # The access time of each file is kept as its modification time, so the order survives restarts.
+        existing = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                # Left behind by a process that stopped while writing.
+                self.removeFile(path)
+            elif name.endswith(CACHE_EXTENSION):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, name[:-len(CACHE_EXTENSION)], stat.st_size))
+        for _, key, size in sorted(existing):
+            self.entries[key] = size
+            self.total_size += size
+        self.evict()
+
+    def key(self, source : str, args : Tuple = ()) -> str:
+        """
+        Returns the cache key of a source. Local files are hashed by their contents, and the hash is
+        remembered until the file changes.
+
+        """
+        digest = hashlib.sha256(repr(args).encode())
+        if os.path.isfile(source):
+            stat = os.stat(source)
+            file_id = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+            content_hash = self.hashes.get(file_id)
+            if content_hash == None:
+                file_digest = hashlib.sha256()
+                with open(source, "rb") as file:
+                    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                        file_digest.update(chunk)
+                content_hash = file_digest.hexdigest()
+                self.hashes[file_id] = content_hash
+            digest.update(content_hash.encode())
+        else:
+            digest.update(source.encode())
+        return digest.hexdigest()
+
+    def path(self, key : str) -> str:
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def open(self, key : str):
+        """
+        Returns a `CachedOpus` source for a key, or None if it is not cached.
+
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        path = self.path(key)
+        try:
+            os.utime(path)
+            source = CachedOpus(path)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Discarding unreadable Opus cache file {path}: {e!r}")
+            self.discard(key)
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return source
+
+    def createSource(self, source : str, executable_path : str = "ffmpeg", start : float = 0):
+        """
+        Returns an audio source for a file or URL, starting `start` seconds in. Cached audio is played
+        from the cache, and anything else is encoded with FFmpeg and stored in the cache as it plays.
+        Audio that is not cached and does not start from the beginning is not added to the cache.
+
+        """
+        key = self.key(source, tuple(FFmpegOpus.OUTPUT_ARGS))
+        cached = self.open(key)
+        if cached != None:
+            if start > 0:
+                cached.seek(start)
+            return cached
+        if start > 0:
+            return FFmpegOpus(source, executable_path, start=start)
+        return FFmpegOpus(source, executable_path, cache=self, cache_key=key)
+
+    async def getSource(self, source : str, executable_path : str = "ffmpeg", start : float = 0):
+        """
+        The same as `createSource`, but local files are hashed off the event loop.
+
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.createSource, source, executable_path, start)
+
+    def createWriter(self, key : str):
+        """
+        Returns an `OpusCacheWriter` that stores packets under a key.
+
+        """
+        return OpusCacheWriter(self, key)
+
+    def add(self, key : str, temp_path : str):
+        """
+        Moves a completely written temporary file into the cache, removing the least recently
+        played audio if the cache is now too large.
+
+        """
+        path = self.path(key)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self.lock:
+            if key in self.entries:
+                self.total_size -= self.entries[key]
+            self.entries[key] = size
+            self.total_size += size
+        self.evict()
+
+    def discard(self, key : str):
+        with self.lock:
+            size = self.entries.pop(key, None)
+            if size != None:
+                self.total_size -= size
+        self.removeFile(self.path(key))
+
+    def evict(self):
+        """
+        Removes the least recently played audio until the cache is within its size limit.
+
+        """
+        while True:
+            with self.lock:
+                if self.total_size <= self.max_size or len(self.entries) == 0:
+                    return
+                key, size = self.entries.popitem(last=False)
+                self.total_size -= size
+            self.removeFile(self.path(key))
+
+    def removeFile(self, path : str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # On Windows a file cannot be removed while it is being played.
+            self.logger.warning(f"Could not remove Opus cache file {path}: {e!r}")
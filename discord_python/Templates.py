@@ -0,0 +1,169 @@
+# Precompiled responses for the interactions your application answers most often.
+import json
+import re
+from json.encoder import encode_basestring_ascii
+
+from .Message import Message, HTTPMethods
+from .InteractionResponder import Interaction, InteractionResponse
+
+from typing import (
+    List,
+    Tuple
+)
+
+# Slot markers are serialized by json.dumps as "\u0000name\u0000". The opening quote only
+# counts as part of the slot if it has not been escaped.
+SLOT_PATTERN = re.compile(r'((?<!\\)")?\\u0000([A-Za-z0-9_]+)\\u0000(")?')
+
+class Slot(str):
+    """
+    A placeholder for a value that changes every time a `ResponseTemplate` is rendered. A Slot
+    can be used anywhere a string is accepted when building a response, such as the text of an
+    `InteractionResponseText`, the title of an `Embed` or the value of a `Field`.
+
+    """
+
+    name : str = None
+
+    def __new__(cls, name : str):
+        """
+        Creates a slot.
+
+        Parameters
+        -------
+        name: `str`
+            The name used to provide a value for this slot when rendering. Only letters, numbers
+            and underscores may be used.
+
+        Raises
+        -------
+        ValueError
+            Raised if the name contains any other characters.
+
+        """
+        if not re.fullmatch(r"[A-Za-z0-9_]+", name):
+            raise ValueError("Slot names may only contain letters, numbers and underscores.")
+        slot = super().__new__(cls, f"\x00{name}\x00")
+        slot.name = name
+        return slot
+
+def encodeSlotValue(value) -> bytes:
+    """
+    Encodes a value that replaces an entire JSON value in a template.
+
+    """
+    if type(value) is str:
+        return encode_basestring_ascii(value).encode()
+    return json.dumps(value, separators=(",", ":")).encode()
+
+class ResponseTemplate():
+    """
+    A response that has been serialized once, ahead of time. Only the slots are encoded when
+    rendering, so no dictionaries are built and `json.dumps` is not run over the whole response.
+    This should be used for responses that are sent very often with a small amount of their
+    content changing each time.
+
+    """
+
+    chunks : List[bytes] = []
+    slots : List[Tuple[str, bool]] = []
+    slot_names : List[str] = []
+
+    def __init__(self, response : InteractionResponse) -> None:
+        """
+        Creates a template from an interaction response that contains `Slot` values.
+
+        Parameters
+        -------
+        response: `InteractionResponse`
+            The response to build the template from, such as an `InteractionResponseText` with
+            embeds and action rows attached. Its JSON is generated and serialized here, so it
+            should be fully built beforehand.
+
+        Warning
+        -------
+        A slot that makes up an entire value can be rendered with any JSON serializable value.
+        A slot that is part of a larger string, for example `"Hello " + Slot("name")`, must be
+        rendered with a string.
+
+        """
+        serialized = json.dumps(response.generateJSON(), separators=(",", ":"))
+
+        self.chunks = []
+        self.slots = []
+        position = 0
+        for match in SLOT_PATTERN.finditer(serialized):
+            opening, name, closing = match.groups()
+            whole_value = opening is not None and closing is not None
+            static = serialized[position:match.start()]
+            if opening is not None and not whole_value:
+                static += opening
+            self.chunks.append(static.encode())
+            self.slots.append((name, whole_value))
+            position = match.end()
+            if closing is not None and not whole_value:
+                position -= 1
+        self.chunks.append(serialized[position:].encode())
+        self.slot_names = list(dict.fromkeys(name for name, _ in self.slots))
+
+    def render(self, **values) -> bytes:
+        """
+        Fills every slot with the provided values and returns the response body.
+
+        Parameters
+        -------
+        **values:
+            The value for each slot, keyed by the slot name.
+
+        Raises
+        -------
+        KeyError
+            Raised if a value was not provided for a slot.
+
+        Returns
+        -------
+        :class:`bytes`
+            The serialized JSON body of the response.
+
+        """
+        chunks = self.chunks
+        parts = [chunks[0]]
+        index = 1
+        for name, whole_value in self.slots:
+            try:
+                value = values[name]
+            except KeyError:
+                raise KeyError(f"No value was provided for the slot '{name}'.") from None
+            if whole_value:
+                parts.append(encodeSlotValue(value))
+            else:
+                parts.append(encode_basestring_ascii(value)[1:-1].encode())
+            parts.append(chunks[index])
+            index += 1
+        return b"".join(parts)
+
+    def createMessage(self, interaction : Interaction, client = None, **values) -> Message:
+        """
+        Renders the template and creates a `Message` responding to the given interaction, which
+        can be added to the message queue.
+
+        Parameters
+        -------
+        interaction: `Interaction`
+            The interaction being responded to.
+        client: `Client.Client`
+            The client used to send the message. Defaults to the client that received the interaction.
+        **values:
+            The value for each slot, keyed by the slot name.
+
+        Returns
+        -------
+        :class:`Message`
+            A message containing the pre-serialized response.
+
+        """
+        if client == None:
+            client = interaction.client
+        # Built from the client's API base, so it matches the callback URLs of an InteractionServer.
+        url = f"{client.discord_http_api_base}/interactions/{interaction.interaction_id}/{interaction.interaction_token}/callback"
+        return Message(url=url, method=HTTPMethods.POST, json=self.render(**values), client=client)
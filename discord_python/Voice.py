@@ -1,4 +1,11 @@
+import bisect
+import collections
+import functools
+import itertools
 import subprocess
+import sys
+import threading
+import queue
 from typing import (
     IO,
     List
@@ -7,61 +14,393 @@ import aiohttp
 import asyncio
 import random
 import logging
-import socket
 import time
-import nacl.secret
-import select
+import struct
 
 from .OggParser import OggStream
+from .Opus import opusPacketSamples
+from .VoiceEncryption import VoiceEncryptionMode, ENCRYPTION_MODES, selectEncryptionMode
+from .VoiceReceive import VoiceReceiver, AudioSink
+from .Opus import getOpus
+
+# Version and flags, payload type, sequence, timestamp and SSRC.
+RTP_HEADER = struct.Struct(">BBHII")
+# An Opus frame of silence. Five of these are sent after audio finishes to avoid interpolation.
+SILENCE_FRAME = b'\xF8\xFF\xFE'
 
 class FFmpegHandler():
+    """
+    The base class for audio sources using FFmpeg. The output of FFmpeg is read on a separate thread
+    into a bounded buffer of frames, so reading a frame never blocks the event loop. Errors written
+    by FFmpeg are drained on another thread and logged.
+
+    """
 
     packet_iterator = None
     process: subprocess.Popen = None
     stdout : IO[bytes] = None
     stdin : IO[bytes] = None
     FRAME_SIZE : int = 20
-    UDP_socket : socket.socket = None
+    frames : queue.Queue = None
+    buffer_size : int = 50
+    prebuffer : int = 10
+    primed : threading.Event = None
+    ready_waiters : List = []
+    finished : bool = False
+    stopped : bool = False
+    logger : logging.Logger = None
+    start : float = 0
 
-    def __init__(self, args) -> None:
-        self.open_process(args=args)
+    def __init__(self, args, buffer_size : int = 50, process : subprocess.Popen = None) -> None:
+        """
+        Starts FFmpeg with the given arguments. Subclasses must set `packet_iterator` and then call
+        `start_reading()`.
+
+        Parameters
+        -------
+        args: `List[str]`
+            The command used to start FFmpeg.
+        buffer_size: `int`
+            The maximum amount of frames read ahead of playback. Defaults to 50, which is one second.
+        process: `subprocess.Popen`
+            An FFmpeg process that has already been started, such as one from an `FFmpegPool`. If set,
+            `args` is ignored.
+
+        """
+        self.logger = logging.getLogger("Logging")
+        self.buffer_size = buffer_size
+        self.prebuffer = min(self.prebuffer, buffer_size)
+        self.frames = queue.Queue(maxsize=buffer_size)
+        self.primed = threading.Event()
+        self.primed_lock = threading.Lock()
+        self.ready_waiters = []
+        if process != None:
+            self.adopt_process(process)
+        else:
+            self.open_process(args=args)
 
     def open_process(self, args):
+        # CREATE_NO_WINDOW only exists on Windows, where it stops a console window from opening.
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
         try:
-            self.process = subprocess.Popen(args=args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=subprocess.CREATE_NO_WINDOW)
+            self.process = subprocess.Popen(args=args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creationflags)
             self.stdout = self.process.stdout
             self.stdin = self.process.stdin
         except FileNotFoundError:
             raise FileNotFoundError("FFmpeg executable was not found.")
+        threading.Thread(target=self.drain_stderr, daemon=True).start()
+
+    @staticmethod
+    def createInputArgs(source : str, start : float = 0) -> List[str]:
+        """
+        Returns the FFmpeg options for reading a source from `start` seconds in. The seek is done on the
+        input, so FFmpeg skips straight to the position instead of decoding everything before it, and
+        HTTP sources are requested from the position with range requests.
+
+        """
+        args = []
+        if source.startswith(("http://", "https://")):
+            args += ["-seekable", "1"]
+        if start > 0:
+            args += ["-ss", f"{start:.3f}"]
+        return args + ["-i", source]
+
+    def adopt_process(self, process : subprocess.Popen):
+        self.process = process
+        self.stdout = process.stdout
+        self.stdin = process.stdin
+        threading.Thread(target=self.drain_stderr, daemon=True).start()
+
+    def start_reading(self):
+        """
+        Starts reading frames from FFmpeg into the buffer on a separate thread.
+
+        """
+        threading.Thread(target=self.read_frames, daemon=True).start()
+
+    def read_frames(self):
+        try:
+            for packet in self.packet_iterator:
+                if self.stopped:
+                    break
+                # Blocks while the buffer is full, so FFmpeg is only ever a second ahead of playback.
+                self.frames.put(packet)
+                if not self.primed.is_set() and self.frames.qsize() >= self.prebuffer:
+                    self.set_primed()
+        except (OSError, ValueError) as e:
+            if not self.stopped:
+                self.logger.error(f"Reading from FFmpeg failed: {e!r}")
+        finally:
+            if hasattr(self.packet_iterator, "close"):
+                self.packet_iterator.close()
+            self.finished = True
+            self.set_primed()
+            self.process.wait()
+
+    def drain_stderr(self):
+        for line in self.process.stderr:
+            line = line.decode(errors="replace").strip()
+            if line:
+                self.logger.warning(f"FFmpeg: {line}")
+
+    def set_primed(self):
+        # Called on the reading thread. Coroutines waiting in wait_until_ready are woken on their own loops.
+        with self.primed_lock:
+            if self.primed.is_set():
+                return
+            self.primed.set()
+            waiters = self.ready_waiters
+            self.ready_waiters = []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The event loop has been closed.
+                pass
+
+    async def wait_until_ready(self, timeout : float = 5):
+        """
+        Waits until enough frames have been buffered to start playback, or until FFmpeg has finished.
+        No thread is used while waiting, so many sources can wait at once.
+
+        """
+        with self.primed_lock:
+            if self.primed.is_set():
+                return
+            waiter = (asyncio.get_running_loop(), asyncio.Event())
+            self.ready_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.primed_lock:
+                if waiter in self.ready_waiters:
+                    self.ready_waiters.remove(waiter)
 
     def read(self):
-        #size = int(48 * self.FRAME_SIZE * 4 / 12.18)
-        #data = self.stdout.read(size)
-        #if len(data) != size:
-        #    return b''
-        #return data
+        """
+        Returns the next frame without blocking.
 
-        return next(self.packet_iterator, b'')
+        Returns
+        -------
+        :class:`bytes`
+            The next frame, `b''` once the source has ended, or None if the next frame has not been
+            read from FFmpeg yet.
+
+        """
+        if self.stopped:
+            return b''
+        try:
+            return self.frames.get_nowait()
+        except queue.Empty:
+            if self.finished and self.frames.empty():
+                return b''
+            return None
+
+    def stop(self):
+        """
+        Stops FFmpeg. The process is killed and then reaped by the reading thread.
+
+        """
+        self.stopped = True
+        if self.process.poll() == None:
+            self.process.kill()
+        # Empty the buffer so the reading thread is not left waiting for space.
+        while True:
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                break
 
 class FFmpegPCM(FFmpegHandler):
 
-    def __init__(self, source, executable_path = "ffmpeg") -> None:
-        args = [
-            executable_path, "-i", source, "-f", "s16le", "-ar", "48000", "-ac", "2", "-loglevel", "warning", "pipe:1"
+    # 20ms of 16 bit stereo audio at 48kHz.
+    FRAME_BYTES : int = 3840
+
+    def __init__(self, source, executable_path = "ffmpeg", start : float = 0) -> None:
+        args = [executable_path] + self.createInputArgs(source, start) + [
+            "-f", "s16le", "-ar", "48000", "-ac", "2", "-loglevel", "warning", "pipe:1"
         ]
         super().__init__(args)
+        self.start = start
+        self.packet_iterator = self.iterate_frames()
+        self.start_reading()
+
+    def iterate_frames(self):
+        while True:
+            data = self.stdout.read(self.FRAME_BYTES)
+            if len(data) != self.FRAME_BYTES:
+                return
+            yield data
 
 class FFmpegOpus(FFmpegHandler):
 
-    def __init__(self, source, executable_path = "ffmpeg") -> None:
-        args = [
-            executable_path, "-i", source, "-f", "opus", "-c:a", "libopus", "-ar", "48000", "-ac", "2", "-b:a", "128k", "-loglevel", "warning", "pipe:1"
-        ]
-        super().__init__(args)
+    OUTPUT_ARGS : List[str] = [
+        "-f", "opus", "-c:a", "libopus", "-ar", "48000", "-ac", "2", "-b:a", "128k", "-loglevel", "warning", "pipe:1"
+    ]
+
+    cache = None
+    cache_key : str = None
+
+    def __init__(self, source, executable_path = "ffmpeg", cache = None, cache_key : str = None, process : subprocess.Popen = None, start : float = 0) -> None:
+        """
+        Encodes a file or URL to Opus with FFmpeg.
+
+        Parameters
+        -------
+        start: `float`
+            The position in seconds to start playing from.
+        cache: `OpusCache`
+            If set, the packets are also written to this cache under `cache_key` as they are read,
+            and are kept once FFmpeg has encoded the whole source. Use `OpusCache.createSource()`
+            rather than setting this directly.
+        process: `subprocess.Popen`
+            An FFmpeg process that is already running and being fed the source. Use
+            `FFmpegPool.getSource()` rather than setting this directly.
+
+        """
+        args = [executable_path] + self.createInputArgs(source, start) + self.OUTPUT_ARGS
+        super().__init__(args, process=process)
+        self.start = start
+        self.cache = cache
+        self.cache_key = cache_key
         self.packet_iterator = OggStream(self.stdout).iterate_packets()
+        if cache != None:
+            self.packet_iterator = self.cache_packets(self.packet_iterator)
+        self.start_reading()
+
+    def cache_packets(self, packets):
+        writer = self.cache.createWriter(self.cache_key)
+        try:
+            for packet in packets:
+                writer.write(packet)
+                yield packet
+            # Audio that was stopped early or that FFmpeg failed to encode is not cached.
+            if self.process.wait() == 0 and not self.stopped:
+                writer.commit()
+        finally:
+            writer.close()
+
+class OpusFile():
+    """
+    An audio source that plays an Ogg Opus file (such as a .opus file) directly, without FFmpeg. The
+    file is memory mapped, and seeking uses the granule positions of its pages, so starting part way
+    through does not read or decode anything before that point.
+
+    """
+
+    path : str = None
+    stream : OggStream = None
+    packets = None
+    pre_skip : int = 0
+    start : float = 0
+    stopped : bool = False
+
+    def __init__(self, path : str, start : float = 0) -> None:
+        """
+        Opens an Ogg Opus file.
+
+        Parameters
+        -------
+        start: `float`
+            The position in seconds to start playing from.
+
+        Raises
+        -------
+        ValueError
+            Raised if the file is not an Ogg Opus file.
+
+        """
+        self.path = path
+        self.stream = OggStream.fromFile(path, skip_headers=False)
+        header = next(self.stream.iterate_packets(), b'')
+        if bytes(header[:8]) != b'OpusHead':
+            raise ValueError(f"{path} is not an Ogg Opus file.")
+        self.pre_skip = int.from_bytes(header[10:12], "little")
+        self.stream.skip_headers = True
+        self.seek(start)
+
+    def buildIndex(self):
+        # The byte offset and final granule position of every page that completes a packet.
+        self.page_offsets = []
+        self.page_granules = []
+        self.stream.seek(0)
+        for page in self.stream.iterate_pages():
+            if page.granule >= 0:
+                self.page_offsets.append(page.offset)
+                self.page_granules.append(page.granule)
+
+    def seek(self, position : float):
+        """
+        Moves playback to `position` seconds. This can be called while the file is playing.
+
+        """
+        self.start = max(position, 0)
+        if self.start == 0:
+            self.stream.seek(0)
+            self.packets = self.stream.iterate_packets()
+            return
+        if not hasattr(self, "page_granules"):
+            self.buildIndex()
+        target = int(self.start * 48000) + self.pre_skip
+        # The first page with a packet ending after the target. Its packets start where the previous
+        # page's granule position ends.
+        page = bisect.bisect_right(self.page_granules, target)
+        if page >= len(self.page_offsets):
+            self.packets = iter(())
+            return
+        granule = self.page_granules[page - 1] if page > 0 else 0
+        self.stream.seek(self.page_offsets[page])
+        packets = self.stream.iterate_packets()
+        self.packets = packets
+        # Skip the packets of the page that end before the target.
+        for packet in packets:
+            granule += opusPacketSamples(packet)
+            if granule > target:
+                self.packets = itertools.chain((packet,), packets)
+                return
+
+    async def wait_until_ready(self, timeout : float = 5):
+        pass
+
+    def read(self):
+        if self.stopped:
+            return b''
+        return next(self.packets, b'')
 
+    def stop(self):
+        self.stopped = True
 
+class VoiceUDPProtocol(asyncio.DatagramProtocol):
+    """
+    The asyncio protocol for the UDP connection to a voice server. Received packets are handed to the
+    `VoiceClient` as they arrive, instead of the socket being polled.
 
+    """
+
+    voice_client = None
+    transport : asyncio.DatagramTransport = None
+    discovery_future : asyncio.Future = None
+
+    def __init__(self, voice_client) -> None:
+        self.voice_client = voice_client
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.discovery_future != None and not self.discovery_future.done() and len(data) == 74 and data[:2] == b'\x00\x02':
+            # IP Discovery response.
+            self.discovery_future.set_result(data)
+            return
+        self.voice_client.receivePacket(data)
+
+    def error_received(self, exc):
+        self.voice_client.logger.warning(f"Voice UDP error: {exc}")
+
+    def connection_lost(self, exc):
+        self.voice_client.logger.debug(f"Voice UDP connection closed: {exc}")
 
 class VoiceClient():
 
@@ -73,8 +412,53 @@ class VoiceClient():
     ready : bool = False
     logger : logging.Logger = None
     secret_key : List[int] = None
-    sock : socket.socket = None
-    iteration : int = 0
+    mode : str = None
+    encryption : VoiceEncryptionMode = None
+    header : bytearray = None
+    transport : asyncio.DatagramTransport = None
+    protocol : VoiceUDPProtocol = None
+    guild_id : str = None
+    channel_id : str = None
+    source : FFmpegHandler = None
+    silence_remaining : int = 0
+    play_finished : asyncio.Future = None
+    underruns : int = 0
+    packets_sent : int = 0
+    queue : collections.deque = None
+    next_source = None
+    prefetching : bool = False
+    queue_generation : int = 0
+    tracks_played : int = 0
+    source_frames : int = 0
+    discovery_timeout : float = 1.0
+    discovery_attempts : int = 5
+    # Voice servers are always secure, but a local stand-in server (such as the one in benchmarks/) is not.
+    websocket_scheme : str = "wss"
+    receiver : VoiceReceiver = None
+    session_id : str = None
+    user_id : str = None
+    token : str = None
+    endpoint : str = None
+    voice_state_received : asyncio.Future = None
+    voice_server_received : asyncio.Future = None
+    voice_ready_received : asyncio.Future = None
+    session_description_received : asyncio.Future = None
+    voice_update_timeout : float = 10.0
+    connect_task : asyncio.Task = None
+    heartbeat_task : asyncio.Task = None
+    heartbeat_nonce : int = None
+    heartbeat_sent_at : float = None
+    heartbeat_acknowledged : bool = True
+    missed_heartbeats : int = 0
+    max_missed_heartbeats : int = 3
+    latency : float = None
+    recent_latencies : collections.deque = None
+    resume_attempts : int = 5
+    resumes : int = 0
+    disconnecting : bool = False
+
+    # Authentication failed, session no longer valid, session timed out and disconnected (such as being kicked).
+    NON_RESUMABLE_CLOSE_CODES = (4004, 4006, 4009, 4014)
 
     voice_ws : aiohttp.ClientWebSocketResponse = None
 
@@ -85,154 +469,251 @@ class VoiceClient():
 
     def __init__(self, guild_id, channel_id, self_mute, self_deaf, client) -> None:
         self.client = client
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        # The RTP header is packed into this buffer for every packet.
+        self.header = bytearray(12)
+        self.receiver = VoiceReceiver()
+        self.recent_latencies = collections.deque(maxlen=20)
+        self.queue = collections.deque()
         self.logger = client.logger
-        print(self.logger)
         loop = asyncio.get_running_loop()
-        loop.create_task(self.createVoiceWebsocketConnection(guild_id, channel_id, self_mute, self_deaf))
-        pass
+        # Completed by the Client when the gateway sends the voice state and server for this guild.
+        self.voice_state_received = loop.create_future()
+        self.voice_server_received = loop.create_future()
+        self.voice_ready_received = loop.create_future()
+        # Completed once the encryption key is received, after the UDP connection is ready.
+        self.session_description_received = loop.create_future()
+        self.connect_task = loop.create_task(self.createVoiceWebsocketConnection(guild_id, channel_id, self_mute, self_deaf))
 
     async def createVoiceWebsocketConnection(self, guild_id, channel_id, self_mute, self_deaf):
+        """
+        Asks the gateway to join the voice channel, then connects to the voice server once the voice
+        state and server updates for this guild have been received.
 
-        # TODO: Send websocket packet to get the endpoint to connect to.
+        """
         self.logger.debug("Creating voice websocket connection.")
 
-        #await asyncio.sleep(5)
-
         payload = {"op": 4, "d": {"guild_id": guild_id, "channel_id": channel_id, "self_mute": self_mute, "self_deaf": self_deaf}}
-        #payload = {"op": 4, "d": {"guild_id": "828553142604922951", "channel_id": "828553142604922951", "self_mute": self_mute, "self_deaf": self_deaf}}
-
         self.logger.debug(f"PAYLOAD: {payload}")
-
         await self.client.ws.send_json(payload)
-
-        # TODO: Receive endpoint information.
-
         self.logger.debug("Sent VOICE UPDATE request.")
 
-        while True:
-            if self.client.voice_endpoint != None:
-                break
-            await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(asyncio.gather(self.voice_state_received, self.voice_server_received), self.voice_update_timeout)
+        except asyncio.TimeoutError:
+            self.logger.error(f"Did not receive the voice state and server for guild {guild_id} in time.")
+            self.client.voice_clients.pop(guild_id, None)
+            return
 
-        # TODO: Establish a voice websocket connection.
+        self.logger.debug(f"Received voice endpoint: {self.endpoint}")
+        await self.createVoiceWebsocket(self.endpoint)
 
-        self.logger.debug(f"Received voice endpoint: {self.client.voice_endpoint}")
+    def voiceStateUpdate(self, data):
+        """
+        Called by the `Client` for VOICE_STATE_UPDATE events about our own user in this guild.
 
-        # TODO: Run asyncio.create_task() to communicate with it.
-        asyncio.create_task(self.createVoiceWebsocket(self.client.voice_endpoint))
+        """
+        self.session_id = data['session_id']
+        self.user_id = data['user_id']
+        if data.get('channel_id') != None:
+            self.channel_id = data['channel_id']
+        if not self.voice_state_received.done():
+            self.voice_state_received.set_result(None)
+
+    def voiceServerUpdate(self, data):
+        """
+        Called by the `Client` for VOICE_SERVER_UPDATE events in this guild.
 
-        self.client.voice_endpoint = None
-        pass
+        """
+        if data.get('endpoint') == None:
+            # The voice server is being reallocated, and another update will follow.
+            return
+        self.endpoint = data['endpoint']
+        self.token = data['token']
+        if not self.voice_server_received.done():
+            self.voice_server_received.set_result(None)
 
     async def voiceWSHeartbeat(self, ws : aiohttp.ClientWebSocketResponse):
         """
-        Sends heartbeats at a regular interval through the websocket connection.
+        Sends heartbeats at a regular interval through the voice websocket connection. Each heartbeat
+        has its own nonce, which the acknowledgement is matched against to measure the latency. If
+        too many heartbeats in a row are not acknowledged, the connection is closed and resumed.
 
         """
+        self.missed_heartbeats = 0
+        self.heartbeat_acknowledged = True
+        while not ws.closed:
+            if not self.heartbeat_acknowledged:
+                self.missed_heartbeats += 1
+                self.logger.warning(f"Voice heartbeat in guild {self.guild_id} was not acknowledged ({self.missed_heartbeats} missed).")
+                if self.missed_heartbeats >= self.max_missed_heartbeats:
+                    # The listener resumes the session once the websocket has closed.
+                    await ws.close(code=4000)
+                    return
+
+            self.heartbeat_nonce = random.getrandbits(52)
+            self.heartbeat_sent_at = time.monotonic()
+            self.heartbeat_acknowledged = False
+            await ws.send_json({"op": 3, "d": self.heartbeat_nonce})
+            await asyncio.sleep(self.heartbeat_interval / 1000)
+
+    def heartbeatAcknowledged(self, nonce):
+        if nonce != self.heartbeat_nonce:
+            self.logger.debug(f"Ignoring voice heartbeat acknowledgement with an old nonce: {nonce}")
+            return
+        self.latency = time.monotonic() - self.heartbeat_sent_at
+        self.recent_latencies.append(self.latency)
+        self.heartbeat_acknowledged = True
+        self.missed_heartbeats = 0
+
+    def averageLatency(self) -> float:
+        """
+        Returns the average round trip time of the recent voice heartbeats in seconds, or None if no
+        heartbeat has been acknowledged yet.
 
-        while True:
-                payload = {"op":3, "d":random.randint(0, 10000000)}
-                self.logger.debug(f"VOICE PAYLOAD: {payload}")
-                await ws.send_json(payload)
-                self.logger.info(f"Sleeping for {self.heartbeat_interval / 1000} seconds...")
-                await asyncio.sleep(self.heartbeat_interval / 1000)
-                # Send the heartbeat with the previous sequence value to keep the connection alive.
+        """
+        if not self.recent_latencies:
+            return None
+        return sum(self.recent_latencies) / len(self.recent_latencies)
 
     async def createVoiceWSListener(self, ws : aiohttp.ClientWebSocketResponse):
-        while True:
-            async for message in ws:
-                self.logger.debug(f"Voice: {message.data}")
-                if message.type == aiohttp.WSMsgType.TEXT:
-                    message_json = message.json()
-                    if message_json['op'] == 2:
-                        # Ready event
-                        data = message_json['d']
-                        self.ssrc = data['ssrc']
-                        self.ip = data['ip']
-                        self.port = data['port']
-                        self.modes = data['modes']
-                    if message_json['op'] == 3:
-                        self.logger.warning(f"Weird heartbeat acknowledgement?! Are we using the correct API version?")
-                    if message_json['op'] == 4:
-                        self.logger.debug("Encryption key received.")
-                        self.secret_key = message_json['d']['secret_key']
-                    if message_json['op'] == 6:
-                        self.logger.debug(f"Voice heartbeat acknowledeged")
-                    if message_json['op'] == 8:
-                        # Heartbeat interval
-                        self.logger.debug("Initial heartbeat interval sent.")
-                        self.heartbeat_interval = message_json['d']['heartbeat_interval']
-                        loop = asyncio.get_running_loop()
-                        loop.create_task(self.voiceWSHeartbeat(ws))
+        async for message in ws:
+            self.logger.debug(f"Voice: {message.data}")
+            if message.type == aiohttp.WSMsgType.TEXT:
+                message_json = message.json()
+                if message_json['op'] == 2:
+                    # Ready event
+                    data = message_json['d']
+                    self.ssrc = data['ssrc']
+                    self.ip = data['ip']
+                    self.port = data['port']
+                    self.modes = data['modes']
+                    if not self.voice_ready_received.done():
+                        self.voice_ready_received.set_result(None)
+                if message_json['op'] == 4:
+                    self.logger.debug("Encryption key received.")
+                    self.secret_key = message_json['d']['secret_key']
+                    self.mode = message_json['d']['mode']
+                    self.encryption = ENCRYPTION_MODES[self.mode](bytes(self.secret_key))
+                    if not self.session_description_received.done():
+                        self.session_description_received.set_result(None)
+                if message_json['op'] == 5:
+                    # Speaking, which gives the user sending audio from an SSRC.
+                    data = message_json['d']
+                    self.receiver.setSpeaking(data['ssrc'], data['user_id'], bool(data['speaking']))
+                if message_json['op'] == 6:
+                    self.heartbeatAcknowledged(message_json['d'])
+                if message_json['op'] == 9:
+                    self.logger.info(f"Resumed voice connection in guild {self.guild_id}.")
+                if message_json['op'] == 13:
+                    # A user left the voice channel.
+                    self.receiver.removeUser(message_json['d']['user_id'])
+                if message_json['op'] == 8:
+                    # Heartbeat interval
+                    self.logger.debug("Initial heartbeat interval sent.")
+                    self.heartbeat_interval = message_json['d']['heartbeat_interval']
+                    if self.heartbeat_task != None:
+                        self.heartbeat_task.cancel()
+                    self.heartbeat_task = asyncio.get_running_loop().create_task(self.voiceWSHeartbeat(ws))
+
+        if ws is self.voice_ws:
+            await self.voiceWSClosed(ws.close_code)
+
+    async def voiceWSClosed(self, close_code):
+        """
+        Called when the voice websocket closes. The session is resumed unless the close code means it
+        cannot be, so the UDP connection and encryption are kept and audio carries on. Otherwise the voice
+        client is disconnected, so the next `Client.getVoiceClient()` creates a new connection.
+
+        """
+        if self.heartbeat_task != None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        if self.disconnecting or self.client.session.closed:
+            return
+        if close_code in self.NON_RESUMABLE_CLOSE_CODES:
+            self.logger.error(f"Voice connection in guild {self.guild_id} closed with code {close_code} and cannot be resumed.")
+            await self.disconnectDead()
+            return
+
+        self.logger.warning(f"Voice connection in guild {self.guild_id} closed with code {close_code}, resuming.")
+        for attempt in range(self.resume_attempts):
+            try:
+                await self.resumeVoiceWebsocket()
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"Resuming voice connection in guild {self.guild_id} failed (attempt {attempt + 1}): {e!r}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+        self.logger.error(f"Could not resume voice connection in guild {self.guild_id}.")
+        await self.disconnectDead()
+
+    async def disconnectDead(self):
+        # Releases the source, scheduler registration and UDP socket of a connection that cannot be resumed.
+        try:
+            await self.disconnect()
+        except (aiohttp.ClientError, ConnectionError) as e:
+            # The gateway may have closed too, in which case the voice state cannot be updated.
+            self.logger.warning(f"Could not leave the voice channel in guild {self.guild_id}: {e!r}")
+
+    async def resumeVoiceWebsocket(self):
+        """
+        Reconnects to the voice server and resumes the session with op 7. IP discovery and protocol
+        selection are not repeated, as the UDP connection is still valid.
+
+        """
+        self.voice_ws = await self.client.session.ws_connect(f"{self.websocket_scheme}://{self.endpoint}?v=4")
+        resume_payload = {
+            "op": 7,
+            "d": {
+                "server_id": self.guild_id,
+                "session_id": self.session_id,
+                "token": self.token
+            }
+        }
+        await self.voice_ws.send_json(resume_payload)
+        self.resumes += 1
+        asyncio.get_running_loop().create_task(self.createVoiceWSListener(self.voice_ws))
 
     async def createVoiceWebsocket(self, url):
         # TODO: Create a new websocket and save it
-        self.voice_ws = await self.client.session.ws_connect("wss://" + url + "?v=4")
+        self.voice_ws = await self.client.session.ws_connect(f"{self.websocket_scheme}://{url}?v=4")
 
         # TODO: Identify
         identify_payload = {
         "op": 0,
         "d": {
-            "server_id": self.client.voice_guild,
-            "user_id": self.client.voice_user_id,
-            "session_id": self.client.voice_session,
-            "token": self.client.voice_token
+            "server_id": self.guild_id,
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "token": self.token
             }
         }
 
         await self.voice_ws.send_json(identify_payload)
 
-        self.client.voice_guild = None
-        self.client.voice_user_id = None
-        self.client.voice_session = None
-        self.client.voice_token = None
-
         # TODO: Create a new listener
         loop = asyncio.get_running_loop()
         loop.create_task(self.createVoiceWSListener(self.voice_ws))
 
-        # TODO: Establish UDP connection
-        # socket library seems useful
-        self.sock = socket.socket(family=socket.AddressFamily.AF_INET, type=socket.SOCK_DGRAM)
-
-        # Wait for identify payload
-        while self.ssrc == None:
-            await asyncio.sleep(0)
-
-        # TODO: Connect to UDP port provided
-        self.sock.connect((self.ip, self.port))
-        self.sock.setblocking(0)
-
-        # TODO: Send the IP Discovery package
+        # Wait for the ready payload, which gives the UDP address to connect to.
+        await self.voice_ready_received
 
-        byte_array = bytearray(b'\x00\x01')
-        byte_array.extend(int(70).to_bytes(2, byteorder="big"))
-        byte_array.extend(int(self.ssrc).to_bytes(4, byteorder="big"))
-        byte_array.extend(b"\x00" * 64)
-        byte_array.extend(b"\x00" * 2)
-        
-        self.logger.debug(f"SENING UDP PACKET: {byte_array.hex()}")
+        # Connect to UDP port provided, through a socket shared with other connections if packets are batched.
+        socket_pool = self.client.getVoiceSocketPool()
+        if socket_pool != None:
+            self.protocol = VoiceUDPProtocol(self)
+            self.transport = await socket_pool.connect((self.ip, self.port), self.protocol)
+        else:
+            self.transport, self.protocol = await loop.create_datagram_endpoint(lambda: VoiceUDPProtocol(self), remote_addr=(self.ip, self.port))
 
-        result = self.sock.send(byte_array)
-
-        self.logger.debug(f"Sent byte array through UDP socket. RESULT: {result}")
-
-        select.select([self.sock], [], [])
-
-        result = self.sock.recv(2048)
-        self.logger.debug(result.hex())
-
-        method = result[:2]
-        length = result[2:4]
-        ssrc = result[4:8]
-        address = result[8:72]
-        port = result[72:74]
-        local_ip = address.decode('utf-8')
-        local_port = int.from_bytes(port, 'big')
+        local_ip, local_port = await self.discoverIP()
 
         self.logger.debug(f"IP Discovery successful, our External IP and Port: {local_ip}:{local_port}")
 
-        # TODO: Send OP 1 SELECT PROTOCAL with our found external IP and PORT
+        # Send OP 1 SELECT PROTOCOL with our found external IP and PORT, and the best encryption mode offered.
+        mode = selectEncryptionMode(self.modes)
+        self.logger.debug(f"Selected voice encryption mode: {mode}")
 
         select_protocol_payload = {
             "op": 1,
@@ -241,7 +722,7 @@ class VoiceClient():
                 "data": {
                     "address": local_ip,
                     "port": local_port,
-                    "mode": "xsalsa20_poly1305"
+                    "mode": mode
                 }
             }
         }
@@ -250,20 +731,89 @@ class VoiceClient():
 
         self.ready = True
 
-        loop.create_task(self.listen_udp())
-        self.logger.debug(f"Select protocol sent.")
+        self.logger.debug("Select protocol sent.")
 
-    async def listen_udp(self):
-        while True:
-            while select.select([self.sock], [], [], 0) == ([], [], []):
-                await asyncio.sleep(0)
-            resp = self.sock.recv(2048)
-            await asyncio.sleep(0)
-            #print(resp)
+    async def discoverIP(self):
+        """
+        Finds our external IP address and port by sending an IP Discovery packet to the voice server.
+        The packet is sent again if no response arrives in time, as UDP packets can be lost.
+
+        Raises
+        -------
+        TimeoutError
+            Raised if the voice server did not respond to any of the attempts.
+
+        Returns
+        -------
+        :class:`Tuple[str, int]`
+            Our external IP address and port.
+
+        """
+        packet = bytearray(b'\x00\x01')
+        packet.extend(int(70).to_bytes(2, byteorder="big"))
+        packet.extend(int(self.ssrc).to_bytes(4, byteorder="big"))
+        packet.extend(b"\x00" * 64)
+        packet.extend(b"\x00" * 2)
+
+        self.protocol.discovery_future = asyncio.get_running_loop().create_future()
+        for attempt in range(self.discovery_attempts):
+            self.logger.debug(f"Sending IP Discovery packet (attempt {attempt + 1}): {packet.hex()}")
+            self.transport.sendto(packet)
+            try:
+                result = await asyncio.wait_for(asyncio.shield(self.protocol.discovery_future), self.discovery_timeout)
+                break
+            except asyncio.TimeoutError:
+                continue
+        else:
+            self.protocol.discovery_future.cancel()
+            raise TimeoutError(f"IP Discovery failed after {self.discovery_attempts} attempts.")
+
+        self.logger.debug(result.hex())
+
+        address = result[8:72]
+        port = result[72:74]
+        local_ip = address.split(b'\x00', 1)[0].decode('utf-8')
+        local_port = int.from_bytes(port, 'big')
+        return local_ip, local_port
+
+    def receivePacket(self, data : bytes):
+        """
+        Called by the UDP protocol for every packet received from the voice server. Audio is passed to
+        the receiver, which discards it straight away if nothing is listening.
+
+        """
+        self.receiver.receive(data, self.encryption)
+
+    def listen(self, decode : bool = False, queue_size : int = 500) -> AudioSink:
+        """
+        Starts receiving the audio sent by other users in the channel.
+
+        Parameters
+        -------
+        decode: `bool`
+            Whether the audio is also decoded to 16 bit stereo PCM at 48kHz. This needs libopus.
+        queue_size: `int`
+            The amount of packets kept for the sink before the oldest are dropped.
+
+        Returns
+        -------
+        :class:`AudioSink`
+            An async iterator of the `VoicePacket`s received, in order for each user.
+
+        """
+        if decode:
+            # Fails here if libopus is missing, rather than when the first packet arrives.
+            getOpus()
+        sink = AudioSink(decode, queue_size)
+        self.receiver.addSink(sink)
+        return sink
+
+    def stopListening(self, sink : AudioSink):
+        self.receiver.removeSink(sink)
 
     async def do_play(self, source : FFmpegHandler):
-        while not self.ready:
-            await asyncio.sleep(0)
+        # The session description arrives once the UDP connection is ready, so this waits for both.
+        await self.session_description_received
 
         self.logger.debug('is playing')
 
@@ -271,96 +821,268 @@ class VoiceClient():
 
         await self.start_speaking()
 
-        start_play = True
-        data = b''
-        start = time.time()
-        next_time = time.time()
-        self.iteration = 0
-        print("Starting audio transmission.")
-        while data != b'' or start_play:
-            start_play = False
-            data = source.read()
-            
-            self.iteration += 1
-
-            # TODO: Send audio packet
-            await self.send_audio_packet(data)
-            await asyncio.sleep(max(0, next_time - time.time()))
-            next_time = start + 0.02 * self.iteration
-        for i in range(5):
-            await self.send_silence_packet()
-        print(f"Played for {time.time()-start} seconds.")
+        await source.wait_until_ready()
+
+        # Anything already playing is replaced. Its source is stopped, and whoever is waiting for it to
+        # finish is released.
+        if self.source != None:
+            self.source.stop()
+        previous = self.play_finished
+
+        # The scheduler sends each frame from here, and the future is completed once the source ends.
+        self.source = source
+        self.source_frames = 0
+        self.silence_remaining = 5
+        self.play_finished = asyncio.get_running_loop().create_future()
+        if previous != None and not previous.done():
+            previous.set_result(None)
+        start = time.monotonic()
+        self.logger.debug("Starting audio transmission.")
+        self.client.getVoiceScheduler().add(self)
+        self.prefetchNext()
+        await self.play_finished
+        self.logger.debug(f"Played for {time.monotonic() - start} seconds.")
+
+    def sendNextFrame(self):
+        """
+        Called by the `VoiceScheduler` every 20ms to send the next frame of the current source. Once
+        the source ends, five frames of silence are sent before playing finishes.
 
-        self.is_playing = False
+        """
+        if self.source != None or self.next_source != None or self.prefetching:
+            # The next queued source can also start while the silence after the last one is sent.
+            data = self.source.read() if self.source != None else b''
+            if data == b'' and (self.next_source != None or self.prefetching):
+                data = self.switchToNextSource()
+            if data == None:
+                # The source has not produced the next frame in time. The timestamp still moves
+                # forward, so the gap is concealed by the receiving client.
+                self.underruns += 1
+                self.timestamp = (self.timestamp + 960) & 0xFFFFFFFF
+                return
+            if data != b'':
+                self.send_packet(data)
+                self.source_frames += 1
+                return
+            self.source = None
+
+        if self.silence_remaining > 0:
+            self.silence_remaining -= 1
+            self.send_packet(SILENCE_FRAME)
+            return
+
+        self.client.getVoiceScheduler().remove(self)
+        self.finishPlaying()
+
+    def switchToNextSource(self):
+        # Called on the frame after the current source ends. The next source starts on this frame,
+        # so the RTP sequence and timestamp carry on without any silence in between.
+        if self.next_source == None:
+            # The next source is still being opened.
+            return None
+        if self.source != None:
+            self.source.stop()
+        self.source = self.next_source
+        self.next_source = None
+        self.silence_remaining = 5
+        self.tracks_played += 1
+        self.source_frames = 0
+        self.prefetchNext()
+        return self.source.read()
+
+    def enqueue(self, source):
+        """
+        Adds audio to the queue. Queued audio is played back to back, and the next source is opened
+        and buffered while the current one is still playing.
 
-    async def send_audio_packet(self, data : bytes):
+        Parameters
+        -------
+        source: `Union[FFmpegHandler, str, Callable]`
+            A source, a file or URL to play with `FFmpegOpus`, or a function that returns a source.
+            Files, URLs and functions are only opened shortly before they are played, so long queues
+            do not start a process for every item.
 
-        # TODO: Encrypt audio data with PyNaCl
-        while self.secret_key == None:
-            await asyncio.sleep(0)
+        """
+        self.queue.append(source)
+        if self.is_playing:
+            self.prefetchNext()
+            return
+        self.is_playing = True
+        asyncio.get_running_loop().create_task(self.playQueue(self.queue.popleft()))
 
-        header = bytearray(b'\x80\x78')
-        header.extend(int(self.sequence).to_bytes(2, byteorder="big"))
-        header.extend(int(self.timestamp).to_bytes(4, byteorder="big"))
-        header.extend(int(self.ssrc).to_bytes(4, byteorder="big"))
+    async def playQueue(self, item):
+        try:
+            source = await self.openSource(item)
+        except Exception as e:
+            self.logger.error(f"Could not open queued audio in guild {self.guild_id}: {e!r}")
+            if self.queue:
+                await self.playQueue(self.queue.popleft())
+            else:
+                self.is_playing = False
+            return
+        await self.do_play(source)
+
+    async def openSource(self, item):
+        # Sources are opened on another thread, as starting FFmpeg or hashing a file can take a while.
+        loop = asyncio.get_running_loop()
+        if isinstance(item, str):
+            return await loop.run_in_executor(None, FFmpegOpus, item)
+        if callable(item) and not hasattr(item, "read"):
+            source = item()
+            if asyncio.iscoroutine(source):
+                return await source
+            return source
+        return item
+
+    def prefetchNext(self):
+        """
+        Starts opening the next queued source, unless it is already open or being opened.
 
-        nonce = bytearray(24)
-        nonce[:12] = header
+        """
+        if self.next_source != None or self.prefetching or not self.queue:
+            return
+        self.prefetching = True
+        task = asyncio.get_running_loop().create_task(self.openSource(self.queue.popleft()))
+        task.add_done_callback(functools.partial(self.prefetched, self.queue_generation))
+
+    def prefetched(self, generation : int, task : asyncio.Task):
+        if task.cancelled():
+            return
+        if generation != self.queue_generation:
+            # The queue was cleared while the source was opening.
+            if task.exception() == None:
+                task.result().stop()
+            return
+        self.prefetching = False
+        if task.exception() != None:
+            self.logger.error(f"Could not open queued audio in guild {self.guild_id}: {task.exception()!r}")
+            self.prefetchNext()
+            return
+        self.next_source = task.result()
+
+    def getPosition(self) -> float:
+        """
+        Returns the position in seconds of the current source, which can be passed as `start` to play
+        it again from the same point later. Sources without a `start`, such as custom sources, are treated as
+        playing from their beginning.
 
-        box = nacl.secret.SecretBox(bytes(self.secret_key))
-        encrypted_data = box.encrypt(bytes(data), bytes(nonce)).ciphertext
+        """
+        if self.source == None:
+            return None
+        return getattr(self.source, "start", 0) + self.source_frames * 0.02
 
-        # TODO: Craft the packet to be sent
-        packet = bytearray()
-        packet.extend(header)
-        packet.extend(encrypted_data)
+    def seek(self, position : float):
+        """
+        Moves the current source to `position` seconds. This works for sources that can seek while
+        playing, such as `OpusFile` and `CachedOpus`.
 
-        # TODO: Send the packet
-        result = self.sock.send(packet)
-        self.logger.debug(f"Sent voice packet of {result} bytes")
+        Raises
+        -------
+        TypeError
+            Raised if the current source cannot seek. Play a new source with `start` set instead.
 
-        self.sequence += 1
-        self.timestamp += 960
-        if self.sequence >= 2 ** 16: self.sequence = 0
-        if self.timestamp >= 2 ** 32: self.timestamp = 0
-        pass
+        """
+        if self.source == None:
+            return
+        if not hasattr(self.source, "seek"):
+            raise TypeError(f"{type(self.source).__name__} cannot seek while playing.")
+        self.source.seek(position)
+        self.source_frames = 0
+
+    def skip(self):
+        """
+        Skips to the next source in the queue. If the queue is empty, playing finishes.
+
+        """
+        if self.source != None:
+            # The source returns no more frames once stopped, so the next frame switches sources.
+            self.source.stop()
+
+    def clearQueue(self):
+        self.queue.clear()
+        self.queue_generation += 1
+        self.prefetching = False
+        if self.next_source != None:
+            self.next_source.stop()
+            self.next_source = None
+
+    def stop(self):
+        """
+        Stops playing the current source and clears the queue. FFmpeg is stopped, and five frames of
+        silence are sent.
+
+        """
+        self.clearQueue()
+        if self.source != None:
+            self.source.stop()
+            self.source = None
+
+    def finishPlaying(self):
+        self.clearQueue()
+        if self.source != None:
+            self.source.stop()
+        self.source = None
+        self.is_playing = False
+        if self.play_finished != None and not self.play_finished.done():
+            self.play_finished.set_result(None)
+
+    def send_packet(self, data : bytes):
+        """
+        Encrypts and sends a single frame of Opus audio with the negotiated encryption mode. The RTP
+        header is packed into a buffer that is reused for every packet, and the frame can be any buffer,
+        such as a memoryview from the Ogg demuxer, so neither is copied before it is encrypted.
+
+        """
+        RTP_HEADER.pack_into(self.header, 0, 0x80, 0x78, self.sequence, self.timestamp, self.ssrc)
+        self.transport.sendto(self.encryption.encrypt(self.header, data))
+
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.timestamp = (self.timestamp + 960) & 0xFFFFFFFF
+        self.packets_sent += 1
+
+    async def send_audio_packet(self, data : bytes):
+
+        await self.session_description_received
+
+        self.send_packet(data)
 
     async def send_silence_packet(self):
-        # TODO: Encrypt audio data with PyNaCl
-        while self.secret_key == None:
-            await asyncio.sleep(0)
-
-        header = bytearray(b'\x80\x78')
-        header.extend(int(self.sequence).to_bytes(2, byteorder="big"))
-        header.extend(int(self.timestamp).to_bytes(4, byteorder="big"))
-        header.extend(int(self.ssrc).to_bytes(4, byteorder="big"))
-
-        nonce = bytearray(24)
-        nonce[:12] = header
-
-        box = nacl.secret.SecretBox(bytes(self.secret_key))
-        encrypted_data = box.encrypt(bytes(bytearray(b'\xF8\xFF\xFE')), bytes(nonce)).ciphertext
-
-        # TODO: Craft the packet to be sent
-        packet = bytearray()
-        packet.extend(header)
-        packet.extend(encrypted_data)
-
-        # TODO: Send the packet
-        result = self.sock.send(packet)
-        self.logger.debug(f"Sent silence voice packet of {result} bytes")
-
-        self.sequence += 1
-        self.timestamp += 960
-        if self.sequence >= 2 ** 16: self.sequence = 0
-        if self.timestamp >= 2 ** 32: self.timestamp = 0
-        pass
+
+        await self.session_description_received
+
+        self.send_packet(SILENCE_FRAME)
 
     async def play(self, source: FFmpegHandler):
         loop = asyncio.get_running_loop()
         loop.create_task(self.do_play(source))
         await asyncio.sleep(1)
 
+    async def disconnect(self):
+        """
+        Stops playing, leaves the voice channel and closes the voice connection.
+
+        """
+        self.disconnecting = True
+        self.stop()
+        if self.play_finished != None:
+            self.client.getVoiceScheduler().remove(self)
+            self.finishPlaying()
+        if self.heartbeat_task != None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        if self.voice_ws != None:
+            await self.voice_ws.close()
+        if self.transport != None:
+            self.transport.close()
+        self.receiver.close()
+        self.ready = False
+        if not self.session_description_received.done():
+            # Audio waiting for the connection will never be played.
+            self.session_description_received.cancel()
+        if self.client.voice_clients.get(self.guild_id) is self:
+            del self.client.voice_clients[self.guild_id]
+        await self.client.ws.send_json({"op": 4, "d": {"guild_id": self.guild_id, "channel_id": None, "self_mute": False, "self_deaf": False}})
+
     async def start_speaking(self):
 
         speaking_payload = {
@@ -0,0 +1,226 @@
+# The encryption modes supported for sending voice packets.
+import struct
+import nacl.bindings
+import nacl.exceptions
+from nacl._sodium import ffi, lib
+
+from typing import (
+    Dict,
+    List
+)
+
+COUNTER = struct.Struct(">I")
+# The length of the authentication tag added by every mode.
+TAG_LENGTH = 16
+
+class VoiceEncryptionMode():
+    """
+    The base class for voice encryption modes. Each mode takes the RTP header and the Opus
+    frame of a packet and returns the packet to be sent to the voice server, and decrypts the
+    packets received from it.
+
+    Packets are encrypted with libsodium through PyNaCl's own bindings, as PyNaCl's functions only
+    accept bytes. This lets each mode keep one nonce buffer for every packet, and encrypt straight
+    into the packet instead of joining its parts afterwards.
+
+    """
+
+    name : str = None
+    key : bytes = None
+    # Whether the RTP header extension is outside the encrypted part of the packet.
+    rtpsize : bool = False
+    nonce_length : int = 24
+    # The amount of bytes appended to the packet after the encrypted frame.
+    suffix_length : int = 0
+
+    def __init__(self, key : bytes) -> None:
+        self.key = key
+        self.nonce = bytearray(self.nonce_length)
+        self.nonce_pointer = ffi.from_buffer(self.nonce)
+
+    def createPacket(self, header, data):
+        # Returns the packet with the header copied in, a pointer to it, and the frame as something
+        # libsodium accepts. Frames from the Ogg demuxer and the Opus cache are memoryviews.
+        packet = bytearray(len(header) + len(data) + TAG_LENGTH + self.suffix_length)
+        packet[:len(header)] = header
+        if type(data) is not bytes:
+            data = ffi.from_buffer(data)
+        return packet, ffi.from_buffer(packet), data
+
+    @staticmethod
+    def ensure(result : int):
+        if result != 0:
+            raise nacl.exceptions.CryptoError("Encrypting a voice packet failed.")
+
+    def encrypt(self, header, data) -> bytearray:
+        pass
+
+    def decrypt(self, packet : bytes, header_length : int) -> bytes:
+        """
+        Decrypts a received packet, where the first `header_length` bytes are not encrypted.
+
+        Raises
+        -------
+        nacl.exceptions.CryptoError
+            Raised if the packet could not be decrypted.
+
+        """
+        pass
+
+class XSalsa20Poly1305(VoiceEncryptionMode):
+    """
+    The original mode, where the RTP header padded with zeroes is used as the nonce.
+
+    """
+
+    name = "xsalsa20_poly1305"
+    padding : bytes = bytes(12)
+
+    def encrypt(self, header, data) -> bytearray:
+        # The rest of the nonce buffer stays zeroed.
+        self.nonce[:len(header)] = header
+        packet, pointer, data = self.createPacket(header, data)
+        self.ensure(lib.crypto_secretbox_easy(pointer + len(header), data, len(data), self.nonce_pointer, self.key))
+        return packet
+
+    def decrypt(self, packet : bytes, header_length : int) -> bytes:
+        return nacl.bindings.crypto_secretbox_open_easy(packet[header_length:], packet[:12] + self.padding, self.key)
+
+class XSalsa20Poly1305Suffix(VoiceEncryptionMode):
+    """
+    A random 24 byte nonce is used for each packet and appended to the packet.
+
+    """
+
+    name = "xsalsa20_poly1305_suffix"
+    suffix_length = 24
+
+    def encrypt(self, header, data) -> bytearray:
+        lib.randombytes(self.nonce_pointer, self.nonce_length)
+        packet, pointer, data = self.createPacket(header, data)
+        self.ensure(lib.crypto_secretbox_easy(pointer + len(header), data, len(data), self.nonce_pointer, self.key))
+        packet[-self.nonce_length:] = self.nonce
+        return packet
+
+    def decrypt(self, packet : bytes, header_length : int) -> bytes:
+        return nacl.bindings.crypto_secretbox_open_easy(packet[header_length:-24], packet[-24:], self.key)
+
+class XSalsa20Poly1305Lite(VoiceEncryptionMode):
+    """
+    An incrementing 32 bit nonce is padded to 24 bytes, and the 4 byte counter is appended to
+    the packet.
+
+    """
+
+    name = "xsalsa20_poly1305_lite"
+    counter : int = 0
+    suffix_length = 4
+
+    def __init__(self, key : bytes) -> None:
+        super().__init__(key)
+        self.counter = 0
+
+    def packCounter(self, packet : bytearray):
+        # Packs the counter into the start of the nonce buffer and the end of the packet.
+        COUNTER.pack_into(self.nonce, 0, self.counter)
+        COUNTER.pack_into(packet, len(packet) - 4, self.counter)
+        self.counter = (self.counter + 1) & 0xFFFFFFFF
+
+    def receivedNonce(self, packet : bytes) -> bytes:
+        # The counter appended to a received packet, padded to the length of the nonce.
+        return packet[-4:] + bytes(self.nonce_length - 4)
+
+    def encrypt(self, header, data) -> bytearray:
+        packet, pointer, data = self.createPacket(header, data)
+        self.packCounter(packet)
+        self.ensure(lib.crypto_secretbox_easy(pointer + len(header), data, len(data), self.nonce_pointer, self.key))
+        return packet
+
+    def decrypt(self, packet : bytes, header_length : int) -> bytes:
+        return nacl.bindings.crypto_secretbox_open_easy(packet[header_length:-4], self.receivedNonce(packet), self.key)
+
+class AEADXChaCha20Poly1305RTPSize(XSalsa20Poly1305Lite):
+    """
+    XChaCha20-Poly1305 with the RTP header as additional data. Like the lite mode, an
+    incrementing 32 bit nonce is padded to 24 bytes and appended to the packet.
+
+    """
+
+    name = "aead_xchacha20_poly1305_rtpsize"
+    rtpsize = True
+
+    def encrypt(self, header, data) -> bytearray:
+        packet, pointer, data = self.createPacket(header, data)
+        self.packCounter(packet)
+        # The header already copied to the start of the packet is the additional data.
+        self.ensure(lib.crypto_aead_xchacha20poly1305_ietf_encrypt(pointer + len(header), ffi.NULL, data, len(data),
+            pointer, len(header), ffi.NULL, self.nonce_pointer, self.key))
+        return packet
+
+    def decrypt(self, packet : bytes, header_length : int) -> bytes:
+        return nacl.bindings.crypto_aead_xchacha20poly1305_ietf_decrypt(packet[header_length:-4], packet[:header_length], self.receivedNonce(packet), self.key)
+
+class AEADAES256GCMRTPSize(XSalsa20Poly1305Lite):
+    """
+    AES-256-GCM with the RTP header as additional data. An incrementing 32 bit nonce is padded
+    to 12 bytes and appended to the packet. This uses AES-NI (or the ARM crypto extensions),
+    so it is only offered when the CPU supports it.
+
+    """
+
+    name = "aead_aes256_gcm_rtpsize"
+    nonce_length : int = 12
+    rtpsize = True
+
+    def encrypt(self, header, data) -> bytearray:
+        packet, pointer, data = self.createPacket(header, data)
+        self.packCounter(packet)
+        self.ensure(lib.crypto_aead_aes256gcm_encrypt(pointer + len(header), ffi.NULL, data, len(data),
+            pointer, len(header), ffi.NULL, self.nonce_pointer, self.key))
+        return packet
+
+    def decrypt(self, packet : bytes, header_length : int) -> bytes:
+        return nacl.bindings.crypto_aead_aes256gcm_decrypt(packet[header_length:-4], packet[:header_length], self.receivedNonce(packet), self.key)
+
+def aesGCMAvailable() -> bool:
+    """
+    Returns whether AES-256-GCM can be used. Older versions of PyNaCl do not include it, and
+    libsodium only supports it with hardware acceleration.
+
+    """
+    if not hasattr(nacl.bindings, "crypto_aead_aes256gcm_encrypt"):
+        return False
+    try:
+        nacl.bindings.crypto_aead_aes256gcm_encrypt(b"", None, bytes(12), bytes(32))
+    except nacl.exceptions.UnavailableError:
+        return False
+    return True
+
+ENCRYPTION_MODES : Dict[str, type] = {
+    mode.name: mode for mode in (AEADAES256GCMRTPSize, AEADXChaCha20Poly1305RTPSize, XSalsa20Poly1305Lite, XSalsa20Poly1305Suffix, XSalsa20Poly1305)
+}
+
+# The modes we support, from most to least preferred.
+PREFERRED_MODES : List[str] = [
+    "aead_xchacha20_poly1305_rtpsize",
+    "xsalsa20_poly1305_lite",
+    "xsalsa20_poly1305_suffix",
+    "xsalsa20_poly1305",
+]
+if aesGCMAvailable():
+    PREFERRED_MODES.insert(0, "aead_aes256_gcm_rtpsize")
+
+def selectEncryptionMode(modes : List[str]) -> str:
+    """
+    Picks the best mode we support from the modes offered by the voice server.
+
+    Raises
+    -------
+    ValueError
+        Raised if none of the offered modes are supported.
+
+    """
+    for mode in PREFERRED_MODES:
+        if mode in modes:
+            return mode
+    raise ValueError(f"None of the voice encryption modes offered are supported: {modes}")
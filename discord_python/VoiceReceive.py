@@ -0,0 +1,277 @@
+# Receives, decrypts and reorders the audio sent by other users in a voice channel.
+import asyncio
+import logging
+import struct
+
+from typing import (
+    Dict,
+    List
+)
+
+import nacl.exceptions
+
+from .Opus import OpusDecoder
+
+# Version and flags, marker and payload type, sequence, timestamp and SSRC.
+RTP_HEADER = struct.Struct(">BBHII")
+# The profile and length (in 32 bit words) of an RTP header extension.
+RTP_EXTENSION = struct.Struct(">HH")
+OPUS_PAYLOAD_TYPE = 0x78
+
+class VoicePacket():
+    """
+    A packet of audio received from a user.
+
+    Attributes
+    -------
+    user_id: `str`
+        The user that sent the audio, or None if they have not been seen speaking yet.
+    opus: `bytes`
+        The Opus frame, or None if the packet was lost.
+    pcm: `bytes`
+        The decoded audio, if the sink decodes audio. Lost packets are concealed by the decoder.
+
+    """
+
+    ssrc : int = None
+    user_id : str = None
+    sequence : int = 0
+    timestamp : int = 0
+    opus : bytes = None
+    pcm : bytes = None
+
+    def __init__(self, ssrc : int, sequence : int, timestamp : int, opus : bytes, user_id : str = None) -> None:
+        self.ssrc = ssrc
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.opus = opus
+        self.user_id = user_id
+
+def parseRTP(packet : bytes, encryption) -> VoicePacket:
+    """
+    Parses and decrypts a received RTP packet. Returns None for anything that is not Opus audio,
+    such as RTCP packets.
+
+    Raises
+    -------
+    nacl.exceptions.CryptoError
+        Raised if the packet could not be decrypted.
+
+    """
+    if len(packet) < 12:
+        return None
+    flags, payload_type, sequence, timestamp, ssrc = RTP_HEADER.unpack_from(packet)
+    if payload_type & 0x7F != OPUS_PAYLOAD_TYPE:
+        return None
+
+    header_length = 12 + (flags & 0x0F) * 4
+    has_extension = flags & 0x10
+    if encryption.rtpsize:
+        extension_words = 0
+        if has_extension:
+            # The extension header is sent unencrypted, but the extension itself is encrypted.
+            _, extension_words = RTP_EXTENSION.unpack_from(packet, header_length)
+            header_length += 4
+        data = encryption.decrypt(packet, header_length)
+        skip = extension_words * 4
+    else:
+        # Older modes encrypt everything after the fixed header, including any extension.
+        data = encryption.decrypt(packet, 12)
+        skip = (flags & 0x0F) * 4
+        if has_extension:
+            _, extension_words = RTP_EXTENSION.unpack_from(data, skip)
+            skip += 4 + extension_words * 4
+
+    return VoicePacket(ssrc, sequence, timestamp, data[skip:] if skip else data)
+
+class JitterBuffer():
+    """
+    Puts the packets from a single SSRC back in order. Packets are held until the packets before
+    them arrive, up to `max_delay` packets, after which the missing packets are treated as lost.
+
+    """
+
+    max_delay : int = 5
+    next_sequence : int = None
+    packets : Dict[int, VoicePacket] = None
+
+    received : int = 0
+    lost : int = 0
+    late : int = 0
+
+    def __init__(self, max_delay : int = 5) -> None:
+        self.max_delay = max_delay
+        self.packets = {}
+        self.next_sequence = None
+
+    def push(self, packet : VoicePacket) -> List[VoicePacket]:
+        """
+        Adds a packet, and returns the packets that are now ready in order. A lost packet is
+        returned as a `VoicePacket` without any audio.
+
+        """
+        self.received += 1
+        if self.next_sequence == None:
+            self.next_sequence = packet.sequence
+        # The difference from the expected sequence, allowing for the 16 bit sequence wrapping.
+        if (packet.sequence - self.next_sequence) & 0xFFFF >= 0x8000:
+            # Arrived after it was already treated as lost, or was a duplicate.
+            self.late += 1
+            return []
+        self.packets[packet.sequence] = packet
+
+        ready = []
+        while True:
+            next_packet = self.packets.pop(self.next_sequence, None)
+            if next_packet != None:
+                ready.append(next_packet)
+            elif len(self.packets) > self.max_delay:
+                self.lost += 1
+                ready.append(VoicePacket(packet.ssrc, self.next_sequence, None, None, packet.user_id))
+            else:
+                break
+            self.next_sequence = (self.next_sequence + 1) & 0xFFFF
+        return ready
+
+    def flush(self) -> List[VoicePacket]:
+        """
+        Returns every packet still held in order, such as when the user stops speaking.
+
+        """
+        ready = []
+        while self.packets:
+            next_packet = self.packets.pop(self.next_sequence, None)
+            if next_packet != None:
+                ready.append(next_packet)
+            self.next_sequence = (self.next_sequence + 1) & 0xFFFF
+        # Start again from whichever packet arrives next.
+        self.next_sequence = None
+        return ready
+
+class AudioSink():
+    """
+    An async iterator of the `VoicePacket`s received in a voice channel. Packets are buffered up to
+    `queue_size`, after which the oldest packets are dropped so a slow consumer never holds up
+    receiving.
+
+    """
+
+    decode : bool = False
+    queue : asyncio.Queue = None
+    dropped : int = 0
+    closed : bool = False
+
+    def __init__(self, decode : bool = False, queue_size : int = 500) -> None:
+        self.decode = decode
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, packet : VoicePacket):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(packet)
+
+    def close(self):
+        """
+        Stops the iterator once the packets already received have been read.
+
+        """
+        self.closed = True
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> VoicePacket:
+        packet = await self.queue.get()
+        if packet == None:
+            raise StopAsyncIteration
+        return packet
+
+class VoiceReceiver():
+    """
+    Handles the packets received by a `VoiceClient`. Packets are decrypted, put in order by a
+    jitter buffer for each SSRC, matched to users from speaking events, and given to every sink.
+
+    """
+
+    sinks : List[AudioSink] = []
+    users : Dict[int, str] = None
+    buffers : Dict[int, JitterBuffer] = None
+    decoders : Dict[int, OpusDecoder] = None
+    max_delay : int = 5
+    errors : int = 0
+
+    def __init__(self, max_delay : int = 5) -> None:
+        self.logger = logging.getLogger("Logging")
+        self.sinks = []
+        self.users = {}
+        self.buffers = {}
+        self.decoders = {}
+        self.max_delay = max_delay
+        self.errors = 0
+
+    def addSink(self, sink : AudioSink):
+        self.sinks.append(sink)
+
+    def removeSink(self, sink : AudioSink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+        sink.close()
+
+    def setSpeaking(self, ssrc : int, user_id : str, speaking : bool):
+        """
+        Called for speaking events, which give the user of each SSRC.
+
+        """
+        self.users[ssrc] = user_id
+        if not speaking and ssrc in self.buffers:
+            self.deliver(self.buffers[ssrc].flush())
+
+    def removeUser(self, user_id : str):
+        """
+        Called when a user leaves the channel, so their state is not kept.
+
+        """
+        for ssrc, user in list(self.users.items()):
+            if user == user_id:
+                del self.users[ssrc]
+                self.buffers.pop(ssrc, None)
+                self.decoders.pop(ssrc, None)
+
+    def receive(self, data : bytes, encryption):
+        if not self.sinks or encryption == None:
+            return
+        try:
+            packet = parseRTP(data, encryption)
+        except (nacl.exceptions.CryptoError, struct.error, ValueError) as e:
+            self.errors += 1
+            self.logger.debug(f"Dropped a voice packet that could not be read: {e!r}")
+            return
+        if packet == None:
+            return
+        packet.user_id = self.users.get(packet.ssrc)
+
+        buffer = self.buffers.get(packet.ssrc)
+        if buffer == None:
+            buffer = self.buffers[packet.ssrc] = JitterBuffer(self.max_delay)
+        self.deliver(buffer.push(packet))
+
+    def deliver(self, packets : List[VoicePacket]):
+        for packet in packets:
+            if any(sink.decode for sink in self.sinks):
+                decoder = self.decoders.get(packet.ssrc)
+                if decoder == None:
+                    decoder = self.decoders[packet.ssrc] = OpusDecoder()
+                packet.pcm = decoder.decode(packet.opus)
+            for sink in self.sinks:
+                sink.put(packet)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
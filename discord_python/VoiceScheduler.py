@@ -0,0 +1,112 @@
+# Paces the audio of every voice connection from a single timer.
+import asyncio
+import logging
+import time
+
+from typing import (
+    List
+)
+
+class VoiceScheduler():
+    """
+    Sends the next frame of audio for every playing voice connection once every 20ms. All connections
+    share one timer measured against a monotonic clock, so the cost of each extra stream is only
+    the work of sending its packet, and timing errors do not build up over time.
+
+    """
+
+    FRAME_LENGTH : float = 0.02
+
+    voice_clients : List = []
+    logger : logging.Logger = None
+    task : asyncio.Task = None
+    max_catchup_frames : int = 5
+    socket_pool = None
+
+    ticks : int = 0
+    late_ticks : int = 0
+    skipped_ticks : int = 0
+
+    def __init__(self, logger : logging.Logger, max_catchup_frames : int = 5, socket_pool = None) -> None:
+        """
+        Creates a voice scheduler. This is created by the `Client` when the first audio is played.
+
+        Parameters
+        -------
+        logger: `logging.Logger`
+            The logger used to report problems with sending audio.
+        max_catchup_frames: `int`
+            If the event loop was blocked, up to this many frames are sent at once for each connection
+            to catch up. If it fell further behind than this, the missed frames are skipped instead.
+        socket_pool: `VoiceSocketPool`
+            If given, the packets of every connection are collected during each tick and sent together
+            at the end of it.
+
+        """
+        self.voice_clients = []
+        self.logger = logger
+        self.max_catchup_frames = max_catchup_frames
+        self.socket_pool = socket_pool
+
+    def add(self, voice_client) -> None:
+        """
+        Starts sending frames for a voice connection from the next tick onwards.
+
+        """
+        if voice_client not in self.voice_clients:
+            self.voice_clients.append(voice_client)
+        if self.task == None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def remove(self, voice_client) -> None:
+        """
+        Stops sending frames for a voice connection.
+
+        """
+        if voice_client in self.voice_clients:
+            self.voice_clients.remove(voice_client)
+
+    def tick(self) -> None:
+        """
+        Sends one frame for every voice connection.
+
+        """
+        self.ticks += 1
+        if self.socket_pool != None:
+            self.socket_pool.startBatch()
+        try:
+            for voice_client in self.voice_clients[:]:
+                try:
+                    voice_client.sendNextFrame()
+                except Exception as e:
+                    self.logger.error(f"Stopped playing audio in guild {voice_client.guild_id}: {e!r}")
+                    self.remove(voice_client)
+                    voice_client.finishPlaying()
+        finally:
+            if self.socket_pool != None:
+                self.socket_pool.flush()
+
+    async def run(self):
+        """
+        Runs the timer while any voice connection is playing audio.
+
+        """
+        next_tick = time.monotonic()
+        while self.voice_clients:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # Work out how many ticks are due, in case the event loop was blocked.
+            due = int((time.monotonic() - next_tick) / self.FRAME_LENGTH) + 1
+            if due > 1:
+                self.late_ticks += 1
+            if due > self.max_catchup_frames:
+                self.logger.warning(f"Voice scheduler fell {due} frames behind, skipping {due - 1} frames.")
+                self.skipped_ticks += due - 1
+                next_tick += (due - 1) * self.FRAME_LENGTH
+                due = 1
+
+            for _ in range(due):
+                self.tick()
+            next_tick += due * self.FRAME_LENGTH
@@ -0,0 +1,230 @@
+# Sends the voice packets of many connections with as few system calls as possible.
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import socket
+import struct
+import sys
+
+from typing import (
+    Dict,
+    List,
+    Tuple
+)
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+libc = None
+if sys.platform.startswith("linux"):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        libc.sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        libc = None
+
+def sendmmsgAvailable() -> bool:
+    """
+    Returns whether packets can be sent in batches with `sendmmsg`, which is only available on Linux.
+
+    """
+    return libc != None
+
+def packSockaddr(ip : str, port : int) -> ctypes.Array:
+    # A sockaddr_in for an IPv4 address. The family is in native byte order, the port in network order.
+    return ctypes.create_string_buffer(struct.pack("=H", socket.AF_INET) + struct.pack(">H", port) + socket.inet_aton(ip) + bytes(8), 16)
+
+class SharedVoiceTransport():
+    """
+    Stands in for the datagram transport of one voice connection on a `SharedVoiceSocket`. Packets sent
+    while the socket is batching are held until the end of the scheduler tick.
+
+    """
+
+    shared = None
+    address : Tuple[str, int] = None
+    sockaddr : ctypes.Array = None
+    protocol : asyncio.DatagramProtocol = None
+
+    def __init__(self, shared, address : Tuple[str, int], protocol : asyncio.DatagramProtocol) -> None:
+        self.shared = shared
+        self.address = address
+        self.protocol = protocol
+        try:
+            self.sockaddr = packSockaddr(*address)
+        except OSError:
+            # Not an IPv4 address, so these packets are always sent one at a time.
+            self.sockaddr = None
+
+    def sendto(self, data, address = None):
+        if self.shared.batching and self.sockaddr != None:
+            self.shared.pending.append((data, self.sockaddr, self.address))
+        else:
+            self.shared.transport.sendto(data, self.address)
+
+    def get_extra_info(self, name, default = None):
+        return self.shared.transport.get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self.shared.transport.is_closing()
+
+    def close(self):
+        self.shared.disconnect(self)
+
+class SharedVoiceSocket(asyncio.DatagramProtocol):
+    """
+    A single UDP socket used by many voice connections. Received packets are routed to each connection
+    by the address of its voice server, so each socket only has one connection per voice server. During
+    a scheduler tick, the packets of every connection are collected and sent with one `sendmmsg` call.
+
+    """
+
+    transport : asyncio.DatagramTransport = None
+    connections : Dict[Tuple[str, int], SharedVoiceTransport] = None
+    pending : List = None
+    batching : bool = False
+    capacity : int = 0
+
+    batches : int = 0
+    batched_packets : int = 0
+    fallback_packets : int = 0
+
+    def __init__(self) -> None:
+        self.connections = {}
+        self.pending = []
+        self.logger = logging.getLogger("Logging")
+        self.capacity = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        connection = self.connections.get(addr[:2])
+        if connection != None:
+            connection.protocol.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        self.logger.warning(f"Shared voice UDP error: {exc}")
+
+    def connect(self, address : Tuple[str, int], protocol : asyncio.DatagramProtocol) -> SharedVoiceTransport:
+        transport = SharedVoiceTransport(self, address, protocol)
+        self.connections[address] = transport
+        protocol.connection_made(transport)
+        return transport
+
+    def disconnect(self, transport : SharedVoiceTransport):
+        if self.connections.get(transport.address) is transport:
+            del self.connections[transport.address]
+            transport.protocol.connection_lost(None)
+
+    def grow(self, count : int):
+        # The message headers are allocated once and reused, and only grown when more packets are sent.
+        self.capacity = max(count, self.capacity * 2)
+        self.messages = (mmsghdr * self.capacity)()
+        self.vectors = (iovec * self.capacity)()
+        for index in range(self.capacity):
+            header = self.messages[index].msg_hdr
+            header.msg_iov = ctypes.pointer(self.vectors[index])
+            header.msg_iovlen = 1
+            header.msg_namelen = 16
+
+    def flush(self):
+        """
+        Sends every packet collected during the tick.
+
+        """
+        self.batching = False
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        if self.transport.is_closing():
+            return
+
+        sent = 0
+        if libc != None and not self.transport.get_write_buffer_size():
+            count = len(pending)
+            if count > self.capacity:
+                self.grow(count)
+            messages = self.messages
+            vectors = self.vectors
+            for index, (data, sockaddr, _) in enumerate(pending):
+                # Points at the internal buffer of the packet, which stays alive in `pending`.
+                if type(data) is bytes:
+                    vectors[index].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+                elif type(data) is bytearray:
+                    # Packets from the encryption modes, which are not resized once sent.
+                    vectors[index].iov_base = ctypes.addressof((ctypes.c_char * len(data)).from_buffer(data))
+                else:
+                    data = bytes(data)
+                    pending[index] = (data, sockaddr, None)
+                    vectors[index].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+                vectors[index].iov_len = len(data)
+                messages[index].msg_hdr.msg_name = ctypes.addressof(sockaddr)
+            fileno = self.transport.get_extra_info("socket").fileno()
+            address = ctypes.addressof(messages)
+            while sent < count:
+                result = libc.sendmmsg(fileno, address + sent * ctypes.sizeof(mmsghdr), count - sent, 0)
+                if result <= 0:
+                    error = ctypes.get_errno()
+                    if error != 0:
+                        self.logger.debug(f"sendmmsg failed: {os.strerror(error)}")
+                    break
+                sent += result
+            self.batches += 1
+            self.batched_packets += sent
+
+        # Anything that could not be sent in the batch goes through the transport, which buffers it.
+        for data, _, address in pending[sent:]:
+            self.transport.sendto(data, address)
+            self.fallback_packets += 1
+
+class VoiceSocketPool():
+    """
+    The shared sockets of a client's voice connections. A new socket is only opened when every
+    existing socket already has a connection to the same voice server address.
+
+    """
+
+    sockets : List[SharedVoiceSocket] = []
+
+    def __init__(self) -> None:
+        self.sockets = []
+
+    async def connect(self, address : Tuple[str, int], protocol : asyncio.DatagramProtocol) -> SharedVoiceTransport:
+        """
+        Connects a voice connection's protocol to a voice server through a shared socket.
+
+        """
+        for shared in self.sockets:
+            if address not in shared.connections:
+                return shared.connect(address, protocol)
+        family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+        _, shared = await asyncio.get_running_loop().create_datagram_endpoint(SharedVoiceSocket, family=family)
+        self.sockets.append(shared)
+        return shared.connect(address, protocol)
+
+    def startBatch(self):
+        for shared in self.sockets:
+            shared.batching = True
+
+    def flush(self):
+        for shared in self.sockets:
+            shared.flush()
@@ -5,4 +5,19 @@ from .InteractionResponder import *
 from .Logger import *
 from .Message import *
 from .EmbedBuilder import *
-from .Voice import *
\ No newline at end of file
+from .Voice import *
+from .VoiceEncryption import *
+from .VoiceScheduler import *
+from .Autocomplete import *
+from .Templates import *
+from .InteractionServer import *
+from .Attachments import *
+from .OpusCache import *
+from .Opus import *
+from .AudioMixer import *
+from .VoiceReceive import *
+from .FFmpegPool import *
+from .VoiceUDP import *
+from .MockDiscord import *
+from .GatewayRecorder import *
+from .Metrics import *